@@ -0,0 +1,132 @@
+import random
+import struct
+import numpy as np
+
+try:
+    import opuslib
+except ImportError:
+    opuslib = None
+
+
+class MulawEncoder:
+    # G.711 mu-law: 8 bits per sample, half the bytes of linear16.
+    name = "mulaw"
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+
+    def url_params(self):
+        return f"encoding=mulaw&sample_rate={self.sample_rate}"
+
+    def encode(self, pcm):
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.int32) >> 2
+        mask = np.where(samples < 0, 0x7F, 0xFF)
+        magnitude = np.minimum(np.abs(samples), 8159) + 0x21
+        segment = np.floor(np.log2(magnitude)).astype(np.int32) - 5
+        ulaw = np.where(segment >= 8, 0x7F, (segment << 4) | ((magnitude >> (segment + 1)) & 0x0F))
+        return (ulaw ^ mask).astype(np.uint8).tobytes()
+
+    def flush(self):
+        return b""
+
+
+def _ogg_crc_table():
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+OGG_CRC_TABLE = _ogg_crc_table()
+
+
+def ogg_crc(data):
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ OGG_CRC_TABLE[((crc >> 24) & 0xFF) ^ byte]
+    return crc
+
+
+class OggOpusEncoder:
+    # Opus in an Ogg container. Deepgram reads the format from the stream
+    # header, so no encoding or sample_rate parameters are sent.
+    name = "opus"
+    frame_ms = 20
+    pre_skip = 312
+
+    def __init__(self, sample_rate, bitrate=16000):
+        if opuslib is None:
+            raise RuntimeError("The opuslib package is not installed. Run 'pip install opuslib'.")
+        self.sample_rate = sample_rate
+        self.frame_samples = sample_rate * self.frame_ms // 1000
+        self.encoder = opuslib.Encoder(sample_rate, 1, opuslib.APPLICATION_VOIP)
+        self.encoder.bitrate = bitrate
+        self.serial = random.getrandbits(32)
+        self.page_sequence = 0
+        self.granule = 0
+        self.pending = b""
+        self.headers_sent = False
+
+    def url_params(self):
+        return ""
+
+    def encode(self, pcm):
+        output = b""
+        if not self.headers_sent:
+            output += self.header_pages()
+            self.headers_sent = True
+
+        self.pending += pcm
+        frame_bytes = self.frame_samples * 2
+        packets = []
+        while len(self.pending) >= frame_bytes:
+            frame, self.pending = self.pending[:frame_bytes], self.pending[frame_bytes:]
+            packets.append(self.encoder.encode(frame, self.frame_samples))
+            # Ogg Opus granule positions are always counted at 48 kHz.
+            self.granule += self.frame_samples * 48000 // self.sample_rate
+        if packets:
+            output += self.page(packets, self.granule)
+        return output
+
+    def flush(self):
+        packets = []
+        if self.pending:
+            frame = self.pending.ljust(self.frame_samples * 2, b"\0")
+            packets.append(self.encoder.encode(frame, self.frame_samples))
+            self.granule += len(self.pending) // 2 * 48000 // self.sample_rate
+            self.pending = b""
+        return self.page(packets, self.granule, header_type=0x04)
+
+    def header_pages(self):
+        opus_head = b"OpusHead" + struct.pack("<BBHIhB", 1, 1, self.pre_skip, self.sample_rate, 0, 0)
+        vendor = b"claude-cli"
+        opus_tags = b"OpusTags" + struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", 0)
+        return self.page([opus_head], 0, header_type=0x02) + self.page([opus_tags], 0)
+
+    def page(self, packets, granule, header_type=0x00):
+        lacing = b""
+        for packet in packets:
+            lacing += b"\xff" * (len(packet) // 255) + bytes([len(packet) % 255])
+        header = struct.pack("<4sBBqIIIB", b"OggS", 0, header_type, granule, self.serial,
+                             self.page_sequence, 0, len(lacing))
+        page = bytearray(header + lacing + b"".join(packets))
+        struct.pack_into("<I", page, 22, ogg_crc(page))
+        self.page_sequence += 1
+        return bytes(page)
+
+
+ENCODERS = {
+    "mulaw": MulawEncoder,
+    "opus": OggOpusEncoder,
+}
+
+
+def create_encoder(encoding, sample_rate):
+    if encoding == "linear16":
+        return None
+    if encoding not in ENCODERS:
+        raise ValueError(f"Unsupported STT encoding '{encoding}'")
+    return ENCODERS[encoding](sample_rate)
@@ -1,25 +1,146 @@
 import os
+import asyncio
 import threading
-from queue import Queue
+from queue import Queue, Full
 import logging
 import tempfile
 import uuid
+import time
+from collections import deque
 from dotenv import load_dotenv
 from colorama import init, Fore, Style
 from botocore.exceptions import BotoCoreError, ClientError
 import pygame
+from tts_backends import PollyTTSBackend, LocalTTSBackend, TTSRouter, PollyEngineSelector
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+import session_trace
+import event_bus
+import metrics
+
+FIRST_AUDIO_SECONDS = metrics.registry.histogram("claude_cli_time_to_first_audio_seconds", "Time from sending a turn to the start of its first speech")
+FAST_FAILURES = metrics.registry.counter("claude_cli_circuit_rejections_total", "Requests failed fast by an open circuit, by service")
 
 class AudioManager:
-    def __init__(self, config_manager, polly_client):
+    def __init__(self, config_manager, polly_client, usage_manager=None):
         self.config_manager = config_manager
         self.polly_client = polly_client
-        self.audio_queue = Queue()
+        self.usage_manager = usage_manager
+        self.audio_queue = Queue(self.get_audio_queue_limit())
         self.audio_thread = threading.Thread(target=self.audio_player_thread, daemon=True)
         self.audio_thread.start()
         self.aws_polly_voice = self.config_manager.get_aws_polly_voice()
         self.aws_polly_engine = self.config_manager.get_aws_polly_engine()
+        # Kept across router rebuilds so a config change does not reset an outage.
+        self.polly_breaker = CircuitBreaker("Polly", on_state_change=self.on_breaker_change,
+                                            **self.config_manager.get_circuit_settings())
+        self.engine_selector = PollyEngineSelector(self.aws_polly_engine, self.config_manager.get_tts_polly_fast_engines(),
+                                                   self.config_manager.get_tts_polly_lead_ms())
+        # Queued speech is estimated from its length, at a speaking rate
+        # learned from playback, so tiered mode knows how much is buffered.
+        self.buffer_lock = threading.Lock()
+        self.speech_text = {}  # Text of each file not played yet
+        self.queued_seconds = 0.0
+        self.playing_until = 0.0
+        self.chars_per_second = 15.0
+        self.tts_router = self.create_tts_router()
+        self.audio_worker = None  # Set when playback runs in the audio worker process
+        self.turn_started_at = None
+        self.time_to_first_audio = deque(maxlen=50)
+        self.config_manager.subscribe(
+            ["aws_polly_voice", "aws_polly_engine", "tts_backend", "tts_local_command", "tts_polly_p95_budget_ms"],
+            self.on_config_change
+        )
+        self.config_manager.subscribe(["memory_budget_mode", "audio_queue_max_files"], self.on_memory_config_change)
+        self.config_manager.subscribe(["tts_polly_fast_engines", "tts_polly_lead_ms"], self.on_engine_config_change)
+        # Reads the deque without the queue's lock; a depth a moment out of date is fine.
+        metrics.registry.gauge("claude_cli_audio_queue_depth", "Speech files waiting for playback",
+                               lambda: len(self.audio_queue.queue))
+        self.config_manager.subscribe(
+            ["circuit_failure_rate", "circuit_window_seconds", "circuit_min_calls", "circuit_open_seconds"],
+            lambda config, changed: self.polly_breaker.configure(**self.config_manager.get_circuit_settings())
+        )
+
+    def on_breaker_change(self, breaker, previous, state):
+        if self.tts_router.fallback and self.tts_router.mode != "polly":
+            return  # The local engine takes over, so speech carries on
+        if state == CircuitBreaker.OPEN and previous == CircuitBreaker.CLOSED:
+            print(f"{Fore.RED}Speech output is unavailable. Showing text until it recovers.{Style.RESET_ALL}")
+        elif state == CircuitBreaker.CLOSED:
+            print(f"{Fore.MAGENTA}Speech output has recovered.{Style.RESET_ALL}")
+
+    def speech_degraded(self):
+        return self.tts_router.is_degraded()
+
+    def get_audio_queue_limit(self):
+        # 0 means unbounded, as for Queue itself.
+        if self.config_manager.get_memory_budget_mode():
+            return self.config_manager.get_audio_queue_max_files()
+        return 0
+
+    def on_memory_config_change(self, config, changed):
+        with self.audio_queue.mutex:
+            self.audio_queue.maxsize = self.get_audio_queue_limit()
+            self.audio_queue.not_full.notify_all()
+
+    def create_tts_router(self):
+        return TTSRouter(
+            PollyTTSBackend(self.polly_client, self.aws_polly_voice, self.aws_polly_engine),
+            LocalTTSBackend(self.config_manager.get_tts_local_command()),
+            mode=self.config_manager.get_tts_backend(),
+            p95_budget_ms=self.config_manager.get_tts_polly_p95_budget_ms(),
+            breaker=self.polly_breaker,
+            usage_manager=self.usage_manager,
+            engine_selector=self.engine_selector
+        )
+
+    def on_config_change(self, config, changed):
+        self.aws_polly_voice = config.aws_polly_voice
+        self.aws_polly_engine = config.aws_polly_engine
+        if changed & {"tts_backend", "tts_local_command", "tts_polly_p95_budget_ms"}:
+            self.tts_router = self.create_tts_router()
+        else:
+            # Keep the router's latency history; only the Polly voice settings changed.
+            self.tts_router.primary.voice = self.aws_polly_voice
+            self.tts_router.primary.engine = self.aws_polly_engine
+        self.on_engine_config_change(config, changed)
+
+    def on_engine_config_change(self, config, changed):
+        self.engine_selector.configure(config.aws_polly_engine, config.tts_polly_fast_engines, config.tts_polly_lead_ms)
+
+    def select_polly_engine(self, sequence_number):
+        if self.config_manager.get_tts_polly_engine_mode() != "tiered":
+            return None
+        buffered = self.buffered_seconds()
+        engine = self.engine_selector.select(buffered, first_chunk=sequence_number == 0)
+        logging.debug(f"Polly engine {engine} for chunk {sequence_number} ({buffered:.1f} s of speech queued)")
+        return engine
+
+    def buffered_seconds(self):
+        with self.buffer_lock:
+            return max(0.0, self.playing_until - time.monotonic()) + self.queued_seconds
+
+    def note_queued(self, audio_file):
+        with self.buffer_lock:
+            self.queued_seconds += len(self.speech_text.get(audio_file, "")) / self.chars_per_second
+
+    def note_playing(self, audio_file):
+        with self.buffer_lock:
+            text = self.speech_text.pop(audio_file, "")
+            estimate = len(text) / self.chars_per_second
+            self.queued_seconds = max(0.0, self.queued_seconds - estimate)
+            self.playing_until = time.monotonic() + estimate
+        return text
+
+    def note_played(self, chars, seconds):
+        with self.buffer_lock:
+            self.playing_until = 0.0
+            if chars and seconds > 0.5:
+                self.chars_per_second = 0.8 * self.chars_per_second + 0.2 * chars / seconds
 
     def audio_player_thread(self):
+        # Only waits for pygame, whose own mixer thread does the playback, so
+        # it is left at normal priority. Real-time scheduling and underrun
+        # counts for playback need the audio worker.
         logging.info("Audio player thread started")
         while True:
             audio_file = self.audio_queue.get()
@@ -27,39 +148,47 @@ class AudioManager:
                 logging.info("Audio player thread stopping")
                 break
             logging.debug(f"Playing audio file: {audio_file}")
-            pygame.mixer.music.load(audio_file)
-            pygame.mixer.music.play()
-            while pygame.mixer.music.get_busy():
-                pygame.time.Clock().tick(10)
+            if self.turn_started_at is not None:
+                self.record_time_to_first_audio(time.monotonic() - self.turn_started_at)
+            text = self.note_playing(audio_file)
+            event_bus.publish("tts_start", text=text)
+            started = time.monotonic()
+            self.play_file(audio_file)
+            seconds = time.monotonic() - started
+            self.note_played(len(text), seconds)
+            event_bus.publish("tts_end", text=text, seconds=round(seconds, 3))
+            session_trace.record(session_trace.PLAYBACK, {"seconds": round(seconds, 3)})
             os.remove(audio_file)  # Clean up the file after playing
             logging.debug(f"Finished playing and removed audio file: {audio_file}")
             self.audio_queue.task_done()
 
+    def play_file(self, audio_file):
+        if self.audio_worker:
+            try:
+                self.audio_worker.play(audio_file)
+            except RuntimeError as e:
+                logging.error(f"Error playing {audio_file}: {str(e)}")
+            return
+        pygame.mixer.music.load(audio_file)
+        pygame.mixer.music.play()
+        while pygame.mixer.music.get_busy():
+            pygame.time.Clock().tick(10)
+
     async def text_to_speech(self, text, sequence_number):
         try:
             logging.debug(f"Converting text to speech: '{text[:50]}...'")
-            response = self.polly_client.synthesize_speech(
-                Engine=self.aws_polly_engine,
-                LanguageCode='en-US',
-                Text=text,
-                TextType='text',
-                OutputFormat='mp3',
-                VoiceId=self.aws_polly_voice
-            )
-
-            if "AudioStream" in response:
-                file_name = f"speech_{sequence_number}_{uuid.uuid4()}.mp3"
-                file_path = os.path.join(tempfile.gettempdir(), file_name)
-                
-                with open(file_path, 'wb') as file:
-                    file.write(response['AudioStream'].read())
-                
-                logging.debug(f"Speech file created: {file_path}")
-                return file_path
-            else:
-                logging.error("No AudioStream found in the response")
-                return None
+            file_base = os.path.join(tempfile.gettempdir(), f"speech_{sequence_number}_{uuid.uuid4()}")
+            engine = self.select_polly_engine(sequence_number)
+            file_path = await asyncio.get_event_loop().run_in_executor(None, self.tts_router.synthesize, text, file_base, engine)
+            logging.debug(f"Speech file created: {file_path}")
+            with self.buffer_lock:
+                self.speech_text[file_path] = text
+            return file_path
 
+        except CircuitOpenError as error:
+            FAST_FAILURES.inc(service="polly")
+            logging.debug(str(error))
+            return None
         except (BotoCoreError, ClientError) as error:
             logging.error(f"AWS Polly error: {error}")
             return None
@@ -67,9 +196,32 @@ class AudioManager:
             logging.error(f"Unexpected error in text_to_speech: {str(e)}")
             return None
 
+    def start_turn(self):
+        self.turn_started_at = time.monotonic()
+
+    def record_time_to_first_audio(self, elapsed):
+        self.turn_started_at = None
+        FIRST_AUDIO_SECONDS.observe(elapsed)
+        self.time_to_first_audio.append(elapsed)
+        samples = sorted(self.time_to_first_audio)
+        median = samples[len(samples) // 2]
+        logging.info(f"Time to first audio: {elapsed * 1000:.0f} ms (median {median * 1000:.0f} ms over {len(samples)} turns)")
+
     def queue_audio(self, audio_file):
+        self.note_queued(audio_file)
         self.audio_queue.put(audio_file)
 
+    async def queue_audio_with_backpressure(self, audio_file):
+        # When the queue is bounded and full, wait in a worker thread until
+        # playback catches up. The response stream is not read meanwhile, so
+        # no more speech files are created until there is room for them.
+        self.note_queued(audio_file)
+        try:
+            self.audio_queue.put_nowait(audio_file)
+        except Full:
+            logging.debug("Audio queue full. Waiting for playback to catch up.")
+            await asyncio.get_event_loop().run_in_executor(None, self.audio_queue.put, audio_file)
+
     def wait_for_audio_completion(self):
         self.audio_queue.join()
 
@@ -0,0 +1,351 @@
+import os
+import time
+import signal
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from queue import Empty
+import metrics
+from realtime import CallbackTimer, JITTER_BUCKETS, JITTER_SECONDS, XRUNS
+
+PLAYBACK_RATE = 24000  # Polly's neural voices are 24 kHz, so they play without resampling
+
+# Indexes into the shared counters.
+CAPTURE_FRAMES = 0
+CAPTURE_OVERFLOWS = 1
+PLAYBACK_FILES = 2
+PLAYBACK_UNDERRUNS = 3
+COUNTER_NAMES = ["capture_frames", "capture_overflows", "playback_files", "playback_underruns"]
+
+
+class SharedRing:
+    # A single-producer, single-consumer byte ring in shared memory. The
+    # positions are running totals, so the fill level is write - read. The
+    # lock only guards the positions; the copies happen outside it.
+    def __init__(self, context, capacity):
+        self.capacity = capacity
+        self.buffer = context.RawArray("B", capacity)
+        self.positions = context.RawArray("Q", 2)  # Bytes written, bytes read
+        self.lock = context.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("view", None)
+        return state
+
+    def get_view(self):
+        if "view" not in self.__dict__:
+            self.view = memoryview(self.buffer).cast("B")
+        return self.view
+
+    def available(self):
+        with self.lock:
+            return self.positions[0] - self.positions[1]
+
+    def write(self, data, partial=False):
+        # Writes all of data, or with partial as much as fits. Returns the
+        # number of bytes written.
+        with self.lock:
+            written, read = self.positions[0], self.positions[1]
+        size = min(len(data), self.capacity - (written - read))
+        if size < len(data) and not partial:
+            return 0
+        view = self.get_view()
+        start = written % self.capacity
+        first = min(size, self.capacity - start)
+        view[start:start + first] = data[:first]
+        view[:size - first] = data[first:size]
+        with self.lock:
+            self.positions[0] = written + size
+        return size
+
+    def read(self, size):
+        with self.lock:
+            written, read = self.positions[0], self.positions[1]
+        size = min(size, written - read)
+        view = self.get_view()
+        start = read % self.capacity
+        first = min(size, self.capacity - start)
+        data = bytes(view[start:start + first]) + bytes(view[:size - first])
+        with self.lock:
+            self.positions[1] = read + size
+        return data
+
+
+class AudioWorker:
+    # Runs microphone capture and speech playback in a separate process, so
+    # the audio callbacks never wait for the GIL behind the event loop,
+    # response parsing or logging. Captured frames and decoded speech pass
+    # through shared-memory rings; commands and completions go over queues.
+    def __init__(self, sample_rate=16000, chunk_size=1024, ring_seconds=2.0, realtime_priority=0, cpus=()):
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self.frame_bytes = chunk_size * 2
+        context = multiprocessing.get_context("spawn")
+        self.capture_ring = SharedRing(context, int(ring_seconds * sample_rate) * 2 // self.frame_bytes * self.frame_bytes)
+        self.playback_ring = SharedRing(context, int(ring_seconds * PLAYBACK_RATE) * 2)
+        self.counters = context.RawArray("Q", len(COUNTER_NAMES))
+        # Callback jitter histograms, written by the worker and read when scraped.
+        self.jitter = {stream: context.RawArray("d", len(JITTER_BUCKETS) + 2) for stream in ("capture", "playback")}
+        self.commands = context.Queue()
+        self.events = context.Queue()
+        self.process = context.Process(target=worker_main, daemon=True, name="audio-worker", args=(
+            self.commands, self.events, self.capture_ring, self.playback_ring, self.counters, self.jitter,
+            sample_rate, chunk_size, realtime_priority, list(cpus)))
+        self.playing = {}
+        self.playing_lock = threading.Lock()
+        self.reported = [0] * len(COUNTER_NAMES)
+        self.listener = None
+
+    def start(self):
+        self.process.start()
+        for stream, counts in self.jitter.items():
+            JITTER_SECONDS.attach(counts, stream=stream)
+        self.listener = threading.Thread(target=self.event_listener, daemon=True)
+        self.listener.start()
+        logging.info(f"Audio worker process started (pid {self.process.pid})")
+
+    def event_listener(self):
+        reported_at = time.monotonic()
+        while True:
+            if time.monotonic() - reported_at >= 1.0:
+                reported_at = time.monotonic()
+                self.report_counters()
+            try:
+                event = self.events.get(timeout=1.0)
+            except Empty:
+                if not self.process.is_alive():
+                    logging.error("Audio worker process exited")
+                    self.fail_pending("Audio worker process exited")
+                    return
+                continue
+            except (EOFError, OSError):
+                return
+            kind = event[0]
+            if kind == "stopped":
+                return
+            if kind == "played":
+                self.finish(event[1], None)
+            elif kind == "log":
+                logging.log(event[1], f"Audio worker: {event[2]}")
+            elif kind == "error":
+                logging.error(f"Audio worker: {event[2]}")
+                if event[1]:
+                    self.finish(event[1], event[2])
+
+    def report_counters(self):
+        current = list(self.counters)
+        for index, stream in ((CAPTURE_OVERFLOWS, "capture"), (PLAYBACK_UNDERRUNS, "playback")):
+            if current[index] > self.reported[index]:
+                XRUNS.inc(current[index] - self.reported[index], stream=stream)
+                logging.warning(f"Audio {COUNTER_NAMES[index].replace('_', ' ')}: "
+                                f"{current[index] - self.reported[index]} new, {current[index]} total")
+        self.reported = current
+
+    def get_counters(self):
+        return dict(zip(COUNTER_NAMES, self.counters))
+
+    def finish(self, path, error):
+        with self.playing_lock:
+            waiter = self.playing.pop(path, None)
+        if waiter:
+            waiter[1].append(error)
+            waiter[0].set()
+
+    def fail_pending(self, error):
+        with self.playing_lock:
+            paths = list(self.playing)
+        for path in paths:
+            self.finish(path, error)
+
+    def play(self, path):
+        # Blocks until the file has been played, like pygame's music player.
+        done, result = threading.Event(), []
+        with self.playing_lock:
+            self.playing[path] = (done, result)
+        self.commands.put(("play", path))
+        while not done.wait(1.0):
+            if not self.process.is_alive():
+                self.finish(path, "Audio worker process exited")
+        if result[0]:
+            raise RuntimeError(result[0])
+
+    def start_capture(self):
+        self.capture_ring.read(self.capture_ring.capacity)  # Drop audio left from the last session
+        self.commands.put(("start_capture",))
+
+    def stop_capture(self):
+        self.commands.put(("stop_capture",))
+
+    def read_frame(self, timeout=0.1):
+        # Returns the next captured frame, or None if none arrived in time.
+        deadline = time.monotonic() + timeout
+        while self.capture_ring.available() < self.frame_bytes:
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.01)
+        return self.capture_ring.read(self.frame_bytes)
+
+    def stop(self):
+        if self.process.is_alive():
+            self.commands.put(("shutdown",))
+            self.process.join(2.0)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+            self.fail_pending("Audio worker stopped")
+            counters = self.get_counters()
+            logging.info("Audio worker stopped: " + ", ".join(f"{name} {value}" for name, value in counters.items()))
+        # Also done if the worker died on its own, so no counts stay attached.
+        for stream, counts in self.jitter.items():
+            JITTER_SECONDS.detach(counts, stream=stream)
+
+
+class EventLogHandler(logging.Handler):
+    # Sends the worker's log records to the main process, which owns the log file.
+    def __init__(self, events):
+        super().__init__()
+        self.events = events
+
+    def emit(self, record):
+        self.events.put(("log", record.levelno, record.getMessage()))
+
+
+def worker_main(commands, events, capture_ring, playback_ring, counters, jitter, sample_rate, chunk_size,
+                realtime_priority, cpus):
+    # Ctrl+C goes to the whole process group; the main process stops the
+    # worker itself once it has finished with it.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.getLogger().addHandler(EventLogHandler(events))
+    logging.getLogger().setLevel(logging.INFO)
+    # pygame is only used to decode speech files; sounddevice does the output.
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+    import pygame
+    import sounddevice as sd
+    pygame.mixer.init(frequency=PLAYBACK_RATE, size=-16, channels=1)
+    WorkerProcess(sd, pygame, commands, events, capture_ring, playback_ring, counters, jitter, sample_rate, chunk_size,
+                  realtime_priority, cpus).run()
+
+
+class WorkerProcess:
+    def __init__(self, sd, pygame, commands, events, capture_ring, playback_ring, counters, jitter, sample_rate, chunk_size,
+                 realtime_priority=0, cpus=()):
+        self.sd = sd
+        self.pygame = pygame
+        self.commands = commands
+        self.events = events
+        self.capture_ring = capture_ring
+        self.playback_ring = playback_ring
+        self.counters = counters
+        self.sample_rate = sample_rate
+        self.chunk_size = chunk_size
+        self.jitter = jitter
+        self.realtime_priority = realtime_priority
+        self.cpus = cpus
+        self.capture_timer = None
+        self.playback_timer = self.create_timer("playback", None)
+        self.input_stream = None
+        self.output_stream = None
+        self.decode_queue = deque()
+        self.decode_ready = threading.Event()
+        # Byte positions in the playback stream where each queued file ends.
+        self.file_ends = deque()
+        self.queued_bytes = 0
+        self.played_bytes = 0
+        self.running = True
+
+    def run(self):
+        decoder = threading.Thread(target=self.decoder_thread, daemon=True)
+        decoder.start()
+        while self.running:
+            command = self.commands.get()
+            try:
+                if command[0] == "play":
+                    self.decode_queue.append(command[1])
+                    self.decode_ready.set()
+                elif command[0] == "start_capture":
+                    self.start_capture()
+                elif command[0] == "stop_capture":
+                    self.stop_capture()
+                elif command[0] == "shutdown":
+                    self.running = False
+            except Exception as e:
+                self.events.put(("error", None, f"{command[0]} failed: {str(e)}"))
+        self.stop_capture()
+        if self.output_stream:
+            self.output_stream.close()
+        self.events.put(("stopped",))
+
+    def create_timer(self, stream, period):
+        counts = self.jitter[stream]
+        return CallbackTimer(f"Audio worker {stream} callback", period,
+                             lambda value: metrics.observe_into(counts, JITTER_BUCKETS, value),
+                             self.realtime_priority, self.cpus)
+
+    def start_capture(self):
+        if self.input_stream:
+            return
+        # A new timer for each capture, so the gap between sessions is not counted.
+        self.capture_timer = self.create_timer("capture", self.chunk_size / self.sample_rate)
+        self.input_stream = self.sd.RawInputStream(samplerate=self.sample_rate, channels=1, dtype="int16",
+                                                   blocksize=self.chunk_size, callback=self.input_callback)
+        self.input_stream.start()
+
+    def stop_capture(self):
+        if self.input_stream:
+            self.input_stream.close()
+            self.input_stream = None
+
+    def input_callback(self, indata, frames, time_info, status):
+        self.capture_timer.tick()
+        if status.input_overflow:
+            self.counters[CAPTURE_OVERFLOWS] += 1
+        # The main process is behind when the ring is full; the frame is lost.
+        if self.capture_ring.write(bytes(indata)):
+            self.counters[CAPTURE_FRAMES] += 1
+        else:
+            self.counters[CAPTURE_OVERFLOWS] += 1
+
+    def output_callback(self, outdata, frames, time_info, status):
+        self.playback_timer.tick(frames / PLAYBACK_RATE)
+        if status.output_underflow:
+            self.counters[PLAYBACK_UNDERRUNS] += 1
+        data = self.playback_ring.read(len(outdata))
+        outdata[:len(data)] = data
+        if len(data) < len(outdata):
+            outdata[len(data):] = bytes(len(outdata) - len(data))
+            # Running dry in the middle of a file is an underrun; between files it is just silence.
+            if self.played_bytes + len(data) < self.queued_bytes:
+                self.counters[PLAYBACK_UNDERRUNS] += 1
+        self.played_bytes += len(data)
+        while self.file_ends and self.played_bytes >= self.file_ends[0][0]:
+            self.counters[PLAYBACK_FILES] += 1
+            self.events.put(("played", self.file_ends.popleft()[1]))
+
+    def decoder_thread(self):
+        while True:
+            self.decode_ready.wait()
+            self.decode_ready.clear()
+            while self.decode_queue:
+                path = self.decode_queue.popleft()
+                try:
+                    self.queue_file(path)
+                except Exception as e:
+                    self.events.put(("error", path, f"Could not play {path}: {str(e)}"))
+
+    def queue_file(self, path):
+        data = self.pygame.mixer.Sound(path).get_raw()
+        if self.output_stream is None:
+            self.output_stream = self.sd.RawOutputStream(samplerate=PLAYBACK_RATE, channels=1, dtype="int16",
+                                                         callback=self.output_callback)
+            self.output_stream.start()
+        self.queued_bytes += len(data)
+        self.file_ends.append((self.queued_bytes, path))
+        view = memoryview(data)
+        while view:
+            written = self.playback_ring.write(view, partial=True)
+            view = view[written:]
+            if view:
+                time.sleep(0.01)
@@ -0,0 +1,546 @@
+# Offline benchmarks for the voice pipeline. Run with: python3 benchmark.py <name> --help
+
+import os
+import re
+import sys
+import time
+import wave
+import asyncio
+import argparse
+import tempfile
+from dotenv import load_dotenv
+from config_manager import ConfigManager
+from log_manager import LogManager
+
+
+def load_fixtures(fixtures_dir):
+    # Each fixture is a 16 kHz mono 16-bit <name>.wav with its reference transcript in <name>.txt
+    fixtures = []
+    if not os.path.isdir(fixtures_dir):
+        return fixtures
+    for file_name in sorted(os.listdir(fixtures_dir)):
+        if not file_name.endswith(".wav"):
+            continue
+        wav_path = os.path.join(fixtures_dir, file_name)
+        txt_path = os.path.splitext(wav_path)[0] + ".txt"
+        if not os.path.exists(txt_path):
+            print(f"Skipping {file_name}: no reference transcript")
+            continue
+        with wave.open(wav_path, "rb") as wav:
+            if wav.getframerate() != 16000 or wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+                print(f"Skipping {file_name}: expected 16 kHz mono 16-bit audio")
+                continue
+            audio = wav.readframes(wav.getnframes())
+        with open(txt_path, "r", encoding="utf-8") as f:
+            reference = f.read().strip()
+        fixtures.append((file_name, audio, reference))
+    return fixtures
+
+
+def normalize_words(text):
+    return re.sub(r"[^a-z0-9' ]", " ", text.lower()).split()
+
+
+def word_error_rate(reference, hypothesis):
+    ref, hyp = normalize_words(reference), normalize_words(hypothesis)
+    distances = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        previous, distances[0] = distances[0], i
+        for j, hyp_word in enumerate(hyp, 1):
+            current = min(distances[j] + 1, distances[j - 1] + 1, previous + (ref_word != hyp_word))
+            previous, distances[j] = distances[j], current
+    return distances[len(hyp)] / max(len(ref), 1)
+
+
+def is_truncated(reference, hypothesis):
+    # The utterance was cut short if the hypothesis is shorter and does not
+    # end with the reference's last word.
+    ref, hyp = normalize_words(reference), normalize_words(hypothesis)
+    return bool(ref) and len(hyp) < len(ref) and ref[-1] not in hyp[-3:]
+
+
+def is_silent(frame, threshold=500):
+    samples = memoryview(frame).cast("h")
+    return max((abs(sample) for sample in samples), default=0) < threshold
+
+
+class FixturePlayer:
+    # Feeds a fixture to a backend at real-time pace, followed by silence so
+    # that the backend's end-of-speech detection has something to work with.
+    def __init__(self, audio, chunk_size=1024, sample_rate=16000, tail_seconds=5.0):
+        frame_bytes = chunk_size * 2
+        self.frames = [audio[i:i + frame_bytes] for i in range(0, len(audio), frame_bytes)]
+        silence_frames = int(tail_seconds * sample_rate / chunk_size)
+        self.frames += [bytes(frame_bytes)] * silence_frames
+        self.frame_duration = chunk_size / sample_rate
+        self.speech_frames = [i for i, frame in enumerate(self.frames) if not is_silent(frame)]
+        self.last_speech_frame = self.speech_frames[-1] if self.speech_frames else 0
+        self.position = 0
+        self.started_at = None
+        self.speech_ended_at = None
+
+    async def next_frame(self):
+        if self.position >= len(self.frames):
+            return None
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+        delay = self.started_at + self.position * self.frame_duration - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        frame = self.frames[self.position]
+        if self.position == self.last_speech_frame:
+            self.speech_ended_at = time.monotonic() + self.frame_duration
+        self.position += 1
+        return frame
+
+
+def summarize(values):
+    if not values:
+        return "n/a"
+    values = sorted(values)
+    median = values[len(values) // 2]
+    p95 = values[int(0.95 * (len(values) - 1))]
+    return f"median {median * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms"
+
+
+async def run_stt_fixture(backend, audio, encoder=None, endpointer=None, vad=None):
+    player = FixturePlayer(audio)
+    flushed = False
+
+    async def next_frame():
+        nonlocal flushed
+        frame = await player.next_frame()
+        if frame is not None and endpointer:
+            endpointer.feed(vad.is_speech(frame))
+        if encoder is None:
+            return frame
+        if frame is None:
+            # The encoder's tail goes out before the backend closes the stream.
+            if flushed:
+                return None
+            flushed = True
+            return encoder.flush() or None
+        return encoder.encode(frame)
+
+    transcript = await backend.transcribe(next_frame, lambda text: None, lambda: None, encoder, endpointer)
+    finished_at = time.monotonic()
+    latency = finished_at - player.speech_ended_at if player.speech_ended_at else None
+    return transcript or "", latency
+
+
+def create_stt_manager(config_manager, log_manager=None):
+    from stt_manager import STTManager
+    return STTManager(config_manager, log_manager or LogManager(config_manager))
+
+
+async def benchmark_stt(args):
+    config_manager = ConfigManager()
+    stt_manager = create_stt_manager(config_manager)
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        print(f"No fixtures found in {args.fixtures}")
+        return 1
+
+    for backend_name in args.backends:
+        config_manager.update(stt_backend=backend_name)
+        backend = stt_manager.get_backend()
+        errors, latencies = [], []
+        print(f"\n{backend_name}")
+        for file_name, audio, reference in fixtures:
+            transcript, latency = await run_stt_fixture(backend, audio, backend.create_encoder())
+            wer = word_error_rate(reference, transcript)
+            errors.append(wer)
+            if latency is not None:
+                latencies.append(latency)
+            latency_text = f"{latency * 1000:.0f} ms" if latency is not None else "n/a"
+            print(f"  {file_name}: WER {wer:.1%}, end-of-speech to transcript {latency_text}")
+        print(f"  mean WER {sum(errors) / len(errors):.1%}, latency {summarize(latencies)}")
+    return 0
+
+
+async def benchmark_uplink(args):
+    config_manager = ConfigManager()
+    stt_manager = create_stt_manager(config_manager)
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        print(f"No fixtures found in {args.fixtures}")
+        return 1
+
+    config_manager.update(stt_backend="deepgram")
+    for encoding in args.encodings:
+        config_manager.update(stt_encoding=encoding)
+        backend = stt_manager.get_backend()
+        total_bytes, total_seconds, errors, latencies = 0, 0.0, [], []
+        for file_name, audio, reference in fixtures:
+            transcript, latency = await run_stt_fixture(backend, audio, backend.create_encoder())
+            total_bytes += backend.bytes_sent
+            total_seconds += len(audio) / 2 / 16000
+            errors.append(word_error_rate(reference, transcript))
+            if latency is not None:
+                latencies.append(latency)
+        print(f"{encoding}: {total_bytes} bytes sent, {total_bytes * 8 / max(total_seconds, 0.001) / 1000:.1f} kbit/s of speech, "
+              f"mean WER {sum(errors) / len(errors):.1%}, latency {summarize(latencies)}")
+    return 0
+
+
+async def benchmark_endpointing(args):
+    # Compares the fixed server-side endpointing with adaptive endpointing.
+    # The adaptive pause model starts empty and learns from the fixtures as
+    # it goes; later passes use what the earlier ones learned.
+    from endpointing import VoiceActivityDetector, PauseModel, Endpointer
+
+    config_manager = ConfigManager()
+    stt_manager = create_stt_manager(config_manager)
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        print(f"No fixtures found in {args.fixtures}")
+        return 1
+    frame_ms = stt_manager.stt_chunk_size * 1000 / stt_manager.stt_sample_rate
+
+    for backend_name in args.backends:
+        config_manager.update(stt_backend=backend_name)
+        backend = stt_manager.get_backend()
+        print(f"\n{backend_name}")
+        for mode in ("fixed", "adaptive"):
+            pause_model = PauseModel(os.path.join(tempfile.mkdtemp(prefix="claude_cli_endpointing_"), "endpointing.json"),
+                                     config_manager.get_endpointing_min_ms(), config_manager.get_endpointing_max_ms())
+            vad = VoiceActivityDetector()
+            for pass_number in range(1, (args.passes if mode == "adaptive" else 1) + 1):
+                latencies, errors, truncated = [], [], 0
+                for file_name, audio, reference in fixtures:
+                    endpointer = None
+                    if mode == "adaptive":
+                        endpointer = Endpointer(pause_model.threshold_ms(), pause_model.max_ms, frame_ms)
+                    transcript, latency = await run_stt_fixture(backend, audio, backend.create_encoder(), endpointer, vad)
+                    if endpointer and transcript:
+                        pause_model.add(endpointer.pauses)
+                    errors.append(word_error_rate(reference, transcript))
+                    truncated += is_truncated(reference, transcript)
+                    if latency is not None:
+                        latencies.append(latency)
+                label = mode if mode == "fixed" else f"adaptive, pass {pass_number}"
+                print(f"  {label}: end-of-speech to transcript {summarize(latencies)}, "
+                      f"truncated {truncated} of {len(fixtures)}, mean WER {sum(errors) / len(errors):.1%}")
+            if mode == "adaptive":
+                print(f"  learned end-of-turn silence {pause_model.threshold_ms():.0f} ms from {len(pause_model.pauses)} pauses")
+    return 0
+
+
+async def benchmark_memory(args):
+    # Simulates one long voice session as fast as possible. Every turn adds
+    # a question and a reply to the history, captures speech into the STT
+    # queue and queues its spoken reply for playback. Every few turns the
+    # consumers stall for minutes: the STT connection sends nothing and
+    # playback hangs, while the microphone and speech synthesis carry on.
+    import threading
+    from memory_monitor import rss_bytes
+    from history_manager import HistoryManager
+    from session_replay import ReplayAudioManager
+    from queue import Queue, Empty
+
+    playing = threading.Event()
+    playing.set()
+
+    class StalledAudioManager(ReplayAudioManager):
+        def play_file(self, audio_file):
+            playing.wait()
+
+    config_manager = ConfigManager()
+    config_manager.update(memory_budget_mode=not args.unbounded, config_watch_interval=0.0)
+    log_dir = tempfile.mkdtemp(prefix="claude_cli_memory_")
+    log_manager = LogManager(config_manager, log_dir=log_dir)
+    history_manager = HistoryManager(config_manager, log_manager)
+    stt_manager = create_stt_manager(config_manager, log_manager)
+    audio_manager = StalledAudioManager(config_manager, 1.0)
+    frame_bytes = stt_manager.stt_chunk_size * 2
+    frames_per_second = stt_manager.stt_sample_rate / stt_manager.stt_chunk_size
+    turns_per_hour = int(3600 / args.turn_seconds)
+    loop = asyncio.get_running_loop()
+    # One queue for the whole session, so a backlog left by a stall stays.
+    stt_manager.stt_audio_queue = Queue(stt_manager.get_queue_limit())
+    speech_files = 0
+
+    async def speak(count):
+        # Like the response stream: with a bounded playback queue this waits
+        # once the queue is full, so no more speech is synthesized meanwhile.
+        nonlocal speech_files
+        for _ in range(count):
+            speech_files += 1
+            file_path = os.path.join(log_dir, f"speech_{speech_files}.mp3")
+            open(file_path, "wb").close()
+            await audio_manager.queue_audio_with_backpressure(file_path)
+
+    def capture(seconds, sent):
+        # Each frame is a new object, as the microphone delivers them.
+        for _ in range(int(seconds * frames_per_second)):
+            stt_manager.put_frame(stt_manager.stt_audio_queue, bytes(frame_bytes))
+            if sent:
+                try:
+                    stt_manager.stt_audio_queue.get_nowait()
+                except Empty:
+                    pass
+
+    print(f"Simulating {args.hours} hours, {turns_per_hour} turns per hour, a {args.stall_seconds:.0f} s stall "
+          f"every {args.stall_every} turns, memory budget mode {'off' if args.unbounded else 'on'}")
+    print(f"{'Hour':>4} {'RSS MB':>8} {'Resident msgs':>14} {'STT backlog s':>14} {'Dropped frames':>15} {'Speech files':>13}")
+    samples = []
+    peak_files = 0
+    try:
+        for hour in range(1, args.hours + 1):
+            hour_files = 0
+            for turn in range(turns_per_hour):
+                if turn % args.stall_every == 0:
+                    playing.clear()
+                    capture(args.stall_seconds, sent=False)
+                    speaker = asyncio.ensure_future(speak(max(1, int(args.stall_seconds / args.speech_seconds))))
+                    await asyncio.wait({speaker}, timeout=0.1)  # Until it is done or held back
+                    hour_files = max(hour_files, len(audio_manager.audio_queue.queue))
+                    playing.set()
+                    await speaker
+                else:
+                    capture(args.speech_seconds, sent=True)
+                    await speak(1)
+                await loop.run_in_executor(None, audio_manager.wait_for_audio_completion)
+                history_manager.add_message("user", f"Question {hour}.{turn}")
+                history_manager.add_message("assistant", f"Reply {hour}.{turn} ".ljust(args.reply_chars, "x"))
+                history_manager.save_history()
+            rss = rss_bytes()
+            samples.append(rss)
+            peak_files = max(peak_files, hour_files)
+            backlog = stt_manager.stt_audio_queue.qsize() / frames_per_second
+            print(f"{hour:>4} {rss / 1e6:>8.1f} {len(history_manager.history):>14} {backlog:>14.0f} "
+                  f"{stt_manager.dropped_frames:>15} {hour_files:>13}")
+    finally:
+        playing.set()
+        audio_manager.shutdown()
+
+    growth = (samples[-1] - samples[0]) / 1e6
+    flat = growth <= args.max_growth_mb
+    bounded = peak_files <= config_manager.get_audio_queue_max_files()
+    print(f"RSS grew {growth:.1f} MB after the first hour (limit {args.max_growth_mb} MB): {'PASS' if flat else 'FAIL'}")
+    print(f"At most {peak_files} speech files waited for playback "
+          f"(limit {config_manager.get_audio_queue_max_files()}): {'PASS' if bounded else 'FAIL'}")
+    return 0 if flat and bounded else 1
+
+
+def stress_load(stop, cpu):
+    # Work like the main process does while streaming: JSON parsing and
+    # hashing, as for TLS. Pinned to one CPU when possible.
+    import json
+    import hashlib
+    try:
+        os.sched_setaffinity(0, {cpu})
+    except (AttributeError, OSError):
+        pass
+    payload = json.dumps({"type": "content_block_delta", "delta": {"type": "text_delta", "text": "word " * 40}})
+    while not stop.is_set():
+        for _ in range(100):
+            hashlib.sha256(json.loads(payload)["delta"]["text"].encode()).digest()
+
+
+def jitter_quantile(counts, buckets, quantile):
+    # The upper bound of the bucket holding the quantile.
+    total = sum(counts[:-1])
+    cumulative = 0
+    for bound, count in zip(buckets + (None,), counts[:-1]):
+        cumulative += count
+        if total and cumulative >= quantile * total:
+            return f"<= {bound * 1000:g} ms" if bound is not None else f"> {buckets[-1] * 1000:g} ms"
+    return "n/a"
+
+
+def run_stress_capture(args, priority, cpus):
+    # Captures from the microphone for args.seconds and returns the jitter
+    # histogram counts and the number of input overflows.
+    import threading
+    import metrics
+    from realtime import CallbackTimer, JITTER_BUCKETS
+
+    sample_rate, chunk_size = 16000, 1024
+    if args.audio_worker:
+        from audio_worker import AudioWorker, CAPTURE_OVERFLOWS
+        worker = AudioWorker(sample_rate, chunk_size, realtime_priority=priority, cpus=cpus)
+        worker.start()
+        worker.start_capture()
+        deadline = time.monotonic() + args.seconds
+        while time.monotonic() < deadline:
+            worker.read_frame(0.1)
+        worker.stop_capture()
+        time.sleep(0.5)
+        counts, overflows = list(worker.jitter["capture"]), worker.counters[CAPTURE_OVERFLOWS]
+        worker.stop()
+        return counts, overflows
+
+    import sounddevice as sd
+    counts = [0] * (len(JITTER_BUCKETS) + 1) + [0.0]
+    overflows = [0]
+    timer = CallbackTimer("Stress capture callback", chunk_size / sample_rate,
+                          lambda value: metrics.observe_into(counts, JITTER_BUCKETS, value), priority, cpus)
+
+    def callback(indata, frames, time_info, status):
+        timer.tick()
+        if status.input_overflow:
+            overflows[0] += 1
+
+    stop = threading.Event()
+    # Threads in this process compete for the interpreter lock, as the event loop does.
+    loaders = [threading.Thread(target=stress_load, args=(stop, cpu), daemon=True) for cpu in range(args.threads)]
+    for loader in loaders:
+        loader.start()
+    stream = sd.RawInputStream(samplerate=sample_rate, channels=1, dtype="int16", blocksize=chunk_size, callback=callback)
+    stream.start()
+    time.sleep(args.seconds)
+    stream.close()
+    stop.set()
+    return counts, overflows[0]
+
+
+def benchmark_audio_stress(args):
+    # Captures microphone audio while the other CPUs are kept busy, once at
+    # normal priority and once with the configured real-time settings, and
+    # reports the callback jitter and input overflows.
+    import multiprocessing
+    from realtime import JITTER_BUCKETS
+
+    config_manager = ConfigManager()
+    priority = args.priority if args.priority is not None else config_manager.get_audio_realtime_priority()
+    cpus = args.cpus if args.cpus is not None else config_manager.get_audio_cpu_affinity()
+    cpu_count = os.cpu_count() or 1
+    load_cpus = [cpu for cpu in range(cpu_count) if cpu not in cpus] or list(range(cpu_count))
+    print(f"Capturing for {args.seconds} s {'in the audio worker' if args.audio_worker else 'in process'}, "
+          f"loading CPUs {', '.join(map(str, load_cpus))}")
+
+    runs = [("normal priority", 0, [])]
+    if priority or cpus:
+        runs.append((f"priority {priority}, CPUs {', '.join(map(str, cpus)) or 'any'}", priority, cpus))
+    else:
+        print("No audio_realtime_priority or audio_cpu_affinity set; pass --priority or --cpus to compare")
+    for label, run_priority, run_cpus in runs:
+        stop = multiprocessing.Event()
+        loaders = [multiprocessing.Process(target=stress_load, args=(stop, cpu), daemon=True)
+                   for cpu in load_cpus for _ in range(args.load_per_cpu)]
+        for loader in loaders:
+            loader.start()
+        try:
+            counts, overflows = run_stress_capture(args, run_priority, run_cpus)
+        finally:
+            stop.set()
+            for loader in loaders:
+                loader.join()
+        callbacks = int(sum(counts[:-1]))
+        mean = counts[-1] / callbacks * 1000 if callbacks else 0.0
+        print(f"{label}: {callbacks} callbacks, jitter mean {mean:.2f} ms, "
+              f"p50 {jitter_quantile(counts, JITTER_BUCKETS, 0.5)}, p99 {jitter_quantile(counts, JITTER_BUCKETS, 0.99)}, "
+              f"max {jitter_quantile(counts, JITTER_BUCKETS, 1.0)}, {overflows} input overflows")
+    return 0
+
+
+REPLAY_METRICS = [("stt", "Speech to transcript"), ("first_text", "Time to first text"),
+                  ("first_audio", "Time to first audio"), ("turn", "Turn time")]
+
+
+async def benchmark_replay(args):
+    # Replays a trace recorded with main.py --record. Only local processing
+    # is measured for real; network and device delays are the recorded ones.
+    import json
+    from session_replay import SessionReplay
+
+    replay = SessionReplay(args.trace, args.speed)
+    if not replay.turns:
+        print(f"No complete turns in {args.trace}")
+        return 1
+    print(f"Replaying {len(replay.turns)} turns from {args.trace} at {args.speed}x speed")
+
+    def show_turn(result):
+        recorded, replayed = result["recorded"], result["replayed"]
+        parts = [f"{name} {recorded[name] * 1000:.0f}/{replayed[name] * 1000:.0f} ms"
+                 for name, _ in REPLAY_METRICS if name in recorded and name in replayed]
+        print(f"  turn {result['turn']} ({result['source']}): {', '.join(parts)} (recorded/replayed)")
+
+    results = await replay.run(show_turn)
+    summary = {}
+    for name, label in REPLAY_METRICS:
+        recorded = [result["recorded"][name] for result in results if name in result["recorded"]]
+        replayed = [result["replayed"][name] for result in results if name in result["replayed"]]
+        summary[name] = replayed
+        print(f"{label}: recorded {summarize(recorded)}; replayed {summarize(replayed)}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("speed") != args.speed:
+            print(f"Warning: the baseline was replayed at {baseline.get('speed')}x and this run at {args.speed}x")
+        print(f"Compared with {args.compare}:")
+        for name, label in REPLAY_METRICS:
+            before = sorted(result["replayed"][name] for result in baseline["turns"] if name in result["replayed"])
+            after = sorted(summary[name])
+            if before and after:
+                change = (after[len(after) // 2] - before[len(before) // 2]) * 1000
+                print(f"  {label}: {summarize(before)} -> {summarize(after)} (median {change:+.0f} ms)")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"trace": args.trace, "speed": args.speed, "turns": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 0
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Claude CLI voice pipeline benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    stt_parser = subparsers.add_parser("stt", help="Compare STT backends on recorded fixtures")
+    stt_parser.add_argument("--fixtures", default="fixtures/stt", help="Directory of <name>.wav/<name>.txt pairs")
+    stt_parser.add_argument("--backends", nargs="+", default=["deepgram", "vosk"])
+
+    uplink_parser = subparsers.add_parser("uplink", help="Compare Deepgram uplink encodings on recorded fixtures")
+    uplink_parser.add_argument("--fixtures", default="fixtures/stt", help="Directory of <name>.wav/<name>.txt pairs")
+    uplink_parser.add_argument("--encodings", nargs="+", default=["linear16", "mulaw", "opus"])
+
+    endpointing_parser = subparsers.add_parser("endpointing", help="Compare fixed and adaptive endpointing on recorded fixtures")
+    endpointing_parser.add_argument("--fixtures", default="fixtures/stt", help="Directory of <name>.wav/<name>.txt pairs")
+    endpointing_parser.add_argument("--backends", nargs="+", default=["deepgram"])
+    endpointing_parser.add_argument("--passes", type=int, default=2, help="Passes over the fixtures with adaptive endpointing")
+
+    memory_parser = subparsers.add_parser("memory", help="Check that RSS stays flat over a long simulated session")
+    memory_parser.add_argument("--hours", type=int, default=8, help="Simulated session length")
+    memory_parser.add_argument("--turn-seconds", type=float, default=30, help="Simulated time between turns")
+    memory_parser.add_argument("--speech-seconds", type=float, default=5, help="Audio captured per turn")
+    memory_parser.add_argument("--stall-every", type=int, default=20, help="Simulate a stall every N turns")
+    memory_parser.add_argument("--stall-seconds", type=float, default=180, help="Length of each stall")
+    memory_parser.add_argument("--reply-chars", type=int, default=2000, help="Length of each simulated reply")
+    memory_parser.add_argument("--max-growth-mb", type=float, default=2.0, help="Allowed RSS growth after the first hour")
+    memory_parser.add_argument("--unbounded", action="store_true", help="Run with memory budget mode off for comparison")
+
+    stress_parser = subparsers.add_parser("audio-stress", help="Measure audio callback jitter while the other CPUs are busy")
+    stress_parser.add_argument("--seconds", type=float, default=30, help="Capture time for each run")
+    stress_parser.add_argument("--priority", type=int, help="SCHED_FIFO priority (default audio_realtime_priority)")
+    stress_parser.add_argument("--cpus", type=int, nargs="*", help="CPUs for the audio callback (default audio_cpu_affinity)")
+    stress_parser.add_argument("--load-per-cpu", type=int, default=1, help="Busy processes on each of the other CPUs")
+    stress_parser.add_argument("--threads", type=int, default=1, help="Busy threads in this process")
+    stress_parser.add_argument("--audio-worker", action="store_true", help="Capture in the audio worker process")
+
+    replay_parser = subparsers.add_parser("replay", help="Replay a recorded session and measure per-turn latency")
+    replay_parser.add_argument("trace", help="Trace recorded with main.py --record")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="Replay faster (>1) or slower (<1) than recorded")
+    replay_parser.add_argument("--output", help="Write per-turn results to this JSON file")
+    replay_parser.add_argument("--compare", help="Results JSON from an earlier replay to compare against")
+
+    args = parser.parse_args()
+    if args.benchmark == "stt":
+        return asyncio.run(benchmark_stt(args))
+    if args.benchmark == "uplink":
+        return asyncio.run(benchmark_uplink(args))
+    if args.benchmark == "endpointing":
+        return asyncio.run(benchmark_endpointing(args))
+    if args.benchmark == "memory":
+        return asyncio.run(benchmark_memory(args))
+    if args.benchmark == "audio-stress":
+        return benchmark_audio_stress(args)
+    if args.benchmark == "replay":
+        return asyncio.run(benchmark_replay(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
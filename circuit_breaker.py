@@ -0,0 +1,109 @@
+import time
+import logging
+import threading
+from collections import deque
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # Tracks call outcomes over a sliding time window. When the failure rate
+    # reaches failure_rate (with at least min_calls calls in the window) the
+    # circuit opens and calls fail fast. After open_seconds a single probe
+    # call is let through (half-open): success closes the circuit, failure
+    # opens it again for twice as long, up to max_open_seconds.
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name, failure_rate=0.5, window_seconds=60, min_calls=3,
+                 open_seconds=30, max_open_seconds=300, on_state_change=None):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.on_state_change = on_state_change
+        self.state = self.CLOSED
+        self.outcomes = deque()
+        self.open_duration = open_seconds
+        self.open_until = 0
+        self.lock = threading.Lock()
+
+    def configure(self, failure_rate, window_seconds, min_calls, open_seconds):
+        with self.lock:
+            self.failure_rate = failure_rate
+            self.window_seconds = window_seconds
+            self.min_calls = min_calls
+            self.open_seconds = open_seconds
+            self.max_open_seconds = max(self.max_open_seconds, open_seconds)
+
+    def allow(self):
+        # Returns True if a call may go ahead. A caller that gets True must
+        # report the outcome with record_success or record_failure.
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() >= self.open_until:
+                self.set_state(self.HALF_OPEN)
+                return True
+            return False
+
+    def retry_in(self):
+        return max(0.0, self.open_until - time.monotonic()) if self.state == self.OPEN else 0.0
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                self.outcomes.clear()
+                self.open_duration = self.open_seconds
+                self.set_state(self.CLOSED)
+                return
+            self.add_outcome(True)
+
+    def record_failure(self):
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.open_duration = min(self.open_duration * 2, self.max_open_seconds)
+                self.open()
+                return
+            if self.state == self.OPEN:
+                return
+            self.add_outcome(False)
+            failures = sum(1 for _, ok in self.outcomes if not ok)
+            if len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.failure_rate:
+                self.open_duration = self.open_seconds
+                self.open()
+
+    def record_cancelled(self):
+        # A probe that was abandoned before it finished; the next call probes again.
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.open_until = time.monotonic()
+                self.state = self.OPEN
+
+    def add_outcome(self, ok):
+        now = time.monotonic()
+        self.outcomes.append((now, ok))
+        while self.outcomes and self.outcomes[0][0] < now - self.window_seconds:
+            self.outcomes.popleft()
+
+    def open(self):
+        self.open_until = time.monotonic() + self.open_duration
+        self.outcomes.clear()
+        self.set_state(self.OPEN)
+
+    def set_state(self, state):
+        previous, self.state = self.state, state
+        if state == self.OPEN:
+            logging.warning(f"{self.name} circuit open; failing fast for {self.open_duration:.0f} s")
+        else:
+            logging.info(f"{self.name} circuit {state}")
+        if self.on_state_change and previous != state:
+            try:
+                self.on_state_change(self, previous, state)
+            except Exception as e:
+                logging.error(f"Error in {self.name} circuit callback: {str(e)}")
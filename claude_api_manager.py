@@ -1,22 +1,103 @@
 import os
-import json
+import time
 import asyncio
-import re
 from anthropic import AsyncAnthropic
 from dotenv import load_dotenv
 from colorama import init, Fore, Style
+from sentence_chunker import SentenceChunker
+from speech_normalizer import SpeechNormalizer
+from stream_renderer import StreamRenderer
+import session_trace
+import event_bus
+import metrics
+
+# Prompt caching needs this beta header on older API versions.
+PROMPT_CACHE_HEADERS = {"anthropic-beta": "prompt-caching-2024-07-31"}
+# The API only caches prompts of at least this many tokens; shorter ones are
+# sent and billed as normal input.
+PROMPT_CACHE_MIN_TOKENS = {"haiku": 2048}
+PROMPT_CACHE_DEFAULT_MIN_TOKENS = 1024
+
+TURNS = metrics.registry.counter("claude_cli_turns_total", "Turns sent to Claude, by outcome")
+TURN_SECONDS = metrics.registry.histogram("claude_cli_turn_seconds", "Time from sending a turn until its speech has played")
+TTFT_SECONDS = metrics.registry.histogram("claude_cli_ttft_seconds", "Time from sending a turn to the first text, by model")
+RESPONSE_SECONDS = metrics.registry.histogram("claude_cli_anthropic_response_seconds", "Time to stream a complete response, by model")
+ERRORS = metrics.registry.counter("claude_cli_errors_total", "Failed requests, by service")
+RETRIES = metrics.registry.counter("claude_cli_retries_total", "Retried requests, by service")
+HEDGES = metrics.registry.counter("claude_cli_hedges_total", "Turns hedged to the fallback model, by result")
+TOKENS = metrics.registry.counter("claude_cli_tokens_total", "Tokens used, by type (cache_read against the input types gives the prompt cache hit rate)")
+SPEECH_CHARS = metrics.registry.counter("claude_cli_speech_chars_total", "Response characters before and after speech normalization, by stage")
+
+
+class OpenedStream:
+    # A response stream that has been read up to its first text delta.
+    # events holds what was read so far, with their arrival times in
+    # arrivals; iterator continues from there.
+    def __init__(self, model, stream, iterator, events, arrivals):
+        self.model = model
+        self.stream = stream
+        self.iterator = iterator
+        self.events = events
+        self.arrivals = arrivals
+
+    async def __aiter__(self):
+        # Only the stream that is used is recorded, with the time each event
+        # arrived rather than the time it was consumed.
+        for chunk, arrived_at in zip(self.events, self.arrivals):
+            if session_trace.is_recording():
+                session_trace.record(session_trace.LLM_CHUNK, chunk.to_dict(), arrived_at)
+            yield chunk
+        async for chunk in self.iterator:
+            if session_trace.is_recording():
+                session_trace.record(session_trace.LLM_CHUNK, chunk.to_dict())
+            yield chunk
+
 
 class ClaudeAPIManager:
-    def __init__(self, config_manager, log_manager):
+    def __init__(self, config_manager, log_manager, usage_manager=None):
         self.config_manager = config_manager
         self.logger = log_manager.get_logger()
+        self.usage_manager = usage_manager
         self.client = AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
         self.model = self.config_manager.get_model()
         self.max_tokens = self.config_manager.get_max_tokens()
+        self.temperature = self.config_manager.get_temperature()
+        self.top_p = self.config_manager.get_top_p()
         self.system_prompt = self.load_system_prompt()
+        self.tts_chunking = self.config_manager.get_tts_chunking()
+        self.tts_first_chunk_words = self.config_manager.get_tts_first_chunk_words()
+        self.tts_chunk_char_budget = self.config_manager.get_tts_chunk_char_budget()
+        self.tts_normalize = self.config_manager.get_tts_normalize()
+        self.speech_chars_saved = 0
+        self.renderer = StreamRenderer(self.config_manager.get_render_fps())
+        self.fallback_model = self.config_manager.get_fallback_model()
+        self.hedge_deadline_ms = self.config_manager.get_hedge_ttft_deadline_ms()
+        self.hedge_stats = {"turns": 0, "fired": 0, "fallback_won": 0}
+        self.prompt_cache = self.config_manager.get_prompt_cache()
+        self.system_prompt_tokens = None  # Counted in the background by ProfileManager
+        self.config_manager.subscribe(
+            ["model", "max_tokens", "temperature", "top_p", "prompt_cache",
+             "tts_chunking", "tts_first_chunk_words", "tts_chunk_char_budget", "tts_normalize", "render_fps",
+             "fallback_model", "hedge_ttft_deadline_ms"],
+            self.on_config_change
+        )
+
+    def on_config_change(self, config, changed):
+        self.model = config.model
+        self.max_tokens = config.max_tokens
+        self.temperature = config.temperature
+        self.top_p = config.top_p
+        self.tts_chunking = config.tts_chunking
+        self.tts_first_chunk_words = config.tts_first_chunk_words
+        self.tts_chunk_char_budget = config.tts_chunk_char_budget
+        self.tts_normalize = config.tts_normalize
+        self.renderer.interval = 1 / config.render_fps
+        self.fallback_model = config.fallback_model
+        self.hedge_deadline_ms = config.hedge_ttft_deadline_ms
+        self.prompt_cache = config.prompt_cache
 
-    def load_system_prompt(self):
-        system_prompt_file = self.config_manager.get_system_prompt_file()
+    def load_system_prompt(self, system_prompt_file=None):
+        system_prompt_file = system_prompt_file or self.config_manager.get_system_prompt_file()
         try:
             with open(system_prompt_file, "r", encoding='utf-8') as f:
                 system_prompt = f.read().strip()
@@ -29,6 +110,44 @@ class ClaudeAPIManager:
             self.logger.error(f"Error loading system prompt: {str(e)}. Using default system prompt.")
             return "You are a helpful AI assistant."
 
+    def is_cacheable(self, prompt_tokens, model=None):
+        # Until the prompt has been counted it is sent without cache_control.
+        if not self.prompt_cache or prompt_tokens is None:
+            return False
+        model = model or self.model
+        minimum = next((tokens for family, tokens in PROMPT_CACHE_MIN_TOKENS.items() if family in model),
+                       PROMPT_CACHE_DEFAULT_MIN_TOKENS)
+        return prompt_tokens >= minimum
+
+    def system_param(self, system_prompt=None, prompt_tokens=None, model=None):
+        # Marks the system prompt as cacheable if it is long enough to be cached.
+        if system_prompt is None:
+            system_prompt, prompt_tokens = self.system_prompt, self.system_prompt_tokens
+        if not self.is_cacheable(prompt_tokens, model):
+            return system_prompt
+        return [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+
+    def request_headers(self):
+        return PROMPT_CACHE_HEADERS if self.prompt_cache else None
+
+    async def warm_prompt_cache(self, system_prompt, prompt_tokens):
+        # A one-token request that writes the system prompt to the server-side
+        # cache, so the next real turn only reads it. Skipped for prompts too
+        # short to cache, where it would be a billed request for nothing.
+        if not self.is_cacheable(prompt_tokens):
+            return None
+        response = await self.client.messages.create(
+            model=self.model,
+            max_tokens=1,
+            messages=[{"role": "user", "content": "Hi"}],
+            system=self.system_param(system_prompt, prompt_tokens),
+            extra_headers=self.request_headers()
+        )
+        usage = {"input_tokens": 0, "output_tokens": 0, "cache_write_tokens": 0, "cache_read_tokens": 0}
+        self.read_usage(response.usage, usage)
+        self.record_usage(self.model, usage)
+        return usage
+
     async def count_tokens(self, text):
         token_count = await self.client.count_tokens(text)
         self.logger.debug(f"Token count: {token_count}")
@@ -41,79 +160,214 @@ class ClaudeAPIManager:
 
         async def process_sentence(sentence):
             nonlocal sequence_number
+            event_bus.publish("sentence", text=sentence.strip())
+            if speech_enabled and normalizer:
+                sentence = normalizer.normalize(sentence)
             if speech_enabled and sentence.strip():
                 file_path = await audio_manager.text_to_speech(sentence.strip(), sequence_number)
                 if file_path:
-                    audio_manager.queue_audio(file_path)
+                    await audio_manager.queue_audio_with_backpressure(file_path)
                     sequence_number += 1
 
+        if speech_enabled:
+            audio_manager.start_turn()
+
         messages = self.format_messages(message, history)
-        input_tokens = await self.count_tokens(json.dumps(messages) + self.system_prompt)
-        
-        if show_tokens:
-            print(f"{Fore.CYAN}Input tokens: {input_tokens}{Style.RESET_ALL}")
-        self.logger.info(f"Sending message to Claude. Input tokens: {input_tokens}")
+        turn_started = time.monotonic()
+        self.logger.info(f"Sending message to Claude. {len(messages)} messages in context")
+        self.hedge_stats["turns"] += 1  # Once per turn, however many attempts it takes
 
         for attempt in range(max_retries):
+            # Token usage comes from the stream itself, so no count_tokens calls are needed.
+            usage = {"input_tokens": 0, "output_tokens": 0, "cache_write_tokens": 0, "cache_read_tokens": 0}
+            model = self.model
+            session_trace.record(session_trace.LLM_REQUEST, {"model": model})
+            request_started = time.monotonic()
+            first_text = True
             try:
-                stream = await self.client.messages.create(
-                    model=self.model,
-                    max_tokens=self.max_tokens,
-                    messages=messages,
-                    system=self.system_prompt,
-                    stream=True
-                )
+                stream = await self.open_hedged_stream(messages)
+                model = stream.model
+                event_bus.publish("response_start", model=model, attempt=attempt + 1)
 
                 full_response = ""
-                sentence_buffer = ""
+                chunker = SentenceChunker(self.tts_chunking, self.tts_first_chunk_words, self.tts_chunk_char_budget)
+                normalizer = SpeechNormalizer() if self.tts_normalize else None
                 if text_output_enabled:
+                    self.renderer.start()
                     print(f"{Fore.GREEN}Claude: ", end='', flush=True)
 
                 async for chunk in stream:
-                    if chunk.type == "content_block_delta":
+                    if chunk.type == "message_start":
+                        self.read_usage(chunk.message.usage, usage)
+                    elif chunk.type == "message_delta":
+                        usage["output_tokens"] = chunk.usage.output_tokens
+                    elif chunk.type == "content_block_delta":
                         if chunk.delta.text:
+                            if first_text:
+                                first_text = False
+                                TTFT_SECONDS.observe(time.monotonic() - turn_started, model=model)
                             if text_output_enabled:
-                                print(f"{Fore.GREEN}{chunk.delta.text}", end='', flush=True)
+                                self.renderer.write(chunk.delta.text)
+                            event_bus.publish("delta", text=chunk.delta.text)
                             full_response += chunk.delta.text
-                            sentence_buffer += chunk.delta.text
-                            
-                            sentences = re.split(r'(?<!\d)(?<!\.\d)(\.|!|\?)\s+', sentence_buffer)
-                            for i in range(0, len(sentences) - 1, 2):
-                                sentence = sentences[i] + sentences[i+1]
+
+                            for sentence in chunker.feed(chunk.delta.text):
                                 await process_sentence(sentence)
-                            
-                            sentence_buffer = sentences[-1] if sentences else ""
 
                     elif chunk.type == "message_stop":
                         break
 
-                if sentence_buffer:
-                    await process_sentence(sentence_buffer)
+                RESPONSE_SECONDS.observe(time.monotonic() - request_started, model=model)
+                for sentence in chunker.flush():
+                    await process_sentence(sentence)
+                if speech_enabled and normalizer:
+                    self.log_speech_savings(normalizer)
 
                 if text_output_enabled:
+                    self.renderer.flush()
                     print(Style.RESET_ALL)
 
+                self.record_usage(model, usage)
+                total_tokens = sum(usage.values())
                 if show_tokens:
-                    output_tokens = await self.count_tokens(full_response)
-                    total_tokens = input_tokens + output_tokens
-                    print(f"{Fore.CYAN}Output tokens: {output_tokens}")
+                    print(f"{Fore.CYAN}Input tokens: {usage['input_tokens']}")
+                    if usage["cache_write_tokens"] or usage["cache_read_tokens"]:
+                        print(f"Cache write tokens: {usage['cache_write_tokens']}, cache read tokens: {usage['cache_read_tokens']}")
+                    print(f"Output tokens: {usage['output_tokens']}")
+                    if speech_enabled and normalizer:
+                        print(f"Speech characters: {normalizer.chars_out} ({normalizer.saved()} saved by normalization)")
                     print(f"Total tokens: {total_tokens}{Style.RESET_ALL}")
-                    self.logger.info(f"Response received. Output tokens: {output_tokens}, Total tokens: {total_tokens}")
+                self.logger.info(f"Response received. Input tokens: {usage['input_tokens']}, "
+                                 f"Output tokens: {usage['output_tokens']}, Total tokens: {total_tokens}")
 
-                # Wait for audio playback to complete
-                audio_manager.wait_for_audio_completion()
+                # Wait for audio playback to complete without blocking the event loop
+                await asyncio.get_event_loop().run_in_executor(None, audio_manager.wait_for_audio_completion)
                 self.logger.info("Message sent and response processed successfully")
+                TURNS.inc(outcome="ok")
+                TURN_SECONDS.observe(time.monotonic() - turn_started)
 
                 return full_response
 
             except Exception as e:
+                self.renderer.flush()
+                # A stream that failed part way through is still billed.
+                self.record_usage(model, usage)
+                ERRORS.inc(service="anthropic")
                 if attempt == max_retries - 1:
                     self.logger.error(f"Max retries reached. Error: {str(e)}")
+                    TURNS.inc(outcome="error")
                     raise
+                RETRIES.inc(service="anthropic")
                 delay = base_delay * (2 ** attempt)
                 self.logger.warning(f"API error occurred. Retrying in {delay} seconds... (Attempt {attempt + 1}/{max_retries})")
                 await asyncio.sleep(delay)
 
+    def log_speech_savings(self, normalizer):
+        self.speech_chars_saved += normalizer.saved()
+        SPEECH_CHARS.inc(normalizer.chars_in, stage="received")
+        SPEECH_CHARS.inc(normalizer.chars_out, stage="spoken")
+        self.logger.info(f"Speech normalization: {normalizer.chars_out} of {normalizer.chars_in} characters spoken "
+                         f"({normalizer.saved()} saved, {self.speech_chars_saved} this session)")
+
+    def read_usage(self, source, usage):
+        usage["input_tokens"] = source.input_tokens or 0
+        usage["output_tokens"] = source.output_tokens or 0
+        usage["cache_write_tokens"] = getattr(source, "cache_creation_input_tokens", 0) or 0
+        usage["cache_read_tokens"] = getattr(source, "cache_read_input_tokens", 0) or 0
+
+    def record_usage(self, model, usage):
+        for name, count in usage.items():
+            if count:
+                TOKENS.inc(count, type=name.replace("_tokens", ""))
+        if self.usage_manager and any(usage.values()):
+            self.usage_manager.record_message(model, usage)
+
+    async def open_stream(self, model, messages):
+        stream = await self.client.messages.create(
+            model=model,
+            max_tokens=self.max_tokens,
+            messages=messages,
+            system=self.system_param(model=model),
+            stream=True,
+            extra_headers=self.request_headers(),
+            **self.sampling_params()
+        )
+        try:
+            iterator = stream.__aiter__()
+            events, arrivals = [], []
+            async for chunk in iterator:
+                events.append(chunk)
+                arrivals.append(time.monotonic())
+                if chunk.type == "message_stop" or (chunk.type == "content_block_delta" and getattr(chunk.delta, "text", None)):
+                    break
+            return OpenedStream(model, stream, iterator, events, arrivals)
+        except BaseException:
+            await stream.close()
+            raise
+
+    async def discard_stream(self, opened):
+        usage = {"input_tokens": 0, "output_tokens": 0, "cache_write_tokens": 0, "cache_read_tokens": 0}
+        for chunk in opened.events:
+            if chunk.type == "message_start":
+                self.read_usage(chunk.message.usage, usage)
+        self.record_usage(opened.model, usage)
+        await opened.stream.close()
+
+    async def open_hedged_stream(self, messages):
+        # Sends the turn to the configured model. If no text arrives within the
+        # hedge deadline, or the request fails first, the same turn is also sent
+        # to the fallback model; the first stream to produce text wins and the
+        # other request is cancelled.
+        can_hedge = bool(self.fallback_model) and self.fallback_model != self.model
+        pending = {asyncio.create_task(self.open_stream(self.model, messages))}
+        hedge_task = None
+        winner, error = None, None
+        try:
+            while pending and winner is None:
+                timeout = self.hedge_deadline_ms / 1000 if can_hedge and hedge_task is None else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        self.logger.warning(f"Stream request failed: {str(error)}")
+                    elif winner is None:
+                        winner = task.result()
+                    else:
+                        await self.discard_stream(task.result())
+
+                if winner is None and can_hedge and hedge_task is None:
+                    reason = "primary request failed" if done else f"no first token after {self.hedge_deadline_ms} ms"
+                    self.hedge_stats["fired"] += 1
+                    HEDGES.inc(result="fired")
+                    self.logger.warning(f"Hedging with {self.fallback_model}: {reason} "
+                                        f"(fired {self.hedge_stats['fired']} of {self.hedge_stats['turns']} turns)")
+                    hedge_task = asyncio.create_task(self.open_stream(self.fallback_model, messages))
+                    pending.add(hedge_task)
+        finally:
+            for task in pending:
+                task.cancel()
+            # A request may have opened its stream before it was cancelled.
+            for result in await asyncio.gather(*pending, return_exceptions=True):
+                if isinstance(result, OpenedStream):
+                    await self.discard_stream(result)
+
+        if winner is None:
+            raise error
+        if winner.model != self.model:
+            self.hedge_stats["fallback_won"] += 1
+            HEDGES.inc(result="fallback_won")
+            self.logger.info(f"Fallback model {winner.model} answered first "
+                             f"({self.hedge_stats['fallback_won']} of {self.hedge_stats['fired']} hedges)")
+        return winner
+
+    def sampling_params(self):
+        params = {}
+        if self.temperature is not None:
+            params["temperature"] = self.temperature
+        if self.top_p is not None:
+            params["top_p"] = self.top_p
+        return params
+
     def format_messages(self, message, history):
         formatted_messages = [{"role": entry["role"], "content": entry["content"]} for entry in history]
         formatted_messages.append({"role": "user", "content": message})
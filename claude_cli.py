@@ -1,58 +1,250 @@
 import os
+import re
+import asyncio
 import logging
 from colorama import init, Fore, Style
 import boto3
+from botocore.config import Config
 from stt_manager import STTManager
-from history_manager import HistoryManager
+from profile_manager import ProfileManager
 from claude_api_manager import ClaudeAPIManager
 from log_manager import LogManager
 from config_manager import ConfigManager
 from audio_manager import AudioManager
+from usage_manager import UsageManager
+from input_reader import InputReader
+from memory_monitor import MemoryMonitor, rss_bytes
+from audio_worker import AudioWorker
+import session_trace
+import event_bus
+import metrics
 
 
 class ClaudeCLI:
-    def __init__(self):
-        self.config_manager = ConfigManager()
-        self.log_manager = LogManager(self.config_manager)
+    def __init__(self, profiler=None, config_manager=None, log_manager=None):
+        self.profiler = profiler
+        self.config_manager = config_manager or ConfigManager()
+        self.log_manager = log_manager or LogManager(self.config_manager)
         self.logger = self.log_manager.get_logger()
-        self.history_manager = HistoryManager(self.config_manager, self.log_manager)
-        self.claude_api = ClaudeAPIManager(self.config_manager, self.log_manager)
+        self.usage_manager = UsageManager(self.config_manager, self.log_manager)
+        self.claude_api = ClaudeAPIManager(self.config_manager, self.log_manager, self.usage_manager)
+        self.profile_manager = ProfileManager(self.config_manager, self.log_manager, self.claude_api)
+        self.history_manager = self.profile_manager.active.history_manager
         self.show_tokens = False
         self.speech_enabled = self.config_manager.get_speech_enabled()
         self.text_output_enabled = self.config_manager.get_text_output_enabled()
-        self.polly_client = boto3.client('polly',
-                                         aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-                                         aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-                                         region_name=os.getenv("AWS_REGION"))
-        self.audio_manager = AudioManager(self.config_manager, self.polly_client)
-        self.stt_manager = STTManager(self.config_manager, self.log_manager)
+        self.audio_manager = self.create_audio_manager()
+        self.stt_manager = STTManager(self.config_manager, self.log_manager, self.usage_manager)
         self.stt_enabled = self.config_manager.get_stt_enabled()
+        self.input_source = "typed"
+        self.input_reader = self.create_input_reader()
+        self.audio_worker = None
+        if self.config_manager.get_audio_worker():
+            self.start_audio_worker()
+        self.config_manager.subscribe(["audio_worker"], self.on_audio_worker_change)
+        self.metrics_server = None
+        metrics.registry.gauge("claude_cli_resident_memory_bytes", "Resident set size of the main process", rss_bytes)
+        metrics.registry.gauge("claude_cli_audio_worker_events_total", "Audio worker capture and playback events, by event",
+                               self.audio_worker_counters, kind="counter")
+        metrics.registry.gauge("claude_cli_circuit_open", "1 while a service's circuit breaker is not closed, by service",
+                               self.circuit_states)
+        self.start_metrics_server(self.config_manager.get_metrics_port())
+        self.config_manager.subscribe(["metrics_port"], lambda config, changed: self.start_metrics_server(config.metrics_port))
+        self.event_server = None
+        self.start_event_server(self.config_manager.get_event_socket_path())
+        self.config_manager.subscribe(["event_socket_path", "event_buffer_size"],
+                                      lambda config, changed: self.start_event_server(config.event_socket_path))
+        self.config_manager.subscribe(["speech_enabled", "text_output_enabled", "stt_enabled"], self.on_config_change)
+        self.memory_monitor = MemoryMonitor(self.config_manager.get_memory_report_interval())
+        if self.config_manager.get_memory_budget_mode():
+            self.memory_monitor.start()
+        self.config_manager.subscribe(["memory_budget_mode", "memory_report_interval"], self.on_memory_config_change)
         self.logger.info("ClaudeCLI initialized successfully")
 
-    async def send_message(self, message):
-        response = await self.claude_api.send_message(
-            message, 
-            self.history_manager.get_history(), 
-            self.speech_enabled, 
-            self.text_output_enabled, 
-            self.show_tokens, 
-            self.audio_manager
-        )
+    def create_audio_manager(self):
+        # Session replay overrides this and create_input_reader.
+        polly_client = boto3.client('polly',
+                                    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+                                    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+                                    region_name=os.getenv("AWS_REGION"),
+                                    # Short timeouts so an outage is detected quickly.
+                                    config=Config(connect_timeout=self.config_manager.get_polly_timeout_seconds(),
+                                                  read_timeout=self.config_manager.get_polly_timeout_seconds(),
+                                                  retries={"max_attempts": 1}))
+        return AudioManager(self.config_manager, polly_client, self.usage_manager)
+
+    def create_input_reader(self):
+        return InputReader(self.log_manager.log_dir)
+
+    def on_config_change(self, config, changed):
+        if "speech_enabled" in changed:
+            self.speech_enabled = config.speech_enabled
+        if "text_output_enabled" in changed:
+            self.text_output_enabled = config.text_output_enabled
+        if "stt_enabled" in changed:
+            self.stt_enabled = config.stt_enabled
+
+    def start_audio_worker(self):
+        try:
+            self.audio_worker = AudioWorker(self.stt_manager.stt_sample_rate, self.stt_manager.stt_chunk_size,
+                                            realtime_priority=self.config_manager.get_audio_realtime_priority(),
+                                            cpus=self.config_manager.get_audio_cpu_affinity())
+            self.audio_worker.start()
+        except Exception as e:
+            self.logger.error(f"Could not start the audio worker process: {str(e)}. Using in-process audio.")
+            self.audio_worker = None
+        self.audio_manager.audio_worker = self.audio_worker
+        self.stt_manager.audio_worker = self.audio_worker
+
+    def stop_audio_worker(self):
+        worker, self.audio_worker = self.audio_worker, None
+        self.audio_manager.audio_worker = None
+        self.stt_manager.audio_worker = None
+        if worker:
+            worker.stop()
+
+    def start_metrics_server(self, port):
+        if self.metrics_server:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        if not port:
+            return
+        try:
+            self.metrics_server = metrics.MetricsServer(port)
+            self.metrics_server.start()
+        except OSError as e:
+            self.logger.error(f"Could not serve metrics on port {port}: {str(e)}")
+            self.metrics_server = None
+
+    def start_event_server(self, path):
+        # Clients that are connected when the settings change reconnect.
+        if self.event_server:
+            self.event_server.stop()
+            self.event_server = None
+        if not path:
+            return
+        try:
+            self.event_server = event_bus.EventSocketServer(path, self.config_manager.get_event_buffer_size())
+            self.event_server.start()
+        except OSError as e:
+            self.logger.error(f"Could not publish events on {path}: {str(e)}")
+            self.event_server = None
+
+    def audio_worker_counters(self):
+        if not self.audio_worker:
+            return None
+        return {metrics.label_key({"event": name}): value for name, value in self.audio_worker.get_counters().items()}
+
+    def circuit_states(self):
+        breakers = [self.audio_manager.polly_breaker] + list(self.stt_manager.breakers.values())
+        return {metrics.label_key({"service": breaker.name}): int(breaker.state != breaker.CLOSED) for breaker in breakers}
+
+    def on_audio_worker_change(self, config, changed):
+        # A capture or playback already running finishes where it started.
+        if config.audio_worker and not self.audio_worker:
+            self.start_audio_worker()
+        elif not config.audio_worker and self.audio_worker:
+            self.stop_audio_worker()
+
+    def on_memory_config_change(self, config, changed):
+        self.memory_monitor.stop()
+        self.memory_monitor.interval = config.memory_report_interval
+        if config.memory_budget_mode:
+            self.memory_monitor.start()
+
+    async def send_message(self, message, source="typed"):
+        session_trace.record(session_trace.TURN_START, {"source": source, "text": message})
+        event_bus.publish("turn_start", source=source, text=message)
+        # Text is shown while speech output is down, even if turned off.
+        text_output_enabled = self.text_output_enabled or (self.speech_enabled and self.audio_manager.speech_degraded())
+        try:
+            response = await self.claude_api.send_message(
+                message, 
+                self.history_manager.get_history(), 
+                self.speech_enabled, 
+                text_output_enabled, 
+                self.show_tokens, 
+                self.audio_manager
+            )
+        except Exception:
+            event_bus.publish("turn_end", outcome="error")
+            raise
+        event_bus.publish("turn_end", outcome="ok")
         self.history_manager.add_message("user", message)
         self.history_manager.add_message("assistant", response)
         self.history_manager.save_history()  # Save history once after both messages are added
+        session_trace.record(session_trace.TURN_END, {})
 
-    async def display_history(self):
+    async def display_history(self, args=""):
         self.logger.info("Displaying conversation history")
-        for entry in self.history_manager.history:
-            role = entry["role"].capitalize()
-            content = entry["content"]
-            color = Fore.YELLOW if role == "User" else Fore.GREEN
-            print(f"{color}{role}: {content}{Style.RESET_ALL}")
-            if self.show_tokens:
-                tokens = await self.claude_api.count_tokens(content)
-                print(f"{Fore.CYAN}Tokens: {tokens}{Style.RESET_ALL}")
-            print()
+        total = self.history_manager.message_count()
+        page_size = self.config_manager.get_history_display_page_size()
+        selection = self.parse_history_selection(args, total, page_size)
+        if selection is None:
+            print(f"{Fore.RED}Usage: history [all | <page> | <first>-<last>]{Style.RESET_ALL}")
+            return
+        start, end = selection
+        if start >= end:
+            print(f"{Fore.MAGENTA}No conversation history to show.{Style.RESET_ALL}")
+            return
+
+        for page_start in range(start, end, page_size):
+            page_end = min(page_start + page_size, end)
+            entries = self.history_manager.get_messages(page_start, page_end)
+            token_counts = await self.get_token_counts(page_start, entries) if self.show_tokens else None
+            for offset, entry in enumerate(entries):
+                role = entry["role"].capitalize()
+                content = entry["content"]
+                color = Fore.YELLOW if role == "User" else Fore.GREEN
+                print(f"{color}[{page_start + offset + 1}] {role}: {content}{Style.RESET_ALL}")
+                if token_counts:
+                    print(f"{Fore.CYAN}Tokens: {token_counts[offset]}{Style.RESET_ALL}")
+                print()
+            if page_end < end:
+                answer = await self.input_reader.read_line(
+                    f"{Fore.MAGENTA}-- {page_end}/{end} shown. Press Enter for more, q to stop --{Style.RESET_ALL}",
+                    add_history=False)
+                if answer.strip().lower() == "q":
+                    break
+
+    def parse_history_selection(self, args, total, page_size):
+        # Returns a 0-based [start, end) range of messages, or None if invalid.
+        args = args.strip().lower()
+        if not args:
+            last_page = max(0, (total - 1) // page_size)
+            return last_page * page_size, total
+        if args == "all":
+            return 0, total
+        if args.isdigit() and int(args) >= 1:
+            start = (int(args) - 1) * page_size
+            return min(start, total), min(start + page_size, total)
+        first, _, last = args.partition("-")
+        if first.isdigit() and last.isdigit() and 1 <= int(first) <= int(last):
+            return min(int(first) - 1, total), min(int(last), total)
+        return None
+
+    async def get_token_counts(self, start, entries):
+        token_counts = self.history_manager.get_token_counts(start, start + len(entries))
+        missing = [i for i, count in enumerate(token_counts) if count is None]
+        if not missing:
+            return token_counts
+
+        semaphore = asyncio.Semaphore(self.config_manager.get_history_token_concurrency())
+
+        async def count_tokens(i):
+            async with semaphore:
+                return await self.claude_api.count_tokens(entries[i]["content"])
+
+        results = await asyncio.gather(*(count_tokens(i) for i in missing), return_exceptions=True)
+        new_counts = {}
+        for i, result in zip(missing, results):
+            if isinstance(result, Exception):
+                self.logger.error(f"Error counting tokens for message {start + i + 1}: {str(result)}")
+                continue
+            token_counts[i] = result
+            new_counts[start + i] = result
+        self.history_manager.set_token_counts(new_counts)
+        return token_counts
 
     def display_system_prompt(self):
         self.logger.info("Displaying system prompt")
@@ -63,6 +255,16 @@ class ClaudeCLI:
         self.logger.info("Displaying model information")
         print(f"{Fore.CYAN}Current model: {self.claude_api.model}")
         print(f"Max tokens: {self.claude_api.max_tokens}")
+        print(f"Temperature: {self.claude_api.temperature if self.claude_api.temperature is not None else 'default'}")
+        print(f"Top P: {self.claude_api.top_p if self.claude_api.top_p is not None else 'default'}")
+        if self.claude_api.fallback_model:
+            stats = self.claude_api.hedge_stats
+            print(f"Fallback model: {self.claude_api.fallback_model} after {self.claude_api.hedge_deadline_ms} ms "
+                  f"(hedged {stats['fired']} of {stats['turns']} turns, fallback won {stats['fallback_won']})")
+        print(f"Polly engine: {self.audio_manager.aws_polly_engine} ({self.config_manager.get_tts_polly_engine_mode()})")
+        for engine, (count, median, p95) in sorted(self.audio_manager.engine_selector.stats().items()):
+            timing = f"median {median * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms" if median is not None else "too few samples"
+            print(f"  {engine}: {count} recent requests, {timing}")
         print(f"Log level: {self.logger.level}{Style.RESET_ALL}")
 
     def toggle_tokens(self):
@@ -83,6 +285,27 @@ class ClaudeCLI:
         logging.info(f"Text output toggled {status}")
         print(f"{Fore.MAGENTA}Text output is now {status}.{Style.RESET_ALL}")
 
+    def display_profiles(self):
+        self.logger.info("Displaying profiles")
+        print(f"{Fore.CYAN}Profiles:")
+        for name, prompt_file in self.profile_manager.get_prompt_files().items():
+            profile = self.profile_manager.profiles.get(name)
+            marker = "*" if profile is self.profile_manager.active else " "
+            details = ""
+            if profile:
+                tokens = profile.prompt_tokens if profile.prompt_tokens is not None else "?"
+                details = f"{tokens} prompt tokens, {profile.history_manager.message_count()} messages"
+            print(f"{marker} {name:<16} {prompt_file:<28} {details}")
+        print(f"Use 'profile <name>' to switch.{Style.RESET_ALL}")
+
+    def switch_profile(self, name):
+        profile = self.profile_manager.switch(name)
+        if profile is None:
+            print(f"{Fore.RED}Unknown profile '{name}'. Type 'profile' to list profiles.{Style.RESET_ALL}")
+            return
+        self.history_manager = profile.history_manager
+        print(f"{Fore.MAGENTA}Switched to profile '{name}' ({self.history_manager.message_count()} messages in its history).{Style.RESET_ALL}")
+
     def clear_history(self):
         self.history_manager.clear_history()
         print(f"{Fore.MAGENTA}Conversation history cleared and backed up.{Style.RESET_ALL}")
@@ -92,10 +315,13 @@ class ClaudeCLI:
         print(f"{Fore.CYAN}Available commands:")
         print("  exit    - Quit the application")
         print("  system  - Display the current system prompt")
-        print("  history - Show the conversation history")
+        print("  history - Show the latest page of conversation history")
+        print("            (history all, history <page> or history <first>-<last> for more)")
         print("  model   - Display the current Claude model being used")
+        print("  profile - List profiles, or switch with profile <name>")
         print("  clear   - Clear the conversation history (creates a backup)")
         print("  tokens  - Toggle the display of token counts")
+        print("  usage   - Show usage and estimated cost per day and per session")
         print("  speech  - Toggle speech output")
         print("  text    - Toggle text output")
         print("  stt     - Toggle Speech-to-Text input")
@@ -110,23 +336,18 @@ class ClaudeCLI:
     async def run(self):
         try:
             self.logger.info("Starting Claude CLI")
+            if self.profiler:
+                self.profiler.start(asyncio.get_running_loop(), self.log_manager.log_dir)
+            self.profile_manager.start_warming()
+            self.config_manager.start_watching(asyncio.get_running_loop())
             print(f"{Fore.MAGENTA}Welcome to the Claude CLI. Type 'help' for available commands or 'exit' to quit.{Style.RESET_ALL}")
             while True:
-                if self.stt_enabled:
-                    try:
-                        user_input = await self.stt_manager.listen_for_speech()
-                        if user_input is None:
-                            continue  # Skip this iteration and prompt for input again
-                        if user_input == "GOODBYE_DETECTED":
-                            self.logger.info("Exiting Claude CLI due to 'goodbye' detection")
-                            break
-                        print(f"{Fore.YELLOW}You: {user_input}{Style.RESET_ALL}")
-                    except Exception as e:
-                        self.logger.error(f"Error in speech recognition: {str(e)}")
-                        print(f"{Fore.RED}Speech recognition failed. Please type your input.{Style.RESET_ALL}")
-                        user_input = input(f"{Fore.YELLOW}You: {Style.RESET_ALL}").strip()
-                else:
-                    user_input = input(f"{Fore.YELLOW}You: {Style.RESET_ALL}").strip()
+                user_input = await self.get_user_input()
+                if user_input is None:
+                    continue  # Skip this iteration and prompt for input again
+                if user_input == "GOODBYE_DETECTED":
+                    self.logger.info("Exiting Claude CLI due to 'goodbye' detection")
+                    break
 
                 if not user_input:
                     continue  # Skip empty input
@@ -138,14 +359,21 @@ class ClaudeCLI:
                     break
                 elif user_input.lower() == 'system':
                     self.display_system_prompt()
-                elif user_input.lower() == 'history':
-                    await self.display_history()
+                elif re.fullmatch(r'history(\s+(all|\d+|\d+-\d+))?', user_input.lower()):
+                    await self.display_history(user_input[len('history'):])
+                elif user_input.lower() == 'profile':
+                    self.display_profiles()
+                elif re.fullmatch(r'profile\s+\S+', user_input.lower()):
+                    self.switch_profile(user_input.split()[1])
                 elif user_input.lower() == 'model':
                     self.display_model()
                 elif user_input.lower() == 'clear':
                     self.clear_history()
                 elif user_input.lower() == 'tokens':
                     self.toggle_tokens()
+                elif user_input.lower() == 'usage':
+                    self.logger.info("Displaying usage")
+                    self.usage_manager.display_usage()
                 elif user_input.lower() == 'speech':
                     self.toggle_speech()
                 elif user_input.lower() == 'text':
@@ -155,13 +383,56 @@ class ClaudeCLI:
                 elif user_input.lower() == 'help':
                     self.display_help()
                 else:
-                    await self.send_message(user_input)
+                    await self.send_message(user_input, self.input_source)
         finally:
             self.shutdown()
 
+    async def get_user_input(self):
+        # Typed input and speech race; whichever finishes first starts the
+        # turn. An unfinished typed line carries over to the next call.
+        prompt = f"{Fore.YELLOW}You: {Style.RESET_ALL}"
+        self.input_source = "typed"
+        try:
+            if not self.stt_enabled:
+                return (await self.input_reader.read_line(prompt)).strip()
+            typed = asyncio.ensure_future(self.input_reader.read_line(prompt))
+            spoken = asyncio.ensure_future(self.stt_manager.listen_for_speech())
+            done, _ = await asyncio.wait({typed, spoken}, return_when=asyncio.FIRST_COMPLETED)
+            if typed in done:
+                spoken.cancel()
+                await asyncio.gather(spoken, return_exceptions=True)
+                return typed.result().strip()
+            # The typed read cannot be interrupted, so its prompt is cleared
+            # here and drawn again when it is next waited for.
+            self.input_reader.hide_prompt()
+            try:
+                user_input = spoken.result()
+            except Exception as e:
+                self.logger.error(f"Error in speech recognition: {str(e)}")
+                print(f"{Fore.RED}Speech recognition failed. Please type your input.{Style.RESET_ALL}")
+                typed.cancel()
+                return (await self.input_reader.read_line(prompt)).strip()
+            typed.cancel()
+            self.input_source = "spoken"
+            if user_input and user_input != "GOODBYE_DETECTED":
+                print(f"{Fore.YELLOW}You: {user_input}{Style.RESET_ALL}")
+            return user_input
+        except EOFError:
+            return "exit"
+
     def shutdown(self):
         self.logger.info("Shutting down Claude CLI")
+        self.config_manager.shutdown()  # No configuration changes while shutting down
         if hasattr(self.stt_manager, 'stop_audio'):
             self.stt_manager.stop_audio.set()
         self.audio_manager.shutdown()
+        self.stop_audio_worker()
+        if self.profiler:
+            self.profiler.stop()
+        self.memory_monitor.stop()
+        self.start_metrics_server(0)
+        self.start_event_server("")
+        self.input_reader.save_history()
+        self.usage_manager.close()
+        session_trace.stop_recording()
         self.logger.info("Claude CLI shutdown complete")
\ No newline at end of file
@@ -1,12 +1,195 @@
+import os
 import json
 import logging
-from dotenv import load_dotenv
-from colorama import init, Fore, Style
+import threading
+from dataclasses import dataclass, field, fields, replace
+from types import MappingProxyType
+from typing import Optional, Mapping, Tuple
+
+
+class ConfigError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    system_prompt_file: str = "system_prompt.txt"
+    profile: str = "default"
+    prompt_cache: bool = True
+    model: str = "claude-3-sonnet-20240229"
+    temperature: Optional[float] = None
+    top_p: Optional[float] = None
+    max_tokens: int = 4096
+    log_level: str = "INFO"
+    speech_enabled: bool = True
+    text_output_enabled: bool = True
+    stt_enabled: bool = False
+    deepgram_model: str = "general"
+    aws_polly_voice: str = "Ruth"
+    aws_polly_engine: str = "neural"
+    tts_chunking: str = "adaptive"
+    tts_first_chunk_words: int = 8
+    tts_chunk_char_budget: int = 200
+    tts_normalize: bool = True
+    tts_backend: str = "auto"
+    tts_local_command: Tuple[str, ...] = ("espeak-ng", "-w", "{output}", "--stdin")
+    tts_polly_p95_budget_ms: int = 1500
+    tts_polly_engine_mode: str = "fixed"
+    tts_polly_fast_engines: Tuple[str, ...] = ("neural",)
+    tts_polly_lead_ms: int = 500
+    stt_backend: str = "deepgram"
+    stt_vosk_model_path: str = "models/vosk-model-small-en-us-0.15"
+    stt_encoding: str = "linear16"
+    stt_endpointing: str = "adaptive"
+    endpointing_min_ms: int = 250
+    endpointing_max_ms: int = 1500
+    wake_word_mode: str = "off"
+    wake_word_model_path: str = ""
+    wake_word_threshold: float = 0.5
+    wake_word_preroll_ms: int = 1000
+    config_watch_interval: float = 2.0
+    history_page_size: int = 50
+    history_cache_pages: int = 4
+    history_display_page_size: int = 10
+    history_token_concurrency: int = 4
+    render_fps: int = 30
+    fallback_model: str = ""
+    hedge_ttft_deadline_ms: int = 2500
+    circuit_failure_rate: float = 0.5
+    circuit_window_seconds: float = 60.0
+    circuit_min_calls: int = 3
+    circuit_open_seconds: float = 30.0
+    polly_timeout_seconds: float = 5.0
+    deepgram_connect_timeout: float = 5.0
+    audio_worker: bool = False
+    audio_realtime_priority: int = 0
+    audio_cpu_affinity: Tuple[int, ...] = ()
+    metrics_port: int = 0
+    event_socket_path: str = ""
+    event_buffer_size: int = 256
+    memory_budget_mode: bool = False
+    audio_queue_max_files: int = 8
+    stt_queue_max_seconds: float = 10.0
+    history_resident_max: int = 200
+    memory_report_interval: float = 300.0
+    # Keys this version does not know about are kept, but not validated.
+    extra: Mapping = field(default_factory=lambda: MappingProxyType({}))
+
+    CHOICES = {
+        "log_level": ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"),
+        "aws_polly_engine": ("standard", "neural", "long-form", "generative"),
+        "tts_chunking": ("adaptive", "sentence"),
+        "tts_backend": ("auto", "polly", "local"),
+        "tts_polly_engine_mode": ("fixed", "tiered"),
+        "stt_endpointing": ("adaptive", "fixed"),
+        "stt_backend": ("deepgram", "vosk"),
+        "stt_encoding": ("linear16", "mulaw", "opus"),
+        "wake_word_mode": ("off", "energy", "onnx"),
+    }
+    RANGES = {
+        "temperature": (0, 1),
+        "top_p": (0, 1),
+        "max_tokens": (1, None),
+        "tts_first_chunk_words": (1, None),
+        "tts_chunk_char_budget": (1, None),
+        "tts_polly_p95_budget_ms": (0, None),
+        "tts_polly_lead_ms": (0, None),
+        "wake_word_threshold": (0, 1),
+        "wake_word_preroll_ms": (0, 10000),
+        "config_watch_interval": (0, None),
+        "history_page_size": (2, None),
+        "history_cache_pages": (1, None),
+        "history_display_page_size": (1, None),
+        "history_token_concurrency": (1, None),
+        "render_fps": (1, 240),
+        "hedge_ttft_deadline_ms": (0, None),
+        "circuit_failure_rate": (0, 1),
+        "circuit_window_seconds": (1, None),
+        "circuit_min_calls": (1, None),
+        "circuit_open_seconds": (1, None),
+        "polly_timeout_seconds": (1, None),
+        "deepgram_connect_timeout": (1, None),
+        "audio_queue_max_files": (1, None),
+        "stt_queue_max_seconds": (1, None),
+        "history_resident_max": (2, None),
+        "memory_report_interval": (1, None),
+        "endpointing_min_ms": (50, 5000),
+        "endpointing_max_ms": (100, 10000),
+        "metrics_port": (0, 65535),
+        "event_buffer_size": (1, None),
+        "audio_realtime_priority": (0, 99),
+    }
+
+    @classmethod
+    def from_dict(cls, data, strict=True):
+        # Builds a validated snapshot. With strict=False, invalid values are
+        # logged and replaced by their defaults instead of raising ConfigError.
+        values, errors = {}, []
+        known = {f.name: f for f in fields(cls) if f.name != "extra"}
+        for key, value in data.items():
+            if key not in known:
+                continue
+            try:
+                values[key] = cls.validate(key, value, known[key].default)
+            except ConfigError as e:
+                errors.append(str(e))
+
+        if errors and strict:
+            raise ConfigError("; ".join(errors))
+        for error in errors:
+            logging.error(f"Invalid configuration: {error}. Using default value.")
+
+        extra = {key: value for key, value in data.items() if key not in known}
+        return cls(**values, extra=MappingProxyType(extra))
+
+    @classmethod
+    def validate(cls, key, value, default):
+        if default is None:
+            if value is None:
+                return None
+            expected = float
+        else:
+            expected = type(default)
+
+        if expected is float and isinstance(value, int) and not isinstance(value, bool):
+            value = float(value)
+        elif expected is tuple and isinstance(value, list):
+            value = tuple(value)
+        if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+            raise ConfigError(f"{key} must be of type {expected.__name__}, got {value!r}")
+
+        if key == "log_level":
+            value = value.upper()
+        if key in cls.CHOICES and value not in cls.CHOICES[key]:
+            raise ConfigError(f"{key} must be one of {', '.join(cls.CHOICES[key])}, got {value!r}")
+        if key in cls.RANGES:
+            low, high = cls.RANGES[key]
+            if (low is not None and value < low) or (high is not None and value > high):
+                raise ConfigError(f"{key} is out of range: {value!r}")
+        return value
+
+    def get(self, key, default=None):
+        if key != "extra" and key in self.__dataclass_fields__:
+            return getattr(self, key)
+        return self.extra.get(key, default)
+
+    def changed_keys(self, other):
+        changed = {f.name for f in fields(self) if f.name != "extra" and getattr(self, f.name) != getattr(other, f.name)}
+        changed |= {key for key in set(self.extra) | set(other.extra) if self.extra.get(key) != other.extra.get(key)}
+        return changed
+
 
 class ConfigManager:
     def __init__(self, config_file="config.json"):
         self.config_file = config_file
-        self.config = self.load_config()
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.watch_thread = None
+        self.loop = None
+        self.loop_thread = None
+        self.stop_watching = threading.Event()
+        self.last_modified = self.get_modified_time()
+        self.snapshot = ConfigSnapshot.from_dict(self.load_config(), strict=False)
 
     def load_config(self):
         try:
@@ -21,35 +204,256 @@ class ConfigManager:
             logging.error(f"Error decoding {self.config_file}. Using default configuration.")
             return {}
 
+    def get_modified_time(self):
+        try:
+            stat = os.stat(self.config_file)
+            return (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return None
+
+    def subscribe(self, keys, callback):
+        # callback(snapshot, changed_keys) is called whenever any of the given
+        # keys changes. Changes found by the watcher are applied on the event
+        # loop passed to start_watching(), between the steps of other tasks,
+        # so callbacks may change state that the loop owns without locking.
+        # update() calls them straight away on the calling thread.
+        self.subscribers.append((frozenset(keys), callback))
+
+    def update(self, **values):
+        defaults = ConfigSnapshot.__dataclass_fields__
+        validated = {key: ConfigSnapshot.validate(key, value, defaults[key].default) for key, value in values.items()}
+        return self.apply(replace(self.snapshot, **validated))
+
+    def apply(self, snapshot):
+        with self.lock:
+            # Readers always see either the old or the new snapshot, never a mix.
+            previous, self.snapshot = self.snapshot, snapshot
+            changed = snapshot.changed_keys(previous)
+        if not changed:
+            return changed
+        logging.info(f"Configuration changed: {', '.join(sorted(changed))}")
+        if self.loop and threading.get_ident() != self.loop_thread:
+            try:
+                self.loop.call_soon_threadsafe(self.notify, snapshot, changed, True)
+            except RuntimeError:
+                pass  # The loop has closed; the application is exiting
+        else:
+            self.notify(snapshot, changed)
+        return changed
+
+    def notify(self, snapshot, changed, from_watcher=False):
+        if from_watcher and self.stop_watching.is_set():
+            return  # Arrived after shutdown started
+        for keys, callback in self.subscribers:
+            if keys & changed:
+                try:
+                    callback(snapshot, changed)
+                except Exception as e:
+                    logging.error(f"Error applying configuration change: {str(e)}")
+
+    def reload(self):
+        try:
+            with open(self.config_file, "r") as f:
+                data = json.load(f)
+            snapshot = ConfigSnapshot.from_dict(data)
+        except (OSError, json.JSONDecodeError, ConfigError) as e:
+            logging.error(f"Not reloading {self.config_file}: {str(e)}. Keeping current configuration.")
+            return set()
+        return self.apply(snapshot)
+
+    def start_watching(self, loop=None):
+        # Called on the loop's own thread.
+        if self.snapshot.config_watch_interval <= 0 or self.watch_thread:
+            return
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.stop_watching.clear()
+        self.watch_thread = threading.Thread(target=self.watch_config, daemon=True)
+        self.watch_thread.start()
+
+    def watch_config(self):
+        logging.info(f"Watching {self.config_file} for changes")
+        while not self.stop_watching.wait(self.snapshot.config_watch_interval or 2.0):
+            modified = self.get_modified_time()
+            if modified != self.last_modified:
+                self.last_modified = modified
+                self.reload()
+
+    def shutdown(self):
+        self.stop_watching.set()
+        if self.watch_thread:
+            self.watch_thread.join()
+            self.watch_thread = None
+
     def get(self, key, default=None):
-        return self.config.get(key, default)
+        return self.snapshot.get(key, default)
 
     def get_model(self):
-        return self.get("model", "claude-3-sonnet-20240229")
+        return self.snapshot.model
+
+    def get_temperature(self):
+        return self.snapshot.temperature
+
+    def get_top_p(self):
+        return self.snapshot.top_p
 
     def get_max_tokens(self):
-        return self.get("max_tokens", 4096)
+        return self.snapshot.max_tokens
 
     def get_speech_enabled(self):
-        return self.get("speech_enabled", True)
+        return self.snapshot.speech_enabled
 
     def get_text_output_enabled(self):
-        return self.get("text_output_enabled", True)
+        return self.snapshot.text_output_enabled
 
     def get_stt_enabled(self):
-        return self.get("stt_enabled", False)
+        return self.snapshot.stt_enabled
 
     def get_deepgram_model(self):
-        return self.get("deepgram_model", "general")
+        return self.snapshot.deepgram_model
 
     def get_log_level(self):
-        return self.get("log_level", "INFO")
+        return self.snapshot.log_level
 
     def get_system_prompt_file(self):
-        return self.get("system_prompt_file", "system_prompt.txt")
+        return self.snapshot.system_prompt_file
 
     def get_aws_polly_voice(self):
-        return self.get("aws_polly_voice", "Ruth")
+        return self.snapshot.aws_polly_voice
 
     def get_aws_polly_engine(self):
-        return self.get("aws_polly_engine", "neural")
\ No newline at end of file
+        return self.snapshot.aws_polly_engine
+
+    def get_tts_chunking(self):
+        return self.snapshot.tts_chunking
+
+    def get_tts_first_chunk_words(self):
+        return self.snapshot.tts_first_chunk_words
+
+    def get_tts_chunk_char_budget(self):
+        return self.snapshot.tts_chunk_char_budget
+
+    def get_tts_normalize(self):
+        return self.snapshot.tts_normalize
+
+    def get_tts_polly_engine_mode(self):
+        return self.snapshot.tts_polly_engine_mode
+
+    def get_tts_polly_fast_engines(self):
+        return list(self.snapshot.tts_polly_fast_engines)
+
+    def get_tts_polly_lead_ms(self):
+        return self.snapshot.tts_polly_lead_ms
+
+    def get_tts_backend(self):
+        return self.snapshot.tts_backend
+
+    def get_tts_local_command(self):
+        return list(self.snapshot.tts_local_command)
+
+    def get_tts_polly_p95_budget_ms(self):
+        return self.snapshot.tts_polly_p95_budget_ms
+
+    def get_stt_backend(self):
+        return self.snapshot.stt_backend
+
+    def get_stt_vosk_model_path(self):
+        return self.snapshot.stt_vosk_model_path
+
+    def get_stt_encoding(self):
+        return self.snapshot.stt_encoding
+
+    def get_history_page_size(self):
+        return self.snapshot.history_page_size
+
+    def get_history_cache_pages(self):
+        return self.snapshot.history_cache_pages
+
+    def get_history_display_page_size(self):
+        return self.snapshot.history_display_page_size
+
+    def get_history_token_concurrency(self):
+        return self.snapshot.history_token_concurrency
+
+    def get_render_fps(self):
+        return self.snapshot.render_fps
+
+    def get_fallback_model(self):
+        return self.snapshot.fallback_model
+
+    def get_hedge_ttft_deadline_ms(self):
+        return self.snapshot.hedge_ttft_deadline_ms
+
+    def get_wake_word_mode(self):
+        return self.snapshot.wake_word_mode
+
+    def get_wake_word_model_path(self):
+        return self.snapshot.wake_word_model_path
+
+    def get_wake_word_threshold(self):
+        return self.snapshot.wake_word_threshold
+
+    def get_wake_word_preroll_ms(self):
+        return self.snapshot.wake_word_preroll_ms
+
+    def get_memory_budget_mode(self):
+        return self.snapshot.memory_budget_mode
+
+    def get_audio_queue_max_files(self):
+        return self.snapshot.audio_queue_max_files
+
+    def get_stt_queue_max_seconds(self):
+        return self.snapshot.stt_queue_max_seconds
+
+    def get_history_resident_max(self):
+        return self.snapshot.history_resident_max
+
+    def get_memory_report_interval(self):
+        return self.snapshot.memory_report_interval
+
+    def get_profile(self):
+        return self.snapshot.profile
+
+    def get_prompt_cache(self):
+        return self.snapshot.prompt_cache
+
+    def get_circuit_settings(self):
+        return {
+            "failure_rate": self.snapshot.circuit_failure_rate,
+            "window_seconds": self.snapshot.circuit_window_seconds,
+            "min_calls": self.snapshot.circuit_min_calls,
+            "open_seconds": self.snapshot.circuit_open_seconds,
+        }
+
+    def get_polly_timeout_seconds(self):
+        return self.snapshot.polly_timeout_seconds
+
+    def get_deepgram_connect_timeout(self):
+        return self.snapshot.deepgram_connect_timeout
+
+    def get_audio_worker(self):
+        return self.snapshot.audio_worker
+
+    def get_audio_realtime_priority(self):
+        return self.snapshot.audio_realtime_priority
+
+    def get_audio_cpu_affinity(self):
+        return list(self.snapshot.audio_cpu_affinity)
+
+    def get_metrics_port(self):
+        return self.snapshot.metrics_port
+
+    def get_stt_endpointing(self):
+        return self.snapshot.stt_endpointing
+
+    def get_endpointing_min_ms(self):
+        return self.snapshot.endpointing_min_ms
+
+    def get_endpointing_max_ms(self):
+        return self.snapshot.endpointing_max_ms
+
+    def get_event_socket_path(self):
+        return self.snapshot.event_socket_path
+
+    def get_event_buffer_size(self):
+        return self.snapshot.event_buffer_size
@@ -0,0 +1,125 @@
+import json
+import time
+import logging
+import numpy as np
+
+
+class VoiceActivityDetector:
+    # Marks frames as speech when their level is well above an adaptive noise
+    # floor. The floor only follows frames that are not speech.
+    def __init__(self, ratio=3.0, min_level=200):
+        self.ratio = ratio
+        self.min_level = min_level
+        self.noise_floor = None
+
+    def is_speech(self, frame):
+        samples = np.frombuffer(frame, dtype=np.int16)
+        level = float(np.sqrt(np.mean(samples.astype(np.float32) ** 2))) if len(samples) else 0.0
+        if self.noise_floor is None:
+            self.noise_floor = level
+        if level > max(self.noise_floor * self.ratio, self.min_level):
+            return True
+        self.noise_floor = 0.95 * self.noise_floor + 0.05 * level
+        return False
+
+
+class PauseModel:
+    # Learns how long this user pauses in the middle of an utterance, from
+    # the silences in past utterances that were followed by more speech. The
+    # end-of-turn silence is set just above nearly all of them, so a fast
+    # speaker gets a short wait and a slow one is not cut off.
+    def __init__(self, path, min_ms=250, max_ms=1500, default_ms=700, quantile=0.95,
+                 margin_ms=100, min_samples=20, max_samples=500):
+        self.path = path
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.default_ms = default_ms
+        self.quantile = quantile
+        self.margin_ms = margin_ms
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.pauses = []
+        try:
+            with open(path, "r") as f:
+                self.pauses = [float(pause) for pause in json.load(f).get("pauses", [])][-max_samples:]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            logging.error(f"Error loading {path}: {str(e)}. Starting a new pause model.")
+
+    def threshold_ms(self):
+        if len(self.pauses) < self.min_samples:
+            threshold = self.default_ms
+        else:
+            samples = sorted(self.pauses)
+            threshold = samples[int(self.quantile * (len(samples) - 1))] + self.margin_ms
+        return min(max(threshold, self.min_ms), self.max_ms)
+
+    def add(self, pauses):
+        # The list is replaced rather than changed, so save() can run in
+        # another thread.
+        if pauses:
+            self.pauses = (self.pauses + list(pauses))[-self.max_samples:]
+
+    def save(self):
+        pauses = self.pauses
+        try:
+            with open(self.path, "w") as f:
+                json.dump({"pauses": pauses}, f)
+        except OSError as e:
+            logging.error(f"Error saving {self.path}: {str(e)}")
+
+
+class Endpointer:
+    # Decides when the user has finished speaking. The turn ends once the
+    # local VAD has heard threshold_ms of silence after speech and the
+    # transcript has stopped changing for stability_ms, or after max_ms of
+    # silence regardless. Silence is counted in audio time, from the frames
+    # themselves. feed() is called from the capture thread. on_end stops
+    # capture once the backend decides the turn is over.
+    def __init__(self, threshold_ms, max_ms, frame_ms, stability_ms=200, min_speech_ms=150, on_end=None):
+        self.threshold_ms = threshold_ms
+        self.max_ms = max_ms
+        self.frame_ms = frame_ms
+        self.stability_ms = stability_ms
+        self.min_speech_ms = min_speech_ms
+        self.speech_ms = 0
+        self.silence_ms = 0
+        self.heard_speech = False
+        self.pauses = []
+        self.text = ""
+        self.text_changed_at = None
+        self.reason = None
+        self.on_end = on_end
+
+    def feed(self, is_speech):
+        if is_speech:
+            if self.heard_speech and self.silence_ms:
+                self.pauses.append(self.silence_ms)
+            self.speech_ms += self.frame_ms
+            self.silence_ms = 0
+            self.heard_speech = self.heard_speech or self.speech_ms >= self.min_speech_ms
+        elif self.heard_speech:
+            self.silence_ms += self.frame_ms
+
+    def on_text(self, text):
+        if text != self.text:
+            self.text = text
+            self.text_changed_at = time.monotonic()
+
+    def should_end(self):
+        if not self.heard_speech or not self.text.strip():
+            return False
+        silence = self.silence_ms
+        if silence >= self.max_ms:
+            self.reason = "max_silence"
+            return True
+        stable = (time.monotonic() - self.text_changed_at) * 1000 >= self.stability_ms
+        if silence >= self.threshold_ms and stable:
+            self.reason = "pause"
+            return True
+        return False
+
+    def end(self):
+        if self.on_end:
+            self.on_end()
@@ -0,0 +1,173 @@
+import os
+import json
+import stat
+import time
+import socket
+import logging
+import itertools
+import threading
+from collections import deque
+import metrics
+
+DROPPED_EVENTS = metrics.registry.counter("claude_cli_events_dropped_total", "Events dropped because a subscriber was behind")
+
+# Event types and their fields:
+#   turn_start   {"source": "typed" | "spoken", "text": ...}
+#   response_start {"model": ..., "attempt": ...}  A retry starts the response over.
+#   delta        {"text": ...}                     Response text as it streams in
+#   sentence     {"text": ...}                     A chunk of the response, as split for speech
+#   tts_start    {"text": ...}                     Playback of a chunk started
+#   tts_end      {"text": ..., "seconds": ...}
+#   turn_end     {"outcome": "ok" | "error"}
+#   transcript   {"text": ..., "final": bool}      Speech recognition, interim and final
+#   dropped      {"count": ...}                    Sent to a subscriber that fell behind
+
+
+class Subscriber:
+    # A bounded buffer of events for one consumer. When it is full the oldest
+    # event is dropped, so a slow consumer only loses its own events and
+    # never holds up the publisher.
+    def __init__(self, size):
+        self.events = deque(maxlen=size)
+        self.ready = threading.Event()
+        self.dropped = 0
+        # put() and get() run on different threads; the lock keeps the drop
+        # count exact. It is only held for a few list operations.
+        self.lock = threading.Lock()
+
+    def put(self, event):
+        with self.lock:
+            full = len(self.events) == self.events.maxlen
+            if full:
+                self.dropped += 1
+            self.events.append(event)
+        if full:
+            DROPPED_EVENTS.inc()
+        self.ready.set()
+
+    def get(self, timeout=None):
+        # Returns the buffered events, oldest first, or an empty list if none
+        # arrived in time.
+        if not self.events:
+            self.ready.wait(timeout)
+        self.ready.clear()
+        with self.lock:
+            dropped, self.dropped = self.dropped, 0
+            events = list(self.events)
+            self.events.clear()
+        if dropped:
+            events.insert(0, {"type": "dropped", "count": dropped})
+        return events
+
+
+class EventBus:
+    def __init__(self):
+        # Replaced rather than changed, so publish() can read it without a lock.
+        self.subscribers = ()
+        self.lock = threading.Lock()
+        self.sequence = itertools.count(1)
+
+    def subscribe(self, size=256):
+        subscriber = Subscriber(size)
+        with self.lock:
+            self.subscribers = self.subscribers + (subscriber,)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers = tuple(item for item in self.subscribers if item is not subscriber)
+
+    def publish(self, kind, **fields):
+        # Costs next to nothing without subscribers. Safe from any thread.
+        subscribers = self.subscribers
+        if not subscribers:
+            return
+        event = {"type": kind, "seq": next(self.sequence), "time": round(time.time(), 3), **fields}
+        for subscriber in subscribers:
+            subscriber.put(event)
+
+
+bus = EventBus()
+
+
+def publish(kind, **fields):
+    bus.publish(kind, **fields)
+
+
+class EventSocketServer:
+    # Streams events as JSON lines to every client of a Unix domain socket.
+    # Each client has its own subscriber and writer thread, so a client
+    # that stops reading only blocks its own thread and loses its oldest
+    # events.
+    def __init__(self, path, buffer_size=256):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.server = None
+        self.clients = set()
+        self.lock = threading.Lock()
+
+    def start(self):
+        try:
+            if stat.S_ISSOCK(os.stat(self.path).st_mode):
+                os.unlink(self.path)  # Left behind by an earlier run
+        except FileNotFoundError:
+            pass
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.server.bind(self.path)
+            self.server.listen()
+        except OSError:
+            self.server.close()
+            self.server = None
+            raise
+        threading.Thread(target=self.accept_thread, args=(self.server,), daemon=True).start()
+        logging.info(f"Publishing events on {self.path}")
+
+    def accept_thread(self, server):
+        while True:
+            try:
+                client, _ = server.accept()
+            except OSError:
+                return  # The server socket was closed
+            subscriber = bus.subscribe(self.buffer_size)
+            with self.lock:
+                self.clients.add(client)
+            threading.Thread(target=self.client_thread, args=(client, subscriber), daemon=True).start()
+            logging.debug("Event subscriber connected")
+
+    def client_thread(self, client, subscriber):
+        try:
+            while self.server:
+                events = subscriber.get(1.0)
+                if events:
+                    data = "".join(json.dumps(event, ensure_ascii=False) + "\n" for event in events)
+                    client.sendall(data.encode("utf-8"))
+        except OSError:
+            pass
+        finally:
+            bus.unsubscribe(subscriber)
+            with self.lock:
+                self.clients.discard(client)
+            client.close()
+            logging.debug("Event subscriber disconnected")
+
+    def stop(self):
+        server, self.server = self.server, None
+        if not server:
+            return
+        try:
+            server.shutdown(socket.SHUT_RDWR)  # Wakes the accept thread
+        except OSError:
+            pass
+        server.close()
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
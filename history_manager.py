@@ -1,49 +1,260 @@
 import os
 import json
+import struct
+from collections import OrderedDict
 from datetime import datetime
-from dotenv import load_dotenv
-from colorama import init, Fore, Style
 
 
 class HistoryManager:
-    def __init__(self, config_manager, log_manager):
+    # History is stored one message per line in history.jsonl, with the byte
+    # offset of every message in history.idx (8 bytes each). At startup only
+    # the most recent page is read; older pages are read on demand and kept in
+    # a small LRU cache. Token counts are cached in history.tok, 4 bytes per
+    # message, with 0 meaning not yet counted. Profiles other than the default
+    # use the same layout with a history_<profile> prefix.
+    OFFSET_SIZE = 8
+    TOKEN_COUNT_SIZE = 4
+
+    def __init__(self, config_manager, log_manager, profile=None):
         self.config_manager = config_manager
         self.logger = log_manager.get_logger()
         self.log_dir = log_manager.log_dir
+        self.profile = profile
+        self.prefix = f"history_{profile}" if profile else "history"
+        self.history_file = os.path.join(self.log_dir, f"{self.prefix}.jsonl")
+        self.index_file = os.path.join(self.log_dir, f"{self.prefix}.idx")
+        self.token_file = os.path.join(self.log_dir, f"{self.prefix}.tok")
+        self.page_size = self.config_manager.get_history_page_size()
+        self.cache_pages = self.config_manager.get_history_cache_pages()
+        self.resident_max = self.get_resident_limit()
+        self.page_cache = OrderedDict()
+        self.saved_count = 0
+        self.history_start = 0
         self.history = self.load_history()
+        self.config_manager.subscribe(["memory_budget_mode", "history_resident_max"], self.on_config_change)
+
+    def get_resident_limit(self):
+        if self.config_manager.get_memory_budget_mode():
+            return self.config_manager.get_history_resident_max()
+        return None
+
+    def on_config_change(self, config, changed):
+        self.resident_max = self.get_resident_limit()
+        self.trim_resident()
 
     def load_history(self):
-        history_file = os.path.join(self.log_dir, "history.json")
         try:
-            with open(history_file, "r", encoding='utf-8') as f:
-                history = json.load(f)
-            self.logger.info("Conversation history loaded successfully")
+            self.migrate_legacy_history()
+            self.verify_index()
+            self.saved_count = self.read_count()
+            start = max(0, self.saved_count - self.page_size)
+            history = self.read_range(start, self.saved_count)
+            # The API expects the conversation to start with a user message.
+            while history and history[0]["role"] != "user":
+                history.pop(0)
+                start += 1
+            self.history_start = start
+            self.logger.info(f"Conversation history loaded successfully ({len(history)} of {self.saved_count} messages)")
             return history
         except FileNotFoundError:
-            self.logger.warning("history.json not found. Starting with empty history.")
-            return []
-        except json.JSONDecodeError:
-            self.logger.error("Error decoding history.json. Starting with empty history.")
+            self.logger.warning(f"{os.path.basename(self.history_file)} not found. Starting with empty history.")
+        except (json.JSONDecodeError, KeyError, OSError) as e:
+            self.logger.error(f"Error reading conversation history: {str(e)}. Starting with empty history.")
+        self.saved_count = self.read_count()
+        self.history_start = self.saved_count
+        return []
+
+    def migrate_legacy_history(self):
+        legacy_file = os.path.join(self.log_dir, "history.json")
+        if self.profile or not os.path.exists(legacy_file) or os.path.exists(self.history_file):
+            return
+        try:
+            with open(legacy_file, "r", encoding='utf-8') as f:
+                history = json.load(f)
+            if not isinstance(history, list) or not all(isinstance(entry, dict) and "role" in entry and "content" in entry
+                                                        for entry in history):
+                raise ValueError("not a list of messages")
+        except (json.JSONDecodeError, UnicodeDecodeError, ValueError) as e:
+            # Moved aside rather than left in place: once history.jsonl exists
+            # it would never be looked at again.
+            backup_file = legacy_file + ".bak"
+            if os.path.exists(backup_file):
+                backup_file = f"{legacy_file}.{datetime.now().strftime('%Y%m%d_%H%M%S')}.bak"
+            os.replace(legacy_file, backup_file)
+            self.logger.warning(f"Could not migrate history.json: {str(e)}. "
+                                f"It was renamed to {os.path.basename(backup_file)}; its messages were not imported.")
+            return
+        self.append_messages(history)
+        backup_filename = f"history_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        os.replace(legacy_file, os.path.join(self.log_dir, backup_filename))
+        self.logger.info(f"Migrated {len(history)} messages from history.json (original kept as {backup_filename})")
+
+    def verify_index(self):
+        if not os.path.exists(self.history_file):
+            raise FileNotFoundError(self.history_file)
+        size = os.path.getsize(self.history_file)
+        count = self.read_count()
+        valid = (count == 0 and size == 0)
+        if count:
+            last_offset = self.read_offsets(count - 1, count)[0]
+            with open(self.history_file, "rb") as f:
+                f.seek(last_offset)
+                tail = f.read()
+            valid = last_offset < size and tail.count(b"\n") == 1 and tail.endswith(b"\n")
+        if not valid:
+            self.rebuild_index()
+
+    def rebuild_index(self):
+        # Only scans for line starts; messages are not parsed.
+        self.logger.warning("History index is missing or out of date. Rebuilding it.")
+        offsets, position = [], 0
+        with open(self.history_file, "rb") as f:
+            for line in f:
+                if line.strip():
+                    offsets.append(position)
+                position += len(line)
+        with open(self.index_file, "wb") as f:
+            f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+
+    def read_count(self):
+        try:
+            return os.path.getsize(self.index_file) // self.OFFSET_SIZE
+        except FileNotFoundError:
+            return 0
+
+    def read_offsets(self, start, end):
+        with open(self.index_file, "rb") as f:
+            f.seek(start * self.OFFSET_SIZE)
+            data = f.read((end - start) * self.OFFSET_SIZE)
+        return list(struct.unpack(f"<{len(data) // self.OFFSET_SIZE}Q", data))
+
+    def read_range(self, start, end):
+        if start >= end:
             return []
+        first_offset = self.read_offsets(start, start + 1)[0]
+        end_offset = self.read_offsets(end, end + 1)
+        with open(self.history_file, "rb") as f:
+            f.seek(first_offset)
+            data = f.read(end_offset[0] - first_offset) if end_offset else f.read()
+        return [json.loads(line) for line in data.splitlines() if line.strip()]
+
+    def append_messages(self, messages):
+        if not messages:
+            return
+        with open(self.history_file, "ab") as f:
+            position = f.tell()
+            offsets = []
+            for message in messages:
+                line = json.dumps(message, ensure_ascii=False).encode('utf-8') + b"\n"
+                offsets.append(position)
+                f.write(line)
+                position += len(line)
+        with open(self.index_file, "ab") as f:
+            f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+
+    def get_token_counts(self, start, end):
+        try:
+            with open(self.token_file, "rb") as f:
+                f.seek(start * self.TOKEN_COUNT_SIZE)
+                data = f.read((end - start) * self.TOKEN_COUNT_SIZE)
+        except FileNotFoundError:
+            data = b""
+        counts = list(struct.unpack(f"<{len(data) // self.TOKEN_COUNT_SIZE}I", data))
+        counts += [0] * (end - start - len(counts))
+        return [count or None for count in counts]
+
+    def set_token_counts(self, counts):
+        # counts maps message index to token count. Only saved messages can be
+        # cached, since the index has to stay valid after a restart.
+        mode = "r+b" if os.path.exists(self.token_file) else "w+b"
+        with open(self.token_file, mode) as f:
+            for index, count in sorted(counts.items()):
+                if index < self.saved_count:
+                    f.seek(index * self.TOKEN_COUNT_SIZE)
+                    f.write(struct.pack("<I", count))
+
+    def message_count(self):
+        return self.history_start + len(self.history)
+
+    def get_page(self, page):
+        if page in self.page_cache:
+            self.page_cache.move_to_end(page)
+            return self.page_cache[page]
+        start = page * self.page_size
+        messages = self.read_range(start, min(start + self.page_size, self.saved_count))
+        self.page_cache[page] = messages
+        while len(self.page_cache) > self.cache_pages:
+            self.page_cache.popitem(last=False)
+        return messages
+
+    def get_messages(self, start=0, end=None):
+        end = self.message_count() if end is None else min(end, self.message_count())
+        return list(self.iter_messages(start, end))
+
+    def iter_messages(self, start=0, end=None):
+        end = self.message_count() if end is None else min(end, self.message_count())
+        index = max(start, 0)
+        while index < end:
+            if index >= self.history_start:
+                yield from self.history[index - self.history_start:end - self.history_start]
+                return
+            page = index // self.page_size
+            messages = self.get_page(page)
+            page_start = page * self.page_size
+            for message in messages[index - page_start:min(end, self.history_start) - page_start]:
+                yield message
+            index = min(page_start + self.page_size, self.history_start, end)
 
     def save_history(self):
-        history_file = os.path.join(self.log_dir, "history.json")
-        with open(history_file, "w", encoding='utf-8') as f:
-            json.dump(self.history, f, indent=2, ensure_ascii=False)
+        unsaved = self.message_count() - self.saved_count
+        if unsaved > 0:
+            self.append_messages(self.history[len(self.history) - unsaved:])
+            self.saved_count += unsaved
+        self.trim_resident()
         self.logger.info("Conversation history saved")
 
+    def trim_resident(self):
+        # Keeps at most resident_max messages in memory (and so in the context
+        # sent to the API). Only messages already on disk are dropped; they
+        # can still be read back through get_messages().
+        if not self.resident_max or len(self.history) <= self.resident_max:
+            return
+        saved_resident = self.saved_count - self.history_start
+        drop = len(self.history) - self.resident_max
+        # The API expects the conversation to start with a user message.
+        while drop < saved_resident and self.history[drop]["role"] != "user":
+            drop += 1
+        if drop > saved_resident or drop >= len(self.history) or self.history[drop]["role"] != "user":
+            return
+        del self.history[:drop]
+        # Cached pages may have been read before these messages were saved.
+        for page in [page for page in self.page_cache if (page + 1) * self.page_size > self.history_start]:
+            del self.page_cache[page]
+        self.history_start += drop
+        self.logger.debug(f"Trimmed {drop} messages from resident history")
+
     def backup_history(self):
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_filename = f"history_backup_{timestamp}.json"
+        backup_filename = f"{self.prefix}_backup_{timestamp}.json"
         backup_file = os.path.join(self.log_dir, backup_filename)
+        # Written a message at a time so the full history never has to be in memory.
         with open(backup_file, "w", encoding='utf-8') as f:
-            json.dump(self.history, f, indent=2, ensure_ascii=False)
+            f.write("[")
+            for i, message in enumerate(self.iter_messages()):
+                f.write(",\n  " if i else "\n  ")
+                f.write(json.dumps(message, ensure_ascii=False))
+            f.write("\n]\n")
         self.logger.info(f"Conversation history backed up to {backup_filename}")
 
     def clear_history(self):
         self.logger.info("Clearing conversation history")
         self.backup_history()
         self.history = []
+        self.history_start = 0
+        self.saved_count = 0
+        self.page_cache.clear()
+        for path in (self.history_file, self.index_file, self.token_file):
+            open(path, "wb").close()
         self.save_history()
 
 
@@ -52,4 +263,4 @@ class HistoryManager:
         # Removed self.save_history() from here
 
     def get_history(self, num_messages=10):
-        return self.history
\ No newline at end of file
+        return self.history
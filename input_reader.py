@@ -0,0 +1,95 @@
+import os
+import re
+import asyncio
+import logging
+import threading
+from queue import Queue
+
+try:
+    import readline
+except ImportError:
+    readline = None
+
+
+class InputReader:
+    # Reads lines from stdin on a daemon thread so the event loop keeps
+    # running while the user types. A read that is still waiting when its
+    # caller gives up (for example because speech input won) stays pending
+    # and is handed to the next caller, since a blocked input() cannot be
+    # interrupted.
+    def __init__(self, log_dir, history_length=1000):
+        self.history_file = os.path.join(log_dir, "input_history")
+        self.requests = Queue()
+        self.pending = None
+        self.thread = threading.Thread(target=self.reader_thread, daemon=True)
+        self.thread.start()
+        if readline:
+            readline.set_history_length(history_length)
+            try:
+                readline.read_history_file(self.history_file)
+            except (FileNotFoundError, OSError):
+                pass
+
+    def reader_thread(self):
+        while True:
+            loop, future, prompt, add_history = self.requests.get()
+            try:
+                line = input(prompt)
+                if readline and line and not add_history:
+                    last = readline.get_current_history_length()
+                    if last and readline.get_history_item(last) == line:
+                        readline.remove_history_item(last - 1)
+                loop.call_soon_threadsafe(self.set_result, future, line)
+            except BaseException as e:
+                loop.call_soon_threadsafe(self.set_exception, future, e)
+
+    @staticmethod
+    def set_result(future, line):
+        if not future.done():
+            future.set_result(line)
+
+    @staticmethod
+    def set_exception(future, error):
+        if not future.done():
+            future.set_exception(error)
+
+    def format_prompt(self, prompt):
+        # Tells readline the color codes take no space, so line editing
+        # keeps the cursor in the right place.
+        if readline:
+            return re.sub(r"(\x1b\[[0-9;]*m)", "\001\\1\002", prompt)
+        return prompt
+
+    async def read_line(self, prompt="", add_history=True):
+        if self.pending is None:
+            loop = asyncio.get_running_loop()
+            self.pending = loop.create_future()
+            self.requests.put((loop, self.pending, self.format_prompt(prompt), add_history))
+        else:
+            self.show_prompt(prompt)
+        pending = self.pending
+        try:
+            # Shielded so cancelling the caller leaves the read for the next one.
+            return await asyncio.shield(pending)
+        finally:
+            if pending.done():
+                self.pending = None
+
+    def hide_prompt(self):
+        # Clears the prompt of a read that stays pending, so other output
+        # does not run on after it.
+        if self.pending is not None and not self.pending.done():
+            print("\r\x1b[K", end="", flush=True)
+
+    def show_prompt(self, prompt):
+        # Draws the prompt of a carried-over read again, with anything
+        # already typed, since hide_prompt() cleared it.
+        line = readline.get_line_buffer() if readline else ""
+        print(f"\r\x1b[K{prompt}{line}", end="", flush=True)
+
+    def save_history(self):
+        if readline:
+            try:
+                readline.write_history_file(self.history_file)
+            except OSError as e:
+                logging.error(f"Error saving input history: {str(e)}")
@@ -11,6 +11,7 @@ class LogManager:
         self.log_dir = log_dir
         os.makedirs(self.log_dir, exist_ok=True)
         self.setup_logging()
+        self.config_manager.subscribe(["log_level"], self.on_config_change)
 
     def setup_logging(self):
         log_level_str = self.config_manager.get_log_level()
@@ -50,5 +51,13 @@ class LogManager:
             print(f"Current working directory: {os.getcwd()}")
             print(f"Attempted log file path: {os.path.abspath(log_file)}")
 
+    def on_config_change(self, config, changed):
+        log_level = getattr(logging, config.log_level)
+        logger = logging.getLogger()
+        logger.setLevel(log_level)
+        for handler in logger.handlers:
+            handler.setLevel(log_level)
+        logging.info(f"Log level changed to {config.log_level}")
+
     def get_logger(self):
         return logging.getLogger()
\ No newline at end of file
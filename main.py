@@ -1,10 +1,23 @@
 import asyncio
+import argparse
 import pygame
 from colorama import init
 from dotenv import load_dotenv
 from claude_cli import ClaudeCLI
+from profiler import LoopProfiler
+import session_trace
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Claude CLI with speech input and output")
+    parser.add_argument("--profile", action="store_true",
+                        help="Log event loop lag and the stack of any step that blocks the loop")
+    parser.add_argument("--profile-slow-ms", type=int, default=100,
+                        help="Report steps that block the event loop for longer than this (default 100)")
+    parser.add_argument("--profile-sample-hz", type=int, default=0,
+                        help="Also sample all threads at this rate and write folded stacks to logs/ (default off)")
+    parser.add_argument("--record", metavar="PATH",
+                        help="Record the session (microphone audio, transcripts, model output, speech timings) to PATH for replay")
+    args = parser.parse_args()
     
     # Initialize colorama
     init(autoreset=True)
@@ -16,11 +29,15 @@ if __name__ == "__main__":
     # Load environment variables
     load_dotenv()
 
-    cli = ClaudeCLI()
+    if args.record:
+        session_trace.start_recording(args.record)
+
+    profiler = LoopProfiler(args.profile_slow_ms, sample_hz=args.profile_sample_hz) if args.profile else None
+    cli = ClaudeCLI(profiler)
 
     try:
         asyncio.run(cli.run())
     except Exception as e:
         print(f"An error occurred: {e}")
     finally:
-        cli.shutdown()
\ No newline at end of file
+        cli.shutdown()
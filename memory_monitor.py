@@ -0,0 +1,66 @@
+import os
+import logging
+import threading
+import tracemalloc
+
+
+def rss_bytes():
+    # Current resident set size. getrusage only reports the peak, so it is
+    # used only where /proc is not available.
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryMonitor:
+    # Logs RSS and the allocation sites that grew the most since the last
+    # report. tracemalloc slows allocation down, so this only runs in memory
+    # budget mode.
+    def __init__(self, interval=300.0, top=10):
+        self.interval = interval
+        self.top = top
+        self.previous = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.monitor_thread, daemon=True)
+        self.thread.start()
+        logging.info(f"Memory reports every {self.interval:.0f} seconds")
+
+    def monitor_thread(self):
+        while not self.stop_event.wait(self.interval):
+            self.report()
+
+    def report(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Memory: RSS {rss_bytes() / 1e6:.1f} MB, traced {current / 1e6:.1f} MB (peak {peak / 1e6:.1f} MB)"]
+        if self.previous:
+            stats = snapshot.compare_to(self.previous, "lineno")[:self.top]
+            lines += [f"  {stat.size_diff / 1024:+.1f} KiB ({stat.size / 1024:.1f} KiB total) {stat.traceback}" for stat in stats]
+        else:
+            stats = snapshot.statistics("lineno")[:self.top]
+            lines += [f"  {stat.size / 1024:.1f} KiB {stat.traceback}" for stat in stats]
+        self.previous = snapshot
+        logging.info("\n".join(lines))
+
+    def stop(self):
+        if not self.thread:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        self.previous = None
+        tracemalloc.stop()
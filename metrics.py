@@ -0,0 +1,253 @@
+import logging
+import weakref
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def observe_into(counts, buckets, value):
+    # counts holds one count per bucket, then +Inf, then the sum.
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            counts[i] += 1
+            break
+    else:
+        counts[len(buckets)] += 1
+    counts[-1] += value
+
+
+class ShardedMetric:
+    # Each thread updates its own shard, so recording takes no lock and can
+    # never wait for a scrape. A scrape adds the shards up. Copying a shard
+    # with list() does not release the GIL, so it sees a consistent dict even
+    # while its thread is adding to it. When a thread ends, its counts are
+    # added to the retired shard and its own shard is dropped, so threads
+    # that come and go, such as one capture thread per STT session, do not
+    # leave shards behind.
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.retired = {}
+        self.shards = [self.retired]
+        self.lock = threading.Lock()  # Only taken to retire a shard
+        self.local = threading.local()
+
+    def shard(self):
+        try:
+            return self.local.owner.shard
+        except AttributeError:
+            # The owner lives in the thread's local storage, which is freed
+            # when the thread ends.
+            owner = self.local.owner = ShardOwner()
+            weakref.finalize(owner, self.retire, owner.shard)
+            self.shards.append(owner.shard)
+            return owner.shard
+
+    def retire(self, shard):
+        # Values in the retired shard are replaced rather than changed, so a
+        # scrape never sees one half added.
+        with self.lock:
+            for key, value in list(shard.items()):
+                self.retired[key] = self.combine(self.retired.get(key), value)
+            # By identity: list.remove() would match an equal dict. Only
+            # retire() removes shards, so the index cannot move meanwhile.
+            for i, item in enumerate(self.shards):
+                if item is shard:
+                    del self.shards[i]
+                    break
+
+    def combine(self, total, value):
+        raise NotImplementedError
+
+    def collect(self):
+        raise NotImplementedError
+
+
+class ShardOwner:
+    def __init__(self):
+        self.shard = {}
+
+
+class Counter(ShardedMetric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        shard = self.shard()
+        key = label_key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def combine(self, total, value):
+        return (total or 0) + value
+
+    def collect(self):
+        totals = {}
+        for shard in list(self.shards):
+            for key, value in list(shard.items()):
+                totals[key] = totals.get(key, 0) + value
+        return [f"{self.name}{format_labels(key)} {format_value(value)}" for key, value in sorted(totals.items())]
+
+
+class Histogram(ShardedMetric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        shard = self.shard()
+        key = label_key(labels)
+        counts = shard.get(key)
+        if counts is None:
+            counts = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        observe_into(counts, self.buckets, value)
+
+    def attach(self, counts, **labels):
+        # Adds counts kept elsewhere, in the layout observe_into() uses, such
+        # as an array in shared memory written by another process.
+        self.shards.append({label_key(labels): counts})
+
+    def detach(self, counts, **labels):
+        # Stops reading attached counts, keeping what they recorded in the
+        # retired shard so the totals never go backwards.
+        key = label_key(labels)
+        for shard in list(self.shards):
+            if shard is not self.retired and shard.get(key) is counts:
+                self.retire(shard)
+
+    def combine(self, total, value):
+        value = list(value)
+        if total is None:
+            return value
+        return [a + b for a, b in zip(total, value)]
+
+    def collect(self):
+        totals = {}
+        for shard in list(self.shards):
+            for key, counts in list(shard.items()):
+                total = totals.setdefault(key, [0] * len(counts))
+                for i, value in enumerate(list(counts)):
+                    total[i] += value
+        lines = []
+        for key, counts in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(key, [('le', bound)])} {int(cumulative)}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {format_value(float(counts[-1]))}")
+            lines.append(f"{self.name}_count{format_labels(key)} {int(cumulative)}")
+        return lines
+
+
+class CallbackMetric:
+    # A value read only when scraped, such as a queue depth. The callback
+    # returns a number, or a dict from label_key() tuples to numbers.
+    def __init__(self, name, help_text, callback, kind="gauge"):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        self.kind = kind
+
+    def collect(self):
+        value = self.callback()
+        if value is None:
+            return []
+        if isinstance(value, dict):
+            return [f"{self.name}{format_labels(key)} {format_value(item)}" for key, item in sorted(value.items())]
+        return [f"{self.name} {format_value(value)}"]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        # Several instances of a manager share the metrics of the first one.
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text):
+        return self.register(Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def gauge(self, name, help_text, callback, kind="gauge"):
+        # Callbacks are replaced, so they always read the newest instance.
+        metric = CallbackMetric(name, help_text, callback, kind)
+        self.metrics[name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            try:
+                samples = metric.collect()
+            except Exception as e:
+                logging.debug(f"Error collecting metric {metric.name}: {str(e)}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    # Serves /metrics in the Prometheus text format from its own threads.
+    def __init__(self, port, host="127.0.0.1"):
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        self.server = ThreadingHTTPServer((self.host, self.port), MetricsRequestHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        logging.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
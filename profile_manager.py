@@ -0,0 +1,118 @@
+import os
+import glob
+import time
+import asyncio
+from history_manager import HistoryManager
+
+
+class Profile:
+    def __init__(self, name, prompt_file, system_prompt, history_manager):
+        self.name = name
+        self.prompt_file = prompt_file
+        self.system_prompt = system_prompt
+        self.history_manager = history_manager
+        self.prompt_tokens = None
+        self.warmed_at = None
+
+
+class ProfileManager:
+    # A profile is a system prompt with its own conversation history. The
+    # "default" profile uses system_prompt_file and the main history; other
+    # profiles come from <name>_prompt.txt files in the working directory and
+    # from the "profiles" mapping in config.json. Profiles are loaded the
+    # first time they are used and then kept, together with their history.
+    CACHE_TTL = 300  # Lifetime of the server-side prompt cache, in seconds
+
+    def __init__(self, config_manager, log_manager, claude_api):
+        self.config_manager = config_manager
+        self.log_manager = log_manager
+        self.logger = log_manager.get_logger()
+        self.claude_api = claude_api
+        self.profiles = {}
+        self.warm_task = None
+        name = self.config_manager.get_profile()
+        if name not in self.get_prompt_files():
+            self.logger.error(f"Profile '{name}' not found. Using the default profile.")
+            name = "default"
+        self.active = self.load_profile(name)
+        self.claude_api.system_prompt = self.active.system_prompt
+        self.claude_api.system_prompt_tokens = self.active.prompt_tokens
+        self.config_manager.subscribe(["system_prompt_file", "model", "prompt_cache"], self.on_config_change)
+
+    def get_prompt_files(self):
+        default_file = self.config_manager.get_system_prompt_file()
+        files = {"default": default_file}
+        for path in sorted(glob.glob("*_prompt.txt")):
+            if os.path.abspath(path) != os.path.abspath(default_file):
+                files[os.path.basename(path)[:-len("_prompt.txt")]] = path
+        files.update(self.config_manager.get("profiles", {}))
+        return files
+
+    def load_profile(self, name):
+        if name in self.profiles:
+            return self.profiles[name]
+        prompt_file = self.get_prompt_files().get(name)
+        if prompt_file is None:
+            return None
+        if name == "default" and not self.profiles:
+            system_prompt = self.claude_api.system_prompt  # Already loaded at startup
+        else:
+            system_prompt = self.claude_api.load_system_prompt(prompt_file)
+        history_manager = HistoryManager(self.config_manager, self.log_manager, None if name == "default" else name)
+        self.profiles[name] = Profile(name, prompt_file, system_prompt, history_manager)
+        self.logger.info(f"Profile '{name}' loaded from {prompt_file}")
+        return self.profiles[name]
+
+    def on_config_change(self, config, changed):
+        if "system_prompt_file" in changed and "default" in self.profiles:
+            profile = self.profiles["default"]
+            profile.prompt_file = config.system_prompt_file
+            profile.system_prompt = self.claude_api.load_system_prompt(config.system_prompt_file)
+            profile.prompt_tokens = None
+            if self.active is profile:
+                self.claude_api.system_prompt = profile.system_prompt
+                self.claude_api.system_prompt_tokens = None
+        # The cache is kept per model and prompt, so it has to be warmed again.
+        for profile in self.profiles.values():
+            profile.warmed_at = None
+        self.start_warming()  # Runs on the event loop, like every config callback
+
+    def switch(self, name):
+        profile = self.load_profile(name)
+        if profile is None:
+            return None
+        self.active = profile
+        self.claude_api.system_prompt = profile.system_prompt
+        self.claude_api.system_prompt_tokens = profile.prompt_tokens
+        self.logger.info(f"Switched to profile '{name}'")
+        self.start_warming()
+        return profile
+
+    def start_warming(self):
+        # Runs in the background so the prompt is ready by the first turn.
+        if self.warm_task and not self.warm_task.done():
+            self.warm_task.cancel()
+        self.warm_task = asyncio.ensure_future(self.prepare(self.active))
+
+    async def prepare(self, profile):
+        try:
+            if profile.prompt_tokens is None:
+                profile.prompt_tokens = await self.claude_api.count_tokens(profile.system_prompt)
+                if profile is self.active:
+                    self.claude_api.system_prompt_tokens = profile.prompt_tokens
+            if not self.claude_api.is_cacheable(profile.prompt_tokens):
+                if self.claude_api.prompt_cache:
+                    self.logger.debug(f"Prompt for profile '{profile.name}' is too short to cache; not warming it")
+                return
+            if profile.warmed_at is None or time.monotonic() - profile.warmed_at > self.CACHE_TTL * 0.9:
+                started = time.monotonic()
+                usage = await self.claude_api.warm_prompt_cache(profile.system_prompt, profile.prompt_tokens)
+                if usage is not None:
+                    profile.warmed_at = time.monotonic()
+                    self.logger.info(f"Prompt cache for profile '{profile.name}' warmed in "
+                                     f"{(profile.warmed_at - started) * 1000:.0f} ms "
+                                     f"({usage['cache_write_tokens']} tokens written, {usage['cache_read_tokens']} read)")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.warning(f"Could not prepare profile '{profile.name}': {str(e)}")
@@ -0,0 +1,136 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter, deque
+from datetime import datetime
+
+
+class LoopProfiler:
+    # Measures how late the event loop wakes up and, from a watchdog thread,
+    # captures the loop thread's stack whenever a single step runs longer
+    # than slow_ms. With sample_hz set, every thread is also sampled and the
+    # stacks are written in folded format (one "frame;frame;... count" line
+    # per stack) for flamegraph.pl or speedscope.
+    def __init__(self, slow_ms=100, interval_ms=50, sample_hz=0):
+        self.slow = slow_ms / 1000
+        self.interval = interval_ms / 1000
+        self.sample_hz = sample_hz
+        self.lags = deque(maxlen=10000)
+        self.stalls = 0
+        self.samples = Counter()
+        self.loop = None
+        self.loop_thread_id = None
+        self.heartbeat = 0.0
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.lag_task = None
+        self.log_dir = "logs"
+
+    def start(self, loop, log_dir):
+        self.loop = loop
+        self.log_dir = log_dir
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.perf_counter()
+        # In debug mode asyncio also logs the callback or task for each slow
+        # step. It adds some overhead, which is acceptable while profiling.
+        loop.set_debug(True)
+        loop.slow_callback_duration = self.slow
+        self.lag_task = loop.create_task(self.sample_lag())
+        self.threads.append(threading.Thread(target=self.watchdog_thread, daemon=True))
+        if self.sample_hz > 0:
+            self.threads.append(threading.Thread(target=self.sampler_thread, daemon=True))
+        for thread in self.threads:
+            thread.start()
+        logging.info(f"Profiling enabled: stalls over {self.slow * 1000:.0f} ms are logged"
+                     + (f", sampling at {self.sample_hz} Hz" if self.sample_hz > 0 else ""))
+
+    async def sample_lag(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            self.heartbeat = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            self.heartbeat = now
+            self.lags.append(max(0.0, now - expected))
+
+    def watchdog_thread(self):
+        reported = None
+        while not self.stop_event.wait(self.slow / 4):
+            beat = self.heartbeat
+            blocked = time.perf_counter() - beat
+            if blocked < self.slow or beat == reported:
+                continue
+            # One report per stall, taken while the blocking call is still running.
+            reported = beat
+            self.stalls += 1
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(no frame)\n"
+            logging.warning(f"Event loop blocked for over {blocked * 1000:.0f} ms in:\n{stack.rstrip()}")
+
+    def current_task_name(self):
+        # Reading another thread's current task is racy but harmless here;
+        # it only labels the sample.
+        try:
+            task = asyncio.tasks._current_tasks.get(self.loop)
+            return task.get_name() if task else None
+        except Exception:
+            return None
+
+    def sampler_thread(self):
+        names = {}
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(1 / self.sample_hz):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                root = [names.get(thread_id, str(thread_id))]
+                if thread_id == self.loop_thread_id:
+                    task = self.current_task_name()
+                    if task:
+                        root.append(f"task {task}")
+                # Same frame format as py-spy; folded-stack tools split on the last space.
+                self.samples[";".join(root + stack[::-1])] += 1
+
+    def summary(self):
+        if not self.lags:
+            return "no samples"
+        lags = sorted(self.lags)
+        p50 = lags[len(lags) // 2] * 1000
+        p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000
+        return (f"loop lag p50 {p50:.1f} ms, p99 {p99:.1f} ms, max {lags[-1] * 1000:.1f} ms, "
+                f"{self.stalls} stalls over {self.slow * 1000:.0f} ms")
+
+    def write_folded(self):
+        filename = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.folded"
+        path = os.path.join(self.log_dir, filename)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+    def stop(self):
+        if self.stop_event.is_set() or self.loop is None:
+            return
+        self.stop_event.set()
+        self.loop.set_debug(False)
+        if self.lag_task:
+            self.lag_task.cancel()
+        for thread in self.threads:
+            thread.join()
+        logging.info(f"Profile summary: {self.summary()}")
+        if self.samples:
+            try:
+                logging.info(f"Sampled stacks written to {self.write_folded()}")
+            except OSError as e:
+                logging.error(f"Error writing profile samples: {str(e)}")
@@ -0,0 +1,64 @@
+import os
+import time
+import logging
+import metrics
+
+JITTER_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25)
+
+JITTER_SECONDS = metrics.registry.histogram("claude_cli_audio_callback_jitter_seconds",
+                                            "How far audio callbacks stray from the block period, by stream",
+                                            JITTER_BUCKETS)
+XRUNS = metrics.registry.counter("claude_cli_audio_xruns_total", "Audio input overflows and output underruns, by stream")
+
+
+def set_realtime(name, priority=0, cpus=()):
+    # Applies to the calling thread only (Linux schedules threads, not
+    # processes). Missing permissions are logged and the thread carries on
+    # at normal priority. Returns True if anything was applied.
+    applied = []
+    if cpus:
+        try:
+            os.sched_setaffinity(0, {int(cpu) for cpu in cpus})
+            applied.append(f"CPUs {', '.join(str(cpu) for cpu in sorted(cpus))}")
+        except (AttributeError, OSError, ValueError, TypeError) as e:
+            logging.warning(f"Could not pin {name} to CPUs {list(cpus)}: {str(e)}")
+    if priority:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+            applied.append(f"SCHED_FIFO priority {priority}")
+        except PermissionError:
+            logging.warning(f"No permission for real-time priority for {name}; running at normal priority. "
+                            f"Allow it with an rtprio limit in /etc/security/limits.conf or CAP_SYS_NICE.")
+        except (AttributeError, OSError) as e:
+            logging.warning(f"Could not set real-time priority for {name}: {str(e)}")
+    if applied:
+        logging.info(f"{name}: {', '.join(applied)}")
+    return bool(applied)
+
+
+class CallbackTimer:
+    # Called at the start of every audio callback. It measures how far the
+    # time since the previous callback is from the length of the previous
+    # block, and on the first call applies the real-time settings: PortAudio
+    # runs callbacks on a thread of its own, so this is the only place to
+    # reach it. Streams with a variable block size pass the period each time.
+    def __init__(self, name, period, observe, priority=0, cpus=()):
+        self.name = name
+        self.period = period
+        self.observe = observe
+        self.priority = priority
+        self.cpus = cpus
+        self.configured = False
+        self.last = None
+        self.expected = period
+
+    def tick(self, period=None):
+        now = time.monotonic()
+        if not self.configured:
+            self.configured = True
+            if self.priority or self.cpus:
+                set_realtime(self.name, self.priority, self.cpus)
+        if self.last is not None and self.expected is not None:
+            self.observe(abs(now - self.last - self.expected))
+        self.last = now
+        self.expected = period or self.period
@@ -0,0 +1,98 @@
+import re
+
+
+class SentenceChunker:
+    SENTENCE_SPLIT = re.compile(r'(?<!\d)(?<!\.\d)(\.|!|\?)\s+')
+    CLAUSE_SPLIT = re.compile(r'(?<!\d)([,;:])\s+')
+
+    def __init__(self, policy="adaptive", first_chunk_words=8, char_budget=200):
+        self.policy = policy
+        self.first_chunk_words = first_chunk_words
+        self.char_budget = char_budget
+        self.reset()
+
+    def reset(self):
+        self.buffer = ""
+        self.pending = ""
+        self.chunks_emitted = 0
+
+    def feed(self, text):
+        self.buffer += text
+        sentences = self.SENTENCE_SPLIT.split(self.buffer)
+        complete = [sentences[i] + sentences[i + 1] for i in range(0, len(sentences) - 1, 2)]
+        self.buffer = sentences[-1] if sentences else ""
+
+        if self.policy != "adaptive":
+            return self._emit_all(complete)
+
+        chunks = []
+        if self.chunks_emitted == 0 and not self.pending:
+            first = self._take_first_clause(complete)
+            if first is None:
+                return chunks
+            chunks.append(first)
+            self.chunks_emitted += 1
+
+        for sentence in complete:
+            chunks.extend(self._merge(sentence))
+        return chunks
+
+    def flush(self):
+        chunks = []
+        if self.policy == "adaptive":
+            chunks.extend(self._merge(self.buffer))
+            chunks.append(self.pending)
+        else:
+            chunks.extend(self._emit_all([self.buffer]))
+        self.reset()
+        return [chunk for chunk in chunks if chunk.strip()]
+
+    def _emit_all(self, sentences):
+        chunks = [sentence for sentence in sentences if sentence.strip()]
+        self.chunks_emitted += len(chunks)
+        return chunks
+
+    def _take_first_clause(self, complete):
+        # The first chunk goes out as soon as we have a clause or enough words,
+        # so playback can start while the rest of the reply is still streaming.
+        text = " ".join(complete + [self.buffer]) if complete else self.buffer
+        clause = self.CLAUSE_SPLIT.search(text)
+        sentence = self.SENTENCE_SPLIT.search(text)
+        cut = None
+        if clause and (not sentence or clause.start() < sentence.start()):
+            cut = clause.end()
+        elif sentence:
+            cut = sentence.end()
+        else:
+            words = list(re.finditer(r'\S+\s+', text))
+            if len(words) >= self.first_chunk_words:
+                cut = words[self.first_chunk_words - 1].end()
+
+        if cut is None:
+            return None
+
+        first, rest = text[:cut], text[cut:]
+        complete.clear()
+        rest_sentences = self.SENTENCE_SPLIT.split(rest)
+        complete.extend(rest_sentences[i] + rest_sentences[i + 1] for i in range(0, len(rest_sentences) - 1, 2))
+        self.buffer = rest_sentences[-1] if rest_sentences else ""
+        return first
+
+    def _merge(self, sentence):
+        sentence = sentence.strip()
+        if not sentence:
+            return []
+        if not self.pending:
+            self.pending = sentence
+        elif len(self.pending) + 1 + len(sentence) <= self.char_budget:
+            self.pending = f"{self.pending} {sentence}"
+        else:
+            chunk, self.pending = self.pending, sentence
+            self.chunks_emitted += 1
+            return [chunk]
+
+        if len(self.pending) >= self.char_budget:
+            chunk, self.pending = self.pending, ""
+            self.chunks_emitted += 1
+            return [chunk]
+        return []
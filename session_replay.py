@@ -0,0 +1,342 @@
+import os
+import time
+import asyncio
+import tempfile
+import contextlib
+from collections import deque
+from types import SimpleNamespace
+import session_trace
+from config_manager import ConfigManager
+from log_manager import LogManager
+from audio_manager import AudioManager
+from tts_backends import TTSBackend, TTSRouter
+from stt_backends import STTBackend
+from claude_cli import ClaudeCLI
+
+
+class RecordedSTT:
+    def __init__(self, backend, start):
+        self.backend = backend
+        self.start = start
+        self.end = None
+        self.transcript = None
+        self.frames = []     # (seconds after start, audio)
+        self.messages = []   # (seconds after start, message)
+
+
+class RecordedTurn:
+    def __init__(self, source, text, start):
+        self.source = source
+        self.text = text
+        self.start = start
+        self.end = None
+        self.stt = None
+        self.llm_request = None
+        self.chunks = []     # (seconds after the request, event)
+        self.tts = []
+        self.playback = []
+
+    def recorded_metrics(self):
+        metrics = {"turn": self.end - self.start}
+        if self.stt:
+            metrics["stt"] = self.stt.end - self.stt.start
+        first_text = next((offset for offset, chunk in self.chunks if chunk.get("type") == "content_block_delta"
+                           and chunk.get("delta", {}).get("text")), None)
+        if first_text is not None:
+            metrics["first_text"] = self.llm_request + first_text - self.start
+        if self.playback:
+            end, seconds = self.playback[0]
+            metrics["first_audio"] = end - seconds - self.start
+        return metrics
+
+
+def load_turns(path):
+    # Groups a trace into completed turns. The speech session that produced a
+    # spoken turn ends just before the turn starts; sessions that were
+    # cancelled or heard nothing are skipped.
+    turns = []
+    turn, stt, last_stt = None, None, None
+    for kind, offset, payload in session_trace.read_trace(path):
+        if kind == session_trace.STT_START:
+            stt = RecordedSTT(payload["backend"], offset)
+        elif kind == session_trace.MIC_FRAME and stt:
+            stt.frames.append((offset - stt.start, payload))
+        elif kind == session_trace.STT_MESSAGE and stt:
+            stt.messages.append((offset - stt.start, payload))
+        elif kind == session_trace.STT_END and stt:
+            stt.end, stt.transcript = offset, payload["transcript"]
+            last_stt, stt = (stt if stt.transcript else None), None
+        elif kind == session_trace.TURN_START:
+            turn = RecordedTurn(payload["source"], payload["text"], offset)
+            if turn.source == "spoken":
+                turn.stt = last_stt
+            last_stt = None
+        elif turn is None:
+            continue
+        elif kind == session_trace.LLM_REQUEST:
+            # A retried request starts over; only the stream that was used counts.
+            turn.llm_request, turn.chunks = offset, []
+        elif kind == session_trace.LLM_CHUNK:
+            turn.chunks.append((offset - turn.llm_request, payload))
+        elif kind == session_trace.TTS_RESULT:
+            turn.tts.append(payload)
+        elif kind == session_trace.PLAYBACK:
+            turn.playback.append((offset, payload["seconds"]))
+        elif kind == session_trace.TURN_END:
+            turn.end = offset
+            turn.chunks.sort(key=lambda item: item[0])
+            turns.append(turn)
+            turn = None
+    return turns
+
+
+def to_namespace(value):
+    # Recorded stream events are plain dicts; the client code reads attributes.
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: to_namespace(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [to_namespace(item) for item in value]
+    return value
+
+
+async def sleep_until(started, offset, speed):
+    delay = started + offset / speed - time.monotonic()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+class ReplayStream:
+    def __init__(self, chunks, speed):
+        self.chunks = chunks
+        self.speed = speed
+
+    async def __aiter__(self):
+        started = time.monotonic()
+        for offset, chunk in self.chunks:
+            await sleep_until(started, offset, self.speed)
+            yield to_namespace(chunk)
+
+    async def close(self):
+        pass
+
+
+class ReplayMessages:
+    def __init__(self, client):
+        self.client = client
+
+    async def create(self, stream=False, **kwargs):
+        if not stream:
+            usage = SimpleNamespace(input_tokens=0, output_tokens=0)
+            return SimpleNamespace(usage=usage, content=[])
+        return ReplayStream(self.client.turn.chunks, self.client.speed)
+
+
+class ReplayClient:
+    # Stands in for AsyncAnthropic and streams the recorded events of the
+    # current turn with their original spacing.
+    def __init__(self, speed):
+        self.speed = speed
+        self.turn = None
+        self.messages = ReplayMessages(self)
+
+    async def count_tokens(self, text):
+        return 0
+
+
+class ReplayTTSBackend(TTSBackend):
+    # Takes as long as the recorded synthesis did and fails where it failed.
+    name = "polly"
+    file_extension = "mp3"
+
+    def __init__(self, speed):
+        self.speed = speed
+        self.results = deque()
+        self.voice = None
+        self.engine = None
+
+    def synthesize(self, text, file_base, engine=None):
+        result = self.results.popleft() if self.results else {"latency": 0.0, "ok": True}
+        time.sleep(result["latency"] / self.speed)
+        if not result["ok"]:
+            raise RuntimeError("Speech synthesis failed in the recorded session")
+        file_path = f"{file_base}.{self.file_extension}"
+        open(file_path, "wb").close()
+        return file_path
+
+
+class ReplayAudioManager(AudioManager):
+    # Plays each file for as long as the recorded playback took, so replay
+    # needs neither AWS nor an audio device.
+    def __init__(self, config_manager, speed, usage_manager=None):
+        self.speed = speed
+        self.replay_backend = ReplayTTSBackend(speed)
+        self.playback = deque()
+        super().__init__(config_manager, None, usage_manager)
+
+    def create_tts_router(self):
+        return TTSRouter(self.replay_backend, mode="polly", breaker=self.polly_breaker)
+
+    def play_file(self, audio_file):
+        seconds = self.playback.popleft() if self.playback else 0.0
+        time.sleep(seconds / self.speed)
+
+
+class ReplaySTTBackend(STTBackend):
+    # Returns the recorded messages and transcript at their recorded times
+    # while the recorded microphone audio is fed through the capture queue.
+    def __init__(self, name, speed):
+        self.name = name
+        self.speed = speed
+        self.session = None
+        self.started_at = None
+
+    async def transcribe(self, next_frame, on_partial, on_ready, encoder=None, endpointer=None):
+        on_ready()
+
+        async def drain():
+            while await next_frame() is not None:
+                pass
+
+        drainer = asyncio.create_task(drain())
+        try:
+            for offset, message in self.session.messages:
+                await sleep_until(self.started_at, offset, self.speed)
+                transcript = message.get("channel", {}).get("alternatives", [{}])[0].get("transcript", "")
+                if not message.get("is_final") and transcript.strip():
+                    on_partial(transcript.strip())
+            await sleep_until(self.started_at, self.session.end - self.session.start, self.speed)
+            return self.session.transcript
+        finally:
+            drainer.cancel()
+
+
+class ReplayInputReader:
+    # Returns the recorded line of a typed turn. During a spoken turn nothing
+    # is typed, so the read waits until speech wins and cancels it.
+    def __init__(self):
+        self.line = None
+
+    async def read_line(self, prompt):
+        if self.line is None:
+            await asyncio.Future()
+        line, self.line = self.line, None
+        return line
+
+    def hide_prompt(self):
+        pass
+
+    def show_prompt(self, prompt):
+        pass
+
+    def save_history(self):
+        pass
+
+
+class ReplayCLI(ClaudeCLI):
+    def __init__(self, speed, config_manager, log_manager):
+        self.speed = speed
+        super().__init__(config_manager=config_manager, log_manager=log_manager)
+
+    def create_audio_manager(self):
+        return ReplayAudioManager(self.config_manager, self.speed, self.usage_manager)
+
+    def create_input_reader(self):
+        return ReplayInputReader()
+
+
+class SessionReplay:
+    # Runs a recorded session through the CLI's own input and turn handling
+    # (history, sentence chunking, the TTS router and audio queue, the STT
+    # manager) with the network services replaced by their recordings, and
+    # measures each turn.
+    def __init__(self, trace_path, speed=1.0, config_file="config.json"):
+        self.turns = load_turns(trace_path)
+        self.speed = speed
+        os.environ.setdefault("ANTHROPIC_API_KEY", "replay")
+        self.config_manager = ConfigManager(config_file)
+        # Nothing the replay does not measure is started.
+        self.config_manager.update(config_watch_interval=0.0, fallback_model="", metrics_port=0,
+                                   event_socket_path="", audio_worker=False, memory_budget_mode=False)
+        self.log_manager = LogManager(self.config_manager, log_dir=tempfile.mkdtemp(prefix="claude_cli_replay_"))
+        self.cli = ReplayCLI(speed, self.config_manager, self.log_manager)
+        self.cli.text_output_enabled = True
+        self.cli.claude_api.client = ReplayClient(speed)
+        self.devnull = open(os.devnull, "w")
+        self.cli.claude_api.renderer.stream = self.devnull
+        self.first_text_at = None
+        write = self.cli.claude_api.renderer.write
+
+        def timed_write(text):
+            if self.first_text_at is None:
+                self.first_text_at = time.monotonic()
+            write(text)
+
+        self.cli.claude_api.renderer.write = timed_write
+        self.audio_manager = self.cli.audio_manager
+        self.stt_manager = self.cli.stt_manager
+        self.stt_backend = None
+
+    def feed_frames(self):
+        # Replaces the microphone thread.
+        session = self.stt_backend.session
+        for offset, frame in session.frames:
+            delay = self.stt_backend.started_at + offset / self.speed - time.monotonic()
+            if delay > 0 and self.stt_manager.stop_audio.wait(delay):
+                return
+            if self.stt_manager.stop_audio.is_set():
+                return
+            self.stt_manager.captured_samples += len(frame) // 2
+            self.stt_manager.put_frame(self.stt_manager.stt_audio_queue, frame)
+
+    def prepare_input(self, turn):
+        # A typed turn is read without listening, so only spoken turns pay
+        # for the speech session.
+        self.cli.stt_enabled = turn.stt is not None
+        if not turn.stt:
+            self.cli.input_reader.line = turn.text
+            return
+        if self.stt_backend is None or self.stt_backend.name != turn.stt.backend:
+            self.config_manager.update(stt_backend=turn.stt.backend)
+            self.stt_backend = ReplaySTTBackend(turn.stt.backend, self.speed)
+            self.stt_manager.backends[turn.stt.backend] = self.stt_backend
+            self.stt_manager.audio_capture_thread = self.feed_frames
+        self.stt_backend.session = turn.stt
+        self.stt_backend.started_at = time.monotonic()
+
+    async def replay_turn(self, turn):
+        # Times are scaled back by the replay speed so they compare directly
+        # with the recorded ones.
+        metrics = {}
+        self.prepare_input(turn)
+        user_input = await self.cli.get_user_input()
+        if turn.stt:
+            metrics["stt"] = (time.monotonic() - self.stt_backend.started_at) * self.speed
+        self.cli.speech_enabled = bool(turn.tts)
+        self.cli.claude_api.client.turn = turn
+        self.audio_manager.replay_backend.results = deque(turn.tts)
+        self.audio_manager.playback = deque(seconds for _, seconds in turn.playback)
+        audio_samples = len(self.audio_manager.time_to_first_audio)
+        self.first_text_at = None
+        started = time.monotonic()
+        await self.cli.send_message(user_input or turn.text, self.cli.input_source)
+        metrics["turn"] = (time.monotonic() - started) * self.speed
+        if self.first_text_at is not None:
+            metrics["first_text"] = (self.first_text_at - started) * self.speed
+        if len(self.audio_manager.time_to_first_audio) > audio_samples:
+            metrics["first_audio"] = self.audio_manager.time_to_first_audio[-1] * self.speed
+        return metrics
+
+    async def run(self, on_turn=None):
+        results = []
+        try:
+            for number, turn in enumerate(self.turns, 1):
+                with contextlib.redirect_stdout(self.devnull):
+                    replayed = await self.replay_turn(turn)
+                result = {"turn": number, "source": turn.source, "recorded": turn.recorded_metrics(), "replayed": replayed}
+                results.append(result)
+                if on_turn:
+                    on_turn(result)
+        finally:
+            self.cli.shutdown()
+            self.devnull.close()
+        return results
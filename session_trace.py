@@ -0,0 +1,112 @@
+import gzip
+import json
+import time
+import struct
+import logging
+import threading
+from queue import SimpleQueue
+
+# A trace is a gzip stream that starts with TRACE_MAGIC, followed by records
+# of a fixed header (kind, seconds since the start of recording, payload
+# length) and the payload. Microphone frames are stored as raw 16-bit audio,
+# everything else as JSON.
+TRACE_MAGIC = b"CCTRACE1"
+RECORD_HEADER = struct.Struct("<BdI")
+
+TURN_START = 1      # {"source": "typed" | "spoken", "text": ...}
+TURN_END = 2        # {}
+STT_START = 3       # {"backend": ...}
+MIC_FRAME = 4       # raw audio
+STT_MESSAGE = 5     # Deepgram message as received
+STT_END = 6         # {"transcript": ...}
+LLM_REQUEST = 7     # {"model": ...}
+LLM_CHUNK = 8       # stream event
+TTS_RESULT = 9      # {"backend", "chars", "bytes", "latency", "ok"}
+PLAYBACK = 10       # {"seconds": ...}
+
+KIND_NAMES = {
+    TURN_START: "turn_start", TURN_END: "turn_end", STT_START: "stt_start", MIC_FRAME: "mic_frame",
+    STT_MESSAGE: "stt_message", STT_END: "stt_end", LLM_REQUEST: "llm_request", LLM_CHUNK: "llm_chunk",
+    TTS_RESULT: "tts_result", PLAYBACK: "playback",
+}
+
+
+class TraceRecorder:
+    # Records are queued and written by a background thread, so recording
+    # from the audio callback or the event loop never waits on the disk.
+    def __init__(self, path):
+        self.path = path
+        self.file = gzip.open(path, "wb", compresslevel=1)
+        self.file.write(TRACE_MAGIC)
+        self.started_at = time.monotonic()
+        self.queue = SimpleQueue()
+        self.records = 0
+        self.thread = threading.Thread(target=self.writer_thread, daemon=True)
+        self.thread.start()
+
+    def record(self, kind, payload, at=None):
+        if not isinstance(payload, bytes):
+            payload = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.queue.put((kind, (at or time.monotonic()) - self.started_at, payload))
+
+    def writer_thread(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            kind, offset, payload = item
+            try:
+                self.file.write(RECORD_HEADER.pack(kind, offset, len(payload)))
+                self.file.write(payload)
+                self.records += 1
+            except (OSError, ValueError) as e:
+                logging.error(f"Error writing session trace: {str(e)}")
+                break
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+        logging.info(f"Session trace written to {self.path} ({self.records} records)")
+
+
+recorder = None
+
+
+def start_recording(path):
+    global recorder
+    recorder = TraceRecorder(path)
+    logging.info(f"Recording session trace to {path}")
+
+
+def stop_recording():
+    global recorder
+    if recorder:
+        recorder, active = None, recorder
+        active.close()
+
+
+def record(kind, payload, at=None):
+    # A no-op unless recording, so it is cheap to call from hot paths.
+    if recorder:
+        recorder.record(kind, payload, at)
+
+
+def is_recording():
+    return recorder is not None
+
+
+def read_trace(path):
+    # Yields (kind, seconds, payload) with JSON payloads decoded.
+    with gzip.open(path, "rb") as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(f"{path} is not a session trace")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            kind, offset, length = RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return  # Truncated by a crash; keep what was complete
+            yield kind, offset, payload if kind == MIC_FRAME else json.loads(payload)
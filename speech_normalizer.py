@@ -0,0 +1,141 @@
+import re
+from urllib.parse import urlparse
+
+
+class SpeechNormalizer:
+    # Turns markdown from the model into text that is worth speaking. It runs
+    # on the chunks from SentenceChunker and keeps state between them, since
+    # a code block or table usually spans several chunks. Code blocks and
+    # tables are replaced by a short note, markup and emoji are dropped, and
+    # links are read as their text or host name.
+    CODE_NOTE = "The code is shown on screen."
+    TABLE_NOTE = "The table is shown on screen."
+
+    FENCE = re.compile(r"```|~~~")
+    TABLE_SEPARATOR = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$")
+    LINE_MARKUP = re.compile(r"^\s*(#{1,6}\s+|>\s*|[-*+•]\s+|\d{1,3}[.)]\s+)+")
+    # The chunker joins lines that end a sentence, so list items can also
+    # start mid-chunk.
+    INLINE_LIST_MARKER = re.compile(r"([.!?:]\s+)(?:[-*+•]|\d{1,3}[.)])\s+(?=\S)")
+    INLINE_TABLE_ROW = re.compile(r"([.!?:])\s+(?=\|)")
+    IMAGE = re.compile(r"!\[([^\]]*)\]\([^)]*\)")
+    LINK = re.compile(r"\[([^\]]+)\]\([^)]*\)")
+    URL = re.compile(r"\b(?:https?://|www\.)[^\s<>()]+[^\s<>().,;:!?'\"]")
+    INLINE_CODE = re.compile(r"`([^`]*)`")
+    EMPHASIS = re.compile(r"(\*\*|__|~~)(.+?)\1|(?<![\w*])\*(?!\s)(.+?)(?<!\s)\*(?![\w*])|(?<!\w)_(?!\s)(.+?)(?<!\s)_(?!\w)")
+    HTML_TAG = re.compile(r"</?[a-zA-Z][^>]*>")
+    EMOJI = re.compile("[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF\uFE0F\u200D]")
+    LEFTOVER = re.compile(r"[*_#|`]+")
+
+    NUMBER = r"\d[\d,]*(?:\.\d+)?"
+    RANGE = re.compile(rf"(?<![\d\-/.:])({NUMBER})\s*[-–]\s*({NUMBER})(?![\d\-/.:])")
+    MAGNITUDE = re.compile(rf"({NUMBER})(k|K|M|B|bn)\b")
+    MAGNITUDES = {"k": "thousand", "K": "thousand", "M": "million", "B": "billion", "bn": "billion"}
+    UNITS = {
+        "km/h": "kilometers per hour", "mph": "miles per hour", "m/s": "meters per second",
+        "km": "kilometers", "cm": "centimeters", "mm": "millimeters", "m": "meters",
+        "mi": "miles", "ft": "feet", "in": "inches",
+        "kg": "kilograms", "mg": "milligrams", "g": "grams", "lbs": "pounds", "lb": "pounds", "oz": "ounces",
+        "ml": "milliliters", "mL": "milliliters", "l": "liters", "L": "liters",
+        "°C": "degrees Celsius", "°F": "degrees Fahrenheit", "°": "degrees",
+        "KB": "kilobytes", "MB": "megabytes", "GB": "gigabytes", "TB": "terabytes",
+        "kHz": "kilohertz", "MHz": "megahertz", "GHz": "gigahertz", "Hz": "hertz",
+        "kbps": "kilobits per second", "Mbps": "megabits per second", "Gbps": "gigabits per second",
+        "ms": "milliseconds", "kW": "kilowatts", "kWh": "kilowatt hours", "W": "watts", "V": "volts",
+    }
+    UNIT = re.compile(rf"({NUMBER})\s?({'|'.join(re.escape(unit) for unit in sorted(UNITS, key=len, reverse=True))})(?![\w/])")
+    # "in" and "m" are only units directly after a number; "5 in the box" is not inches.
+    AMBIGUOUS_UNITS = {"in", "m", "l", "g", "W", "V"}
+    SYMBOLS = [
+        (re.compile(r"~\s*(?=\d)"), "about "),
+        (re.compile(r"\s*≈\s*"), " approximately "),
+        (re.compile(r"\s*±\s*"), " plus or minus "),
+        (re.compile(r"(?<=\d)\s*[×x]\s*(?=\d)"), " by "),
+        (re.compile(r"\s*(→|->)\s*"), " to "),
+        (re.compile(r"\s*≥\s*"), " at least "),
+        (re.compile(r"\s*≤\s*"), " at most "),
+    ]
+    ABBREVIATIONS = [
+        (re.compile(r"\be\.g\.(?=\s|,|$)"), "for example"),
+        (re.compile(r"\bi\.e\.(?=\s|,|$)"), "that is"),
+        (re.compile(r"\betc\."), "et cetera."),
+        (re.compile(r"\bvs\.?(?=\s)"), "versus"),
+    ]
+
+    def __init__(self):
+        self.in_code = False
+        self.in_table = False
+        self.chars_in = 0
+        self.chars_out = 0
+
+    def normalize(self, text):
+        self.chars_in += len(text)
+        spoken = []
+        for i, part in enumerate(self.FENCE.split(text)):
+            if i > 0:
+                self.in_code = not self.in_code
+                if self.in_code:
+                    spoken.append(self.CODE_NOTE)
+            if not self.in_code:
+                spoken.append(self.normalize_prose(part))
+        result = re.sub(r"\s+", " ", " ".join(spoken)).strip()
+        self.chars_out += len(result)
+        return result
+
+    def normalize_prose(self, text):
+        lines = []
+        for line in self.INLINE_TABLE_ROW.sub("\\1\n", text).split("\n"):
+            if self.is_table_row(line):
+                if not self.in_table:
+                    self.in_table = True
+                    lines.append(self.TABLE_NOTE)
+                continue
+            if line.strip():
+                self.in_table = False
+            lines.append(self.normalize_line(line).strip())
+        # A heading or list item without punctuation still gets a pause.
+        return " ".join(line if not line or line[-1] in ".!?:;," or i == len(lines) - 1 else line + "."
+                        for i, line in enumerate(lines))
+
+    def is_table_row(self, line):
+        stripped = line.strip()
+        if self.TABLE_SEPARATOR.match(stripped) and "-" in stripped:
+            return True
+        return stripped.startswith("|") and stripped.count("|") >= 2
+
+    def normalize_line(self, line):
+        line = self.LINE_MARKUP.sub("", line)
+        line = self.INLINE_LIST_MARKER.sub(r"\1", line)
+        line = self.IMAGE.sub(r"\1", line)
+        line = self.LINK.sub(r"\1", line)
+        line = self.URL.sub(self.speak_url, line)
+        line = self.INLINE_CODE.sub(r"\1", line)
+        line = self.HTML_TAG.sub(" ", line)
+        line = self.EMPHASIS.sub(lambda m: next(group for group in m.groups()[1:] if group is not None), line)
+        line = self.EMOJI.sub("", line)
+        line = self.LEFTOVER.sub(" ", line)
+        for pattern, replacement in self.ABBREVIATIONS:
+            line = pattern.sub(replacement, line)
+        return self.expand_numbers(line)
+
+    def speak_url(self, match):
+        url = match.group(0)
+        host = urlparse(url if "://" in url else f"http://{url}").hostname or ""
+        return host[4:] if host.startswith("www.") else host
+
+    def expand_numbers(self, line):
+        line = self.RANGE.sub(r"\1 to \2", line)
+        line = self.MAGNITUDE.sub(lambda m: f"{m.group(1)} {self.MAGNITUDES[m.group(2)]}", line)
+        line = self.UNIT.sub(self.speak_unit, line)
+        for pattern, replacement in self.SYMBOLS:
+            line = pattern.sub(replacement, line)
+        return line
+
+    def speak_unit(self, match):
+        number, unit = match.groups()
+        if unit in self.AMBIGUOUS_UNITS and match.group(0) != number + unit:
+            return match.group(0)
+        return f"{number} {self.UNITS[unit]}"
+
+    def saved(self):
+        return self.chars_in - self.chars_out
@@ -0,0 +1,59 @@
+import sys
+import threading
+from collections import deque
+from colorama import Fore
+
+
+class StreamRenderer:
+    # Buffers streamed text and writes it to the terminal from a background
+    # thread, either at a fixed frame rate or as soon as a newline arrives.
+    # write() only appends to a deque, so the event loop never waits on the
+    # terminal. After a frame with nothing to write the thread sleeps until
+    # the next write.
+    def __init__(self, fps=30, color=Fore.GREEN, stream=None):
+        self.interval = 1 / fps
+        self.color = color
+        self.stream = stream or sys.stdout
+        self.pending = deque()
+        self.wake = threading.Event()
+        self.output_lock = threading.Lock()
+        self.sleeping = False
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.render_thread, daemon=True)
+            self.thread.start()
+
+    def write(self, text):
+        self.pending.append(text)
+        # Checked after appending; the thread sets it before checking pending.
+        if self.sleeping or "\n" in text:
+            self.wake.set()
+
+    def render_thread(self):
+        active = False
+        while True:
+            if active:
+                self.wake.wait(self.interval)
+            else:
+                self.sleeping = True
+                if not self.pending:
+                    self.wake.wait()
+                self.sleeping = False
+            self.wake.clear()
+            active = self.flush()
+
+    def flush(self):
+        with self.output_lock:
+            chunks = []
+            try:
+                while True:
+                    chunks.append(self.pending.popleft())
+            except IndexError:
+                pass
+            if chunks:
+                # One color code and one flush per block rather than per token.
+                self.stream.write(self.color + "".join(chunks))
+                self.stream.flush()
+            return bool(chunks)
@@ -0,0 +1,253 @@
+import json
+import asyncio
+import websockets
+from websockets.exceptions import WebSocketException, ConnectionClosedError, ConnectionClosedOK
+from colorama import Fore, Style
+from audio_codecs import create_encoder
+import session_trace
+
+try:
+    from vosk import Model, KaldiRecognizer, SetLogLevel
+except ImportError:
+    Model = None
+
+
+class STTBackend:
+    name = "base"
+
+    # Backends that want compressed audio return an encoder here; frames are
+    # then encoded on a separate thread before they reach next_frame.
+    def create_encoder(self):
+        return None
+
+    # next_frame is a coroutine returning the next block of audio, or None once
+    # capture has stopped. on_partial is called with interim text and on_ready
+    # once the backend is accepting audio. With an endpointer, the end of the
+    # turn is decided locally rather than by the backend. Returns the final
+    # transcript, or None if the backend failed.
+    async def transcribe(self, next_frame, on_partial, on_ready, encoder=None, endpointer=None):
+        raise NotImplementedError
+
+
+class DeepgramSTTBackend(STTBackend):
+    name = "deepgram"
+
+    def __init__(self, api_key, model, sample_rate, logger, encoding="linear16", connect_timeout=10):
+        self.api_key = api_key
+        self.connect_timeout = connect_timeout
+        self.model = model
+        self.sample_rate = sample_rate
+        self.logger = logger
+        self.encoding = encoding
+        self.bytes_sent = 0
+
+    def create_encoder(self):
+        return create_encoder(self.encoding, self.sample_rate)
+
+    def get_url(self, encoder=None, endpointing_ms=500):
+        audio_params = encoder.url_params() if encoder else f"encoding=linear16&sample_rate={self.sample_rate}"
+        url = (f"wss://api.deepgram.com/v1/listen?model={self.model}&punctuate=true&interim_results=true"
+               f"&endpointing={endpointing_ms}")
+        return f"{url}&{audio_params}" if audio_params else url
+
+    async def transcribe(self, next_frame, on_partial, on_ready, encoder=None, endpointer=None):
+        print(f"{Fore.CYAN}Connecting to Deepgram, please wait...{Style.RESET_ALL}")
+        self.bytes_sent = 0
+        started_at = asyncio.get_event_loop().time()
+        # With local endpointing, Deepgram's own endpointing is only a backstop.
+        url = self.get_url(encoder, int(endpointer.max_ms) if endpointer else 500)
+        try:
+            async with websockets.connect(url, extra_headers={"Authorization": f"Token {self.api_key}"},
+                                          open_timeout=self.connect_timeout) as ws:
+                on_ready()
+                sender_task = asyncio.create_task(self.audio_sender(ws, next_frame))
+                receiver_task = asyncio.create_task(self.audio_receiver(ws, on_partial, endpointer))
+
+                try:
+                    done, pending = await asyncio.wait(
+                        [sender_task, receiver_task],
+                        return_when=asyncio.FIRST_COMPLETED
+                    )
+
+                    if receiver_task not in done and endpointer:
+                        # The audio ended first. CloseStream has been sent, and
+                        # the receiver collects the last words until Deepgram closes.
+                        done, pending = await asyncio.wait([receiver_task], timeout=3.0)
+
+                    for task in pending:
+                        task.cancel()
+
+                    return receiver_task.result() if receiver_task in done else ""
+                finally:
+                    # Ensure the WebSocket is closed properly
+                    try:
+                        await ws.close()
+                    except Exception as e:
+                        self.logger.error(f"Error closing WebSocket: {str(e)}")
+
+        except WebSocketException as e:
+            print(f"{Fore.RED}WebSocket connection error: {str(e)}{Style.RESET_ALL}")
+            self.logger.error(f"WebSocket connection error: {str(e)}")
+        except ConnectionClosedError as e:
+            if e.code == 1000:
+                print(f"{Fore.CYAN}WebSocket connection closed normally.{Style.RESET_ALL}")
+                self.logger.info("WebSocket connection closed normally.")
+            else:
+                print(f"{Fore.RED}WebSocket connection closed unexpectedly: {str(e)}{Style.RESET_ALL}")
+                self.logger.error(f"WebSocket connection closed unexpectedly: {str(e)}")
+        except ConnectionClosedOK:
+            print(f"{Fore.CYAN}WebSocket connection closed gracefully.{Style.RESET_ALL}")
+            self.logger.info("WebSocket connection closed gracefully.")
+        except Exception as e:
+            print(f"{Fore.RED}An unexpected error occurred: {str(e)}{Style.RESET_ALL}")
+            self.logger.error(f"An unexpected error occurred: {str(e)}")
+        finally:
+            elapsed = asyncio.get_event_loop().time() - started_at
+            self.logger.info(f"Deepgram session sent {self.bytes_sent} bytes of {self.encoding} audio "
+                             f"in {elapsed:.1f} s ({self.bytes_sent * 8 / max(elapsed, 0.001) / 1000:.1f} kbit/s)")
+            print(f"{Fore.CYAN}Disconnected from Deepgram.{Style.RESET_ALL}")
+        return None
+
+    async def audio_sender(self, ws, next_frame):
+        try:
+            while True:
+                audio_data = await next_frame()
+                if audio_data is None:
+                    break
+                await ws.send(audio_data)
+                self.bytes_sent += len(audio_data)
+        except Exception as e:
+            self.logger.error(f"Error in audio sender: {str(e)}")
+        finally:
+            try:
+                await ws.send(json.dumps({"type": "CloseStream"}))
+                self.logger.info("Sent CloseStream message")
+            except ConnectionClosedOK:
+                self.logger.info("WebSocket already closed gracefully")
+            except ConnectionClosedError as e:
+                if e.code == 1000:
+                    self.logger.info("WebSocket closed normally")
+                else:
+                    self.logger.error(f"Error closing WebSocket: {str(e)}")
+            except Exception as e:
+                self.logger.error(f"Unexpected error while closing WebSocket: {str(e)}")
+
+    async def audio_receiver(self, ws, on_partial, endpointer=None):
+        if endpointer:
+            return await self.endpointed_receiver(ws, on_partial, endpointer)
+        transcript = ""
+        try:
+            async for msg in ws:
+                res = json.loads(msg)
+                session_trace.record(session_trace.STT_MESSAGE, res)
+                transcript = res.get("channel", {}).get("alternatives", [{}])[0].get("transcript", "")
+                if not res.get("is_final"):
+                    if transcript.strip():
+                        on_partial(transcript.strip())
+                    continue
+                if transcript.strip():
+                    return transcript.strip()
+        except Exception as e:
+            self.logger.error(f"Error in audio receiver: {str(e)}")
+        return transcript
+
+    async def endpointed_receiver(self, ws, on_partial, endpointer):
+        # Final segments are collected until the endpointer decides the turn
+        # is over. Capture then stops, and the audio still queued, with the
+        # encoder's tail, is sent before CloseStream. Deepgram returns the
+        # words still in flight at once and closes, instead of waiting for
+        # its own endpointing delay.
+        loop = asyncio.get_event_loop()
+        finals = []
+        close_deadline = None
+        try:
+            while True:
+                try:
+                    # Cancelling recv() is safe; nothing is lost.
+                    msg = await asyncio.wait_for(ws.recv(), 0.05)
+                except asyncio.TimeoutError:
+                    msg = None
+                if msg is not None:
+                    res = json.loads(msg)
+                    session_trace.record(session_trace.STT_MESSAGE, res)
+                    transcript = res.get("channel", {}).get("alternatives", [{}])[0].get("transcript", "").strip()
+                    if res.get("is_final"):
+                        if transcript:
+                            finals.append(transcript)
+                        endpointer.on_text(" ".join(finals))
+                        if close_deadline is None and res.get("speech_final") and finals:
+                            endpointer.reason = "server"
+                            return " ".join(finals)
+                    elif transcript:
+                        text = " ".join(finals + [transcript])
+                        endpointer.on_text(text)
+                        on_partial(text)
+                if close_deadline is None:
+                    if endpointer.should_end():
+                        endpointer.end()
+                        close_deadline = loop.time() + 2.0
+                elif loop.time() >= close_deadline:
+                    self.logger.warning("Deepgram did not close the stream; using the transcript so far")
+                    return " ".join(finals)
+        except ConnectionClosedOK:
+            pass
+        except Exception as e:
+            self.logger.error(f"Error in audio receiver: {str(e)}")
+        return " ".join(finals)
+
+
+class VoskSTTBackend(STTBackend):
+    name = "vosk"
+
+    def __init__(self, model_path, sample_rate, logger):
+        self.model_path = model_path
+        self.sample_rate = sample_rate
+        self.logger = logger
+        self.model = None
+
+    def load_model(self):
+        if Model is None:
+            raise RuntimeError("The vosk package is not installed. Run 'pip install vosk'.")
+        if self.model is None:
+            SetLogLevel(-1)
+            self.model = Model(self.model_path)
+            self.logger.info(f"Vosk model loaded from {self.model_path}")
+        return self.model
+
+    async def transcribe(self, next_frame, on_partial, on_ready, encoder=None, endpointer=None):
+        loop = asyncio.get_event_loop()
+        try:
+            model = await loop.run_in_executor(None, self.load_model)
+        except Exception as e:
+            print(f"{Fore.RED}Local speech recognizer unavailable: {str(e)}{Style.RESET_ALL}")
+            self.logger.error(f"Error loading Vosk model: {str(e)}")
+            return None
+
+        recognizer = KaldiRecognizer(model, self.sample_rate)
+        on_ready()
+        last_partial = ""
+        finals = []
+        while True:
+            audio_data = await next_frame()
+            if audio_data is None:
+                break
+            # Decoding is CPU bound, so keep it off the event loop.
+            if await loop.run_in_executor(None, recognizer.AcceptWaveform, audio_data):
+                transcript = json.loads(recognizer.Result()).get("text", "").strip()
+                if transcript and not endpointer:
+                    return transcript
+                if transcript:
+                    # Kaldi's endpoint only closes a segment; the endpointer decides the turn.
+                    finals.append(transcript)
+                    endpointer.on_text(" ".join(finals))
+            else:
+                partial = json.loads(recognizer.PartialResult()).get("partial", "")
+                if partial and partial != last_partial:
+                    last_partial = partial
+                    on_partial(" ".join(finals + [partial]))
+                    if endpointer:
+                        endpointer.on_text(" ".join(finals + [partial]))
+            if endpointer and endpointer.should_end():
+                break
+        finals.append(json.loads(recognizer.FinalResult()).get("text", "").strip())
+        return " ".join(text for text in finals if text)
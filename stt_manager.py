@@ -1,93 +1,337 @@
 import os
-import json
+import time
 import asyncio
 import threading
-from queue import Queue
+from queue import Queue, Empty, Full
+from collections import deque
 import sounddevice as sd
-import websockets
-from websockets.exceptions import WebSocketException, ConnectionClosedError, ConnectionClosedOK
 from dotenv import load_dotenv
 from colorama import init, Fore, Style
+from stt_backends import DeepgramSTTBackend, VoskSTTBackend
+from wake_word import WakeWordDetector
+from circuit_breaker import CircuitBreaker
+from endpointing import VoiceActivityDetector, PauseModel, Endpointer
+from realtime import CallbackTimer, JITTER_SECONDS, XRUNS
+import session_trace
+import event_bus
+import metrics
+
+SESSIONS = metrics.registry.counter("claude_cli_stt_sessions_total", "Speech recognition sessions, by backend and outcome")
+CONNECT_SECONDS = metrics.registry.histogram("claude_cli_stt_connect_seconds", "Time until the speech recognition backend accepts audio, by backend")
+ERRORS = metrics.registry.counter("claude_cli_errors_total", "Failed requests, by service")
+FAST_FAILURES = metrics.registry.counter("claude_cli_circuit_rejections_total", "Requests failed fast by an open circuit, by service")
+ENDPOINTS = metrics.registry.counter("claude_cli_stt_endpoints_total", "Ends of turn detected, by reason")
+DROPPED_FRAMES = metrics.registry.counter("claude_cli_stt_dropped_frames_total", "Microphone frames dropped because the STT connection was behind")
 
 
 class STTManager:
-    def __init__(self, config_manager, log_manager):
+    def __init__(self, config_manager, log_manager, usage_manager=None):
         self.config_manager = config_manager
         self.logger = log_manager.get_logger()
+        self.usage_manager = usage_manager
         self.deepgram_model = self.config_manager.get_deepgram_model()
         self.deepgram_api_key = os.getenv("DEEPGRAM_API_KEY")
         self.stt_sample_rate = 16000
         self.stt_chunk_size = 1024
         self.stt_audio_queue = Queue()
+        self.stt_send_queue = self.stt_audio_queue
         self.stop_audio = threading.Event()
+        self.captured_samples = 0
+        self.dropped_frames = 0
+        self.preroll_frames = deque()
+        self.audio_worker = None  # Set when capture runs in the audio worker process
+        self.vad = VoiceActivityDetector()
+        self.pause_model = PauseModel(os.path.join(log_manager.log_dir, "endpointing.json"),
+                                      self.config_manager.get_endpointing_min_ms(),
+                                      self.config_manager.get_endpointing_max_ms())
+        self.endpointer = None
+        self.backends = {}
+        self.breakers = {}
+        self.config_manager.subscribe(
+            ["deepgram_model", "stt_encoding", "stt_vosk_model_path", "deepgram_connect_timeout"],
+            self.on_config_change
+        )
+        self.config_manager.subscribe(["endpointing_min_ms", "endpointing_max_ms"], self.on_endpointing_config_change)
+        self.config_manager.subscribe(
+            ["circuit_failure_rate", "circuit_window_seconds", "circuit_min_calls", "circuit_open_seconds"],
+            self.on_circuit_config_change
+        )
+        metrics.registry.gauge("claude_cli_stt_queue_depth", "Microphone frames waiting to be sent",
+                               lambda: len(self.stt_send_queue.queue) + len(self.preroll_frames))
+
+    def on_config_change(self, config, changed):
+        # Backends are created per session from the current settings, so
+        # dropping the affected ones is enough for the next session to pick
+        # up the change. The Vosk model is only reloaded if its path changed.
+        self.deepgram_model = config.deepgram_model
+        self.backends.pop("deepgram", None)
+        if "stt_vosk_model_path" in changed:
+            self.backends.pop("vosk", None)
+
+    def on_endpointing_config_change(self, config, changed):
+        self.pause_model.min_ms = config.endpointing_min_ms
+        self.pause_model.max_ms = config.endpointing_max_ms
+
+    def create_endpointer(self):
+        if self.config_manager.get_stt_endpointing() != "adaptive":
+            return None
+        threshold = self.pause_model.threshold_ms()
+        self.logger.debug(f"End-of-turn silence {threshold:.0f} ms from {len(self.pause_model.pauses)} learned pauses")
+        return Endpointer(threshold, self.pause_model.max_ms, self.stt_chunk_size * 1000 / self.stt_sample_rate,
+                          on_end=self.stop_audio.set)
+
+    def get_backend(self):
+        name = self.config_manager.get_stt_backend()
+        if name not in self.backends:
+            if name == "vosk":
+                self.backends[name] = VoskSTTBackend(self.config_manager.get_stt_vosk_model_path(),
+                                                     self.stt_sample_rate, self.logger)
+            else:
+                if name != "deepgram":
+                    self.logger.warning(f"Unknown STT backend '{name}'. Using Deepgram.")
+                self.backends[name] = DeepgramSTTBackend(self.deepgram_api_key, self.deepgram_model,
+                                                         self.stt_sample_rate, self.logger,
+                                                         self.config_manager.get_stt_encoding(),
+                                                         self.config_manager.get_deepgram_connect_timeout())
+        return self.backends[name]
+
+    def get_breaker(self, backend):
+        if backend.name not in self.breakers:
+            self.breakers[backend.name] = CircuitBreaker(f"{backend.name.capitalize()} STT",
+                                                         on_state_change=self.on_breaker_change,
+                                                         **self.config_manager.get_circuit_settings())
+        return self.breakers[backend.name]
+
+    def on_circuit_config_change(self, config, changed):
+        for breaker in self.breakers.values():
+            breaker.configure(**self.config_manager.get_circuit_settings())
+
+    def on_breaker_change(self, breaker, previous, state):
+        if state == CircuitBreaker.OPEN and previous == CircuitBreaker.CLOSED:
+            print(f"{Fore.RED}Speech recognition is unavailable. Type your input; "
+                  f"it will be retried automatically.{Style.RESET_ALL}")
+        elif state == CircuitBreaker.CLOSED:
+            print(f"{Fore.MAGENTA}Speech recognition has recovered.{Style.RESET_ALL}")
+
+    def create_wake_word_detector(self):
+        mode = self.config_manager.get_wake_word_mode()
+        if mode == "off":
+            return None
+        try:
+            return WakeWordDetector(mode, self.stt_sample_rate, self.stt_chunk_size,
+                                    self.config_manager.get_wake_word_model_path(),
+                                    self.config_manager.get_wake_word_threshold(),
+                                    self.config_manager.get_wake_word_preroll_ms())
+        except Exception as e:
+            self.logger.error(f"Error loading wake word model: {str(e)}. Using the energy detector.")
+            return WakeWordDetector("energy", self.stt_sample_rate, self.stt_chunk_size,
+                                    preroll_ms=self.config_manager.get_wake_word_preroll_ms())
+
+    async def wait_for_wake_word(self, detector):
+        # Frames are only inspected locally here; nothing is sent until the
+        # detector fires, after which the pre-roll is replayed ahead of the
+        # live audio so the start of the request is not lost. Detection runs
+        # in a worker thread and only its result comes back to the loop.
+        loop = asyncio.get_event_loop()
+        print(f"{Fore.CYAN}Waiting for wake word...{Style.RESET_ALL}")
+        cancelled = threading.Event()
+        try:
+            preroll = await loop.run_in_executor(None, self.detect_wake_word, detector, cancelled)
+        finally:
+            cancelled.set()  # Ends the thread if this wait was cancelled
+        if preroll is None:
+            return False
+        self.preroll_frames = deque(preroll)
+        # Only the replayed and following audio reaches the service.
+        self.captured_samples = len(self.preroll_frames) * self.stt_chunk_size
+        self.logger.info(f"Wake word detected. Sending {len(self.preroll_frames)} pre-roll frames.")
+        return True
+
+    def detect_wake_word(self, detector, cancelled):
+        # Returns the pre-roll frames once the wake word is heard, or None if
+        # capture stops first.
+        while not (self.stop_audio.is_set() or cancelled.is_set()):
+            try:
+                frame = self.stt_audio_queue.get(True, 0.1)
+            except Empty:
+                continue
+            if detector.process(frame):
+                return detector.take_preroll()
+        return None
 
     async def listen_for_speech(self):
-        print(f"{Fore.CYAN}Connecting to Deepgram, please wait...{Style.RESET_ALL}")
+        backend = self.get_backend()
+        breaker = self.get_breaker(backend)
+        if not breaker.allow():
+            # Fail fast while the service is down. Typed input still works
+            # meanwhile, and the next call after the wait probes the service.
+            FAST_FAILURES.inc(service=backend.name)
+            await asyncio.sleep(max(breaker.retry_in(), 1.0))
+            return None
+        session_trace.record(session_trace.STT_START, {"backend": backend.name})
+        try:
+            result = await self.run_session(backend)
+        except asyncio.CancelledError:
+            breaker.record_cancelled()
+            raise
+        except Exception:
+            breaker.record_failure()
+            ERRORS.inc(service=backend.name)
+            SESSIONS.inc(backend=backend.name, outcome="error")
+            raise
+        session_trace.record(session_trace.STT_END, {"transcript": result})
+        if result is None:
+            breaker.record_failure()
+            ERRORS.inc(service=backend.name)
+            SESSIONS.inc(backend=backend.name, outcome="error")
+            return None
+        breaker.record_success()
+        SESSIONS.inc(backend=backend.name, outcome="ok" if result.strip() else "empty")
+        if not result.strip():
+            print(f"{Fore.YELLOW}No speech detected. Please try again.{Style.RESET_ALL}")
+            return None
+        if "goodbye" in result.lower():
+            print(f"{Fore.MAGENTA}Goodbye detected. Exiting Claude CLI.{Style.RESET_ALL}")
+            return "GOODBYE_DETECTED"
+        return result.strip()
 
-        deepgram_url = f"wss://api.deepgram.com/v1/listen?model={self.deepgram_model}&punctuate=true&encoding=linear16&sample_rate={self.stt_sample_rate}&endpointing=500"
+    async def run_session(self, backend):
+        self.stop_audio.clear()  # Reset the stop event
+        self.stt_audio_queue = Queue(self.get_queue_limit())  # Create a new queue for this session
+        self.stt_send_queue = self.stt_audio_queue
+        self.preroll_frames = deque()
+        self.captured_samples = 0
+        self.dropped_frames = 0
+        audio_thread = None
+        encoder_thread = None
+        partial_shown = False
+        detector = self.create_wake_word_detector()
 
+        def start_capture():
+            nonlocal audio_thread
+            audio_thread = threading.Thread(target=self.audio_capture_thread)
+            audio_thread.start()
+
+        def on_ready():
+            if connect_started is not None:
+                CONNECT_SECONDS.observe(time.monotonic() - connect_started, backend=backend.name)
+            print(f"{Fore.CYAN}Connected. Listening, now talk...{Style.RESET_ALL}")
+            if audio_thread is None:
+                start_capture()
+
+        def on_partial(text):
+            nonlocal partial_shown
+            partial_shown = True
+            event_bus.publish("transcript", text=text, final=False)
+            print(f"\r{Fore.CYAN}... {text}{Style.RESET_ALL}", end='', flush=True)
+
+        result = None
+        streaming = False
+        connect_started = None
         try:
-            async with websockets.connect(deepgram_url, extra_headers={"Authorization": f"Token {self.deepgram_api_key}"}) as ws:
-                print(f"{Fore.CYAN}Connected. Listening, now talk...{Style.RESET_ALL}")
+            if detector:
+                # Capture starts before the STT session so the detector can run
+                # on the same frames; the session is only opened on detection.
+                start_capture()
+                if not await self.wait_for_wake_word(detector):
+                    return ""
+            # Created after the wake word, so only the request itself is
+            # measured. The pre-roll is part of the request, so it is heard
+            # first; the capture thread only uses the VAD once this is set.
+            endpointer = self.create_endpointer()
+            if endpointer:
+                for frame in self.preroll_frames:
+                    endpointer.feed(self.vad.is_speech(frame))
+            self.endpointer = endpointer
+            try:
+                encoder = backend.create_encoder()
+            except Exception as e:
+                self.logger.error(f"Error creating STT audio encoder: {str(e)}. Sending uncompressed audio.")
+                encoder = None
+            if encoder:
+                self.stt_send_queue = Queue(self.get_queue_limit())
+                encoder_thread = threading.Thread(target=self.audio_encoder_thread, args=(encoder,))
+                encoder_thread.start()
+            streaming = True
+            connect_started = time.monotonic()
+            result = await backend.transcribe(self.next_frame, on_partial, on_ready, encoder, self.endpointer)
+        finally:
+            self.stop_audio.set()
+            endpointer, self.endpointer = self.endpointer, None
+            # Joined in a worker thread so a cancelled session does not hold up the loop.
+            loop = asyncio.get_event_loop()
+            if audio_thread:
+                await loop.run_in_executor(None, audio_thread.join)
+            if encoder_thread:
+                await loop.run_in_executor(None, encoder_thread.join)
+            if partial_shown:
+                print()
+            if self.dropped_frames:
+                self.logger.warning(f"Dropped {self.dropped_frames} audio frames while the STT connection was behind")
+            if self.usage_manager and backend.name == "deepgram" and streaming and self.captured_samples:
+                self.usage_manager.record_deepgram(self.deepgram_model, self.captured_samples / self.stt_sample_rate)
 
-                self.stop_audio.clear()  # Reset the stop event
-                self.stt_audio_queue = Queue()  # Create a new queue for this session
-                audio_thread = threading.Thread(target=self.audio_capture_thread)
-                audio_thread.start()
+        if result:
+            event_bus.publish("transcript", text=result, final=True)
+        if endpointer and result:
+            # Only pauses from utterances that were recognized are learned.
+            if endpointer.pauses:
+                self.pause_model.add(endpointer.pauses)
+                await asyncio.get_event_loop().run_in_executor(None, self.pause_model.save)
+            reason = endpointer.reason or "capture_stopped"
+            ENDPOINTS.inc(reason=reason)
+            self.logger.info(f"End of turn ({reason}) after {endpointer.silence_ms:.0f} ms of silence; "
+                             f"threshold {endpointer.threshold_ms:.0f} ms")
 
-                sender_task = asyncio.create_task(self.audio_sender(ws))
-                receiver_task = asyncio.create_task(self.audio_receiver(ws))
+        return result
 
+    def get_queue_limit(self):
+        # In memory budget mode the audio queues hold at most
+        # stt_queue_max_seconds of audio; 0 means unbounded.
+        if not self.config_manager.get_memory_budget_mode():
+            return 0
+        seconds = self.config_manager.get_stt_queue_max_seconds()
+        return max(1, int(seconds * self.stt_sample_rate / self.stt_chunk_size))
+
+    def put_frame(self, queue, frame):
+        # The microphone cannot be paused, so when a bounded queue is full the
+        # oldest frame is dropped to make room for the newest.
+        while True:
+            try:
+                queue.put_nowait(frame)
+                return
+            except Full:
                 try:
-                    done, pending = await asyncio.wait(
-                        [sender_task, receiver_task],
-                        return_when=asyncio.FIRST_COMPLETED
-                    )
-
-                    for task in pending:
-                        task.cancel()
-                    
-                    result = next(iter(done)).result()
-                finally:
-                    self.stop_audio.set()
-                    audio_thread.join()
-
-                    # Ensure the WebSocket is closed properly
-                    try:
-                        await ws.close()
-                    except Exception as e:
-                        self.logger.error(f"Error closing WebSocket: {str(e)}")
-
-                if result and result.strip():
-                    return result
-                else:
-                    print(f"{Fore.YELLOW}No speech detected. Please try again.{Style.RESET_ALL}")
-                    return None
+                    queue.get_nowait()
+                    self.dropped_frames += 1
+                    DROPPED_FRAMES.inc()
+                except Empty:
+                    pass
 
-        except WebSocketException as e:
-            print(f"{Fore.RED}WebSocket connection error: {str(e)}{Style.RESET_ALL}")
-            self.logger.error(f"WebSocket connection error: {str(e)}")
-        except ConnectionClosedError as e:
-            if e.code == 1000:
-                print(f"{Fore.CYAN}WebSocket connection closed normally.{Style.RESET_ALL}")
-                self.logger.info("WebSocket connection closed normally.")
-            else:
-                print(f"{Fore.RED}WebSocket connection closed unexpectedly: {str(e)}{Style.RESET_ALL}")
-                self.logger.error(f"WebSocket connection closed unexpectedly: {str(e)}")
-        except ConnectionClosedOK:
-            print(f"{Fore.CYAN}WebSocket connection closed gracefully.{Style.RESET_ALL}")
-            self.logger.info("WebSocket connection closed gracefully.")
-        except Exception as e:
-            print(f"{Fore.RED}An unexpected error occurred: {str(e)}{Style.RESET_ALL}")
-            self.logger.error(f"An unexpected error occurred: {str(e)}")
-        finally:
-            print(f"{Fore.CYAN}Disconnected from Deepgram.{Style.RESET_ALL}")
+    def handle_frame(self, frame):
+        endpointer = self.endpointer
+        if endpointer:
+            endpointer.feed(self.vad.is_speech(frame))
+        self.captured_samples += len(frame) // 2
+        self.put_frame(self.stt_audio_queue, frame)
+        session_trace.record(session_trace.MIC_FRAME, frame)
 
     def audio_capture_thread(self):
+        if self.audio_worker:
+            return self.worker_capture_thread()
+
+        timer = CallbackTimer("Audio capture callback", self.stt_chunk_size / self.stt_sample_rate,
+                              lambda jitter: JITTER_SECONDS.observe(jitter, stream="capture"),
+                              self.config_manager.get_audio_realtime_priority(),
+                              self.config_manager.get_audio_cpu_affinity())
+
         def audio_callback(indata, frames, time, status):
+            timer.tick()
             if status:
+                if status.input_overflow:
+                    XRUNS.inc(stream="capture")
                 self.logger.warning(f"Audio callback status: {status}")
-            self.stt_audio_queue.put(indata.tobytes())
+            self.handle_frame(indata.tobytes())
 
         try:
             with sd.InputStream(samplerate=self.stt_sample_rate, channels=1, dtype='int16', callback=audio_callback, blocksize=self.stt_chunk_size):
@@ -96,46 +340,74 @@ class STTManager:
         except Exception as e:
             self.logger.error(f"Error in audio capture thread: {str(e)}")
 
-    async def audio_sender(self, ws):
+    def worker_capture_thread(self):
+        # Frames are captured in the audio worker process; this thread only
+        # moves them from the shared ring to the session queue.
+        self.audio_worker.start_capture()
         try:
+            while not self.stop_audio.is_set():
+                frame = self.audio_worker.read_frame(0.1)
+                if frame:
+                    self.handle_frame(frame)
+        except Exception as e:
+            self.logger.error(f"Error in audio capture thread: {str(e)}")
+        finally:
+            self.audio_worker.stop_capture()
+
+    def audio_encoder_thread(self, encoder):
+        try:
+            while self.preroll_frames:
+                encoded = encoder.encode(self.preroll_frames.popleft())
+                if encoded:
+                    self.put_frame(self.stt_send_queue, encoded)
             while not self.stop_audio.is_set():
                 try:
-                    audio_data = await asyncio.get_event_loop().run_in_executor(None, self.stt_audio_queue.get, True, 1.0)
-                    await ws.send(audio_data)
-                except asyncio.TimeoutError:
-                    # No audio data received, but continue loop
+                    audio_data = self.stt_audio_queue.get(True, 0.1)
+                except Empty:
                     continue
-                except Exception as e:
-                    self.logger.error(f"Error sending audio data: {str(e)}")
+                encoded = encoder.encode(audio_data)
+                if encoded:
+                    self.put_frame(self.stt_send_queue, encoded)
+            # Encode what capture left behind, then the encoder's tail: the
+            # last partial Opus frame and the end-of-stream page.
+            while True:
+                try:
+                    audio_data = self.stt_audio_queue.get_nowait()
+                except Empty:
                     break
+                encoded = encoder.encode(audio_data)
+                if encoded:
+                    self.put_frame(self.stt_send_queue, encoded)
+            tail = encoder.flush()
+            if tail:
+                self.put_frame(self.stt_send_queue, tail)
         except Exception as e:
-            self.logger.error(f"Error in audio sender: {str(e)}")
+            self.logger.error(f"Error in audio encoder thread: {str(e)}")
         finally:
-            try:
-                await ws.send(json.dumps({"type": "CloseStream"}))
-                self.logger.info("Sent CloseStream message")
-            except ConnectionClosedOK:
-                self.logger.info("WebSocket already closed gracefully")
-            except ConnectionClosedError as e:
-                if e.code == 1000:
-                    self.logger.info("WebSocket closed normally")
-                else:
-                    self.logger.error(f"Error closing WebSocket: {str(e)}")
-            except Exception as e:
-                self.logger.error(f"Unexpected error while closing WebSocket: {str(e)}")
+            self.put_frame(self.stt_send_queue, None)  # End of stream for next_frame
 
-    async def audio_receiver(self, ws):
-        transcript = ""
-        try:
-            async for msg in ws:
-                res = json.loads(msg)
-                if res.get("is_final"):
-                    transcript = res.get("channel", {}).get("alternatives", [{}])[0].get("transcript", "")
-                    if transcript.strip():
-                        if "goodbye" in transcript.lower():
-                            print(f"{Fore.MAGENTA}Goodbye detected. Exiting Claude CLI.{Style.RESET_ALL}")
-                            return "GOODBYE_DETECTED"
-                        return transcript.strip()
-        except Exception as e:
-            self.logger.error(f"Error in audio receiver: {str(e)}")
-        return transcript
\ No newline at end of file
+    async def next_frame(self):
+        # Once capture stops, what is still queued is returned before None,
+        # so the end of the utterance reaches the backend. The encoder thread
+        # ends its queue with None after the encoder's tail; it is waited for
+        # only briefly in case the thread has died.
+        loop = asyncio.get_event_loop()
+        if self.preroll_frames and self.stt_send_queue is self.stt_audio_queue:
+            return self.preroll_frames.popleft()
+        encoded = self.stt_send_queue is not self.stt_audio_queue
+        deadline = None
+        while True:
+            if self.stop_audio.is_set():
+                if not encoded:
+                    try:
+                        return self.stt_send_queue.get_nowait()
+                    except Empty:
+                        return None
+                deadline = deadline or loop.time() + 1.0
+                if loop.time() >= deadline:
+                    return None
+            try:
+                return await loop.run_in_executor(None, self.stt_send_queue.get, True, 0.1)
+            except Empty:
+                # No audio data received, but continue loop
+                continue
\ No newline at end of file
@@ -0,0 +1,98 @@
+import struct
+import numpy as np
+import pytest
+from audio_codecs import MulawEncoder, OggOpusEncoder, create_encoder, ogg_crc
+
+
+class FakeOpus:
+    # Stands in for opuslib.Encoder, which is optional, with 10-byte packets.
+    def encode(self, frame, frame_samples):
+        return bytes([len(frame) % 256]) * 10
+
+
+def ogg_encoder(sample_rate=16000):
+    encoder = OggOpusEncoder.__new__(OggOpusEncoder)
+    encoder.sample_rate = sample_rate
+    encoder.frame_samples = sample_rate * encoder.frame_ms // 1000
+    encoder.encoder = FakeOpus()
+    encoder.serial = 1234
+    encoder.page_sequence = 0
+    encoder.granule = 0
+    encoder.pending = b""
+    encoder.headers_sent = False
+    return encoder
+
+
+def read_pages(data):
+    pages = []
+    while data:
+        magic, version, header_type, granule, serial, sequence, crc, count = struct.unpack_from("<4sBBqIIIB", data)
+        assert magic == b"OggS"
+        lacing = list(data[27:27 + count])
+        length = 27 + count + sum(lacing)
+        page = bytearray(data[:length])
+        struct.pack_into("<I", page, 22, 0)
+        assert ogg_crc(page) == crc
+        pages.append({"type": header_type, "granule": granule, "serial": serial, "sequence": sequence,
+                      "lacing": lacing, "body": bytes(data[27 + count:length])})
+        data = data[length:]
+    return pages
+
+
+def pcm(*samples):
+    return np.array(samples, dtype=np.int16).tobytes()
+
+
+def test_mulaw_matches_g711():
+    encoder = MulawEncoder(16000)
+    encoded = encoder.encode(pcm(0, -1, 1, 100, -100, 1000, -1000, 32767, -32768))
+    assert list(encoded) == [255, 126, 255, 242, 114, 206, 78, 128, 0]
+
+
+def test_mulaw_halves_the_bytes():
+    encoder = MulawEncoder(8000)
+    assert len(encoder.encode(b"\0\0" * 160)) == 160
+    assert encoder.flush() == b""
+    assert encoder.url_params() == "encoding=mulaw&sample_rate=8000"
+
+
+def test_ogg_crc_check_value():
+    assert ogg_crc(b"123456789") == 0x89A1897F
+
+
+def test_ogg_stream_starts_with_opus_headers():
+    encoder = ogg_encoder()
+    pages = read_pages(encoder.encode(b""))
+    assert [page["sequence"] for page in pages] == [0, 1]
+    assert pages[0]["type"] == 0x02
+    assert pages[0]["body"][:8] == b"OpusHead"
+    assert struct.unpack_from("<I", pages[0]["body"], 12)[0] == 16000
+    assert pages[1]["body"][:8] == b"OpusTags"
+    assert all(page["serial"] == 1234 for page in pages)
+
+
+def test_ogg_granule_counts_48khz_samples():
+    encoder = ogg_encoder()
+    frame_bytes = encoder.frame_samples * 2
+    pages = read_pages(encoder.encode(b"\1" * (frame_bytes * 2 + frame_bytes // 2)))
+    audio = pages[2]
+    assert audio["lacing"] == [10, 10]
+    assert audio["granule"] == 2 * 960
+    tail = read_pages(encoder.flush())
+    assert len(tail) == 1
+    assert tail[0]["type"] == 0x04
+    assert tail[0]["granule"] == 2 * 960 + 480
+    assert tail[0]["sequence"] == 3
+
+
+def test_ogg_lacing_splits_long_packets():
+    encoder = ogg_encoder()
+    pages = read_pages(encoder.page([b"x" * 300, b"y" * 255], 0))
+    assert pages[0]["lacing"] == [255, 45, 255, 0]
+
+
+def test_create_encoder():
+    assert create_encoder("linear16", 16000) is None
+    assert isinstance(create_encoder("mulaw", 16000), MulawEncoder)
+    with pytest.raises(ValueError):
+        create_encoder("flac", 16000)
@@ -0,0 +1,81 @@
+import json
+import pytest
+from config_manager import ConfigError, ConfigManager, ConfigSnapshot
+
+
+def test_values_are_converted_to_field_types():
+    snapshot = ConfigSnapshot.from_dict({"temperature": 1, "log_level": "debug", "audio_cpu_affinity": [2, 3]})
+    assert snapshot.temperature == 1.0
+    assert isinstance(snapshot.temperature, float)
+    assert snapshot.log_level == "DEBUG"
+    assert snapshot.audio_cpu_affinity == (2, 3)
+
+
+@pytest.mark.parametrize("key, value", [
+    ("max_tokens", "100"),
+    ("max_tokens", True),
+    ("max_tokens", 0),
+    ("temperature", 1.5),
+    ("tts_chunking", "word"),
+    ("metrics_port", 70000),
+])
+def test_invalid_values_raise(key, value):
+    with pytest.raises(ConfigError, match=key):
+        ConfigSnapshot.from_dict({key: value})
+
+
+def test_all_errors_are_reported_together():
+    with pytest.raises(ConfigError) as error:
+        ConfigSnapshot.from_dict({"max_tokens": 0, "render_fps": 1000})
+    assert "max_tokens" in str(error.value) and "render_fps" in str(error.value)
+
+
+def test_lenient_load_uses_defaults_for_invalid_values():
+    snapshot = ConfigSnapshot.from_dict({"max_tokens": -1, "model": "claude-test"}, strict=False)
+    assert snapshot.max_tokens == 4096
+    assert snapshot.model == "claude-test"
+
+
+def test_optional_values_accept_none():
+    assert ConfigSnapshot.from_dict({"top_p": None}).top_p is None
+    assert ConfigSnapshot.from_dict({"top_p": 0.5}).top_p == 0.5
+
+
+def test_unknown_keys_are_kept():
+    snapshot = ConfigSnapshot.from_dict({"future_option": 3})
+    assert snapshot.get("future_option") == 3
+    assert snapshot.get("missing", "fallback") == "fallback"
+    with pytest.raises(TypeError):
+        snapshot.extra["future_option"] = 4
+
+
+def test_changed_keys():
+    before = ConfigSnapshot.from_dict({"model": "a", "future_option": 1})
+    after = ConfigSnapshot.from_dict({"model": "b", "future_option": 2, "other": True})
+    assert before.changed_keys(after) == {"model", "future_option", "other"}
+    assert before.changed_keys(before) == set()
+
+
+def test_update_notifies_subscribers_of_their_keys(tmp_path):
+    manager = ConfigManager(str(tmp_path / "config.json"))
+    calls = []
+    manager.subscribe(["speech_enabled"], lambda snapshot, changed: calls.append(changed))
+    assert manager.update(model="claude-test") == {"model"}
+    assert manager.update(speech_enabled=False) == {"speech_enabled"}
+    assert calls == [{"speech_enabled"}]
+    with pytest.raises(ConfigError):
+        manager.update(render_fps=0)
+    assert manager.snapshot.render_fps == 30
+
+
+def test_reload_keeps_current_config_when_invalid(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"max_tokens": 100}))
+    manager = ConfigManager(str(path))
+    assert manager.snapshot.max_tokens == 100
+    path.write_text(json.dumps({"max_tokens": 0}))
+    assert manager.reload() == set()
+    assert manager.snapshot.max_tokens == 100
+    path.write_text(json.dumps({"max_tokens": 200}))
+    assert manager.reload() == {"max_tokens"}
+    assert manager.snapshot.max_tokens == 200
@@ -0,0 +1,89 @@
+import json
+import socket
+import threading
+import time
+from event_bus import DROPPED_EVENTS, EventBus, EventSocketServer, Subscriber, bus
+
+
+def dropped_total():
+    return sum(value for shard in list(DROPPED_EVENTS.shards) for value in shard.values())
+
+
+def test_full_subscriber_drops_oldest_events():
+    subscriber = Subscriber(3)
+    before = dropped_total()
+    for i in range(5):
+        subscriber.put({"type": "delta", "text": str(i)})
+    events = subscriber.get(0)
+    assert events[0] == {"type": "dropped", "count": 2}
+    assert [event["text"] for event in events[1:]] == ["2", "3", "4"]
+    assert dropped_total() - before == 2
+    assert subscriber.get(0) == []
+
+
+def test_slow_subscriber_does_not_affect_others():
+    events = EventBus()
+    slow, fast = events.subscribe(2), events.subscribe(10)
+    for i in range(4):
+        events.publish("delta", text=str(i))
+    assert [event.get("count") for event in slow.get(0)] == [2, None, None]
+    assert [event["seq"] for event in fast.get(0)] == [1, 2, 3, 4]
+
+
+def test_publish_without_subscribers_is_skipped():
+    events = EventBus()
+    events.publish("delta", text="lost")
+    subscriber = events.subscribe()
+    events.publish("turn_end", outcome="ok")
+    events.unsubscribe(subscriber)
+    events.publish("delta", text="also lost")
+    assert [(event["type"], event["seq"]) for event in subscriber.get(0)] == [("turn_end", 1)]
+
+
+def test_get_waits_for_events():
+    subscriber = Subscriber(4)
+    threading.Timer(0.05, subscriber.put, args=({"type": "delta"},)).start()
+    assert subscriber.get(2.0) == [{"type": "delta"}]
+    started = time.monotonic()
+    assert subscriber.get(0.05) == []
+    assert time.monotonic() - started >= 0.04
+
+
+def test_drop_counts_are_exact_across_threads():
+    subscriber = Subscriber(16)
+    received, done = [], threading.Event()
+
+    def consume():
+        while not done.is_set() or subscriber.events:
+            for event in subscriber.get(0.01):
+                received.append(event.get("count", 1) if event["type"] == "dropped" else 1)
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    for i in range(20000):
+        subscriber.put({"type": "delta"})
+    done.set()
+    consumer.join()
+    assert sum(received) == 20000
+
+
+def test_socket_server_streams_json_lines(tmp_path):
+    path = str(tmp_path / "events.sock")
+    server = EventSocketServer(path, buffer_size=8)
+    server.start()
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(path)
+        client.settimeout(5)
+        deadline = time.monotonic() + 5
+        while not bus.subscribers and time.monotonic() < deadline:
+            time.sleep(0.01)
+        bus.publish("transcript", text="héllo", final=True)
+        data = b""
+        while not data.endswith(b"\n"):
+            data += client.recv(4096)
+        event = json.loads(data.decode("utf-8").splitlines()[0])
+        assert (event["type"], event["text"], event["final"]) == ("transcript", "héllo", True)
+        client.close()
+    finally:
+        server.stop()
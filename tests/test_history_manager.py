@@ -0,0 +1,111 @@
+import json
+import os
+from config_manager import ConfigManager
+from history_manager import HistoryManager
+from log_manager import LogManager
+
+
+def messages(count, start=0):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i} é"}
+            for i in range(start, start + count)]
+
+
+def open_history(log_dir, **config):
+    config_manager = ConfigManager(os.path.join(log_dir, "config.json"))
+    config_manager.update(history_page_size=10, history_cache_pages=2, **config)
+    return HistoryManager(config_manager, LogManager(config_manager, log_dir=str(log_dir)))
+
+
+def saved_history(log_dir, count, **config):
+    history = open_history(log_dir, **config)
+    for message in messages(count):
+        history.add_message(message["role"], message["content"])
+    history.save_history()
+    return open_history(log_dir, **config)
+
+
+def test_only_the_last_page_is_loaded(tmp_path):
+    history = saved_history(tmp_path, 25)
+    # Message 15 is from the assistant, so the context starts at 16.
+    assert history.saved_count == 25
+    assert history.history_start == 16
+    assert history.get_history() == messages(9, 16)
+    assert history.message_count() == 25
+
+
+def test_older_messages_are_read_by_page(tmp_path):
+    history = saved_history(tmp_path, 25)
+    assert history.get_page(1) == messages(10, 10)
+    assert history.get_messages() == messages(25)
+    assert history.get_messages(8, 18) == messages(10, 8)
+    assert history.get_messages(20, 100) == messages(5, 20)
+    assert list(history.page_cache) == [0, 1]
+
+
+def test_page_cache_keeps_the_most_recent_pages(tmp_path):
+    history = saved_history(tmp_path, 40)
+    for page in (0, 1, 0, 2):
+        history.get_page(page)
+    assert list(history.page_cache) == [0, 2]
+
+
+def test_index_holds_byte_offsets(tmp_path):
+    history = saved_history(tmp_path, 3)
+    with open(history.history_file, "rb") as f:
+        data = f.read()
+    lines = data.splitlines(keepends=True)
+    assert history.read_offsets(0, 3) == [0, len(lines[0]), len(lines[0]) + len(lines[1])]
+    assert json.loads(lines[1]) == messages(3)[1]
+
+
+def test_missing_or_stale_index_is_rebuilt(tmp_path):
+    history = saved_history(tmp_path, 12)
+    os.remove(history.index_file)
+    assert open_history(tmp_path).get_messages() == messages(12)
+    with open(history.index_file, "r+b") as f:
+        f.truncate(5 * history.OFFSET_SIZE)
+    reopened = open_history(tmp_path)
+    assert reopened.saved_count == 12
+    assert reopened.get_messages() == messages(12)
+
+
+def test_new_messages_are_appended(tmp_path):
+    history = saved_history(tmp_path, 4)
+    history.add_message("user", "next")
+    history.save_history()
+    history.save_history()
+    assert open_history(tmp_path).get_messages() == messages(4) + [{"role": "user", "content": "next"}]
+
+
+def test_token_counts_are_cached_for_saved_messages(tmp_path):
+    history = saved_history(tmp_path, 4)
+    history.set_token_counts({1: 7, 3: 9, 10: 5})
+    assert history.get_token_counts(0, 4) == [None, 7, None, 9]
+    assert history.get_token_counts(4, 6) == [None, None]
+
+
+def test_resident_history_is_trimmed_to_a_user_message(tmp_path):
+    history = saved_history(tmp_path, 24, memory_budget_mode=True, history_resident_max=5)
+    history.add_message("user", "message 24 é")
+    history.save_history()
+    assert history.get_history() == messages(5, 20)
+    history.add_message("assistant", "message 25 é")
+    history.save_history()
+    # Dropping one message would leave an assistant message first.
+    assert history.get_history() == messages(4, 22)
+    assert history.get_messages() == messages(26)
+
+
+def test_legacy_history_is_migrated(tmp_path):
+    with open(tmp_path / "history.json", "w") as f:
+        json.dump(messages(3), f)
+    history = open_history(tmp_path)
+    assert history.get_messages() == messages(3)
+    assert not (tmp_path / "history.json").exists()
+
+
+def test_unreadable_legacy_history_is_kept(tmp_path):
+    (tmp_path / "history.json").write_text("{not json")
+    history = open_history(tmp_path)
+    assert history.get_messages() == []
+    assert (tmp_path / "history.json.bak").read_text() == "{not json"
@@ -0,0 +1,103 @@
+import threading
+import urllib.request
+import pytest
+from metrics import MetricsRegistry, MetricsServer, registry
+
+
+def test_counter_renders_labels_in_order():
+    metrics = MetricsRegistry()
+    counter = metrics.counter("test_requests_total", "Requests")
+    counter.inc(service="polly", outcome="ok")
+    counter.inc(2, service="polly", outcome="ok")
+    counter.inc()
+    assert metrics.render() == (
+        "# HELP test_requests_total Requests\n"
+        "# TYPE test_requests_total counter\n"
+        "test_requests_total 1\n"
+        'test_requests_total{outcome="ok",service="polly"} 3\n'
+    )
+
+
+def test_label_values_are_escaped():
+    metrics = MetricsRegistry()
+    metrics.counter("test_total", "Test").inc(path='a"b\\c\nd')
+    assert 'test_total{path="a\\"b\\\\c\\nd"} 1' in metrics.render()
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = MetricsRegistry()
+    histogram = metrics.histogram("test_seconds", "Latency", buckets=(1.0, 0.1))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(value, stage="tts")
+    assert metrics.render().splitlines()[2:] == [
+        'test_seconds_bucket{stage="tts",le="0.1"} 1',
+        'test_seconds_bucket{stage="tts",le="1.0"} 3',
+        'test_seconds_bucket{stage="tts",le="+Inf"} 4',
+        'test_seconds_sum{stage="tts"} 4.25',
+        'test_seconds_count{stage="tts"} 4',
+    ]
+
+
+def test_registering_twice_shares_the_metric():
+    metrics = MetricsRegistry()
+    assert metrics.counter("test_total", "Test") is metrics.counter("test_total", "Test")
+    metrics.gauge("test_depth", "Depth", lambda: 1)
+    metrics.gauge("test_depth", "Depth", lambda: 2)
+    assert "test_depth 2" in metrics.render()
+
+
+def test_gauges_with_labels_and_failures():
+    metrics = MetricsRegistry()
+    metrics.gauge("test_open", "Open", lambda: {(("service", "polly"),): 1})
+    metrics.gauge("test_none", "Nothing to report", lambda: None)
+    metrics.gauge("test_broken", "Broken", lambda: 1 / 0)
+    rendered = metrics.render()
+    assert 'test_open{service="polly"} 1' in rendered
+    assert "# TYPE test_none gauge" in rendered
+    assert "test_broken" not in rendered
+
+
+def test_counts_from_finished_threads_are_kept():
+    metrics = MetricsRegistry()
+    counter = metrics.counter("test_total", "Test")
+
+    def work():
+        for _ in range(100):
+            counter.inc(kind="a")
+
+    threads = [threading.Thread(target=work) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 'test_total{kind="a"} 2000' in metrics.render()
+    assert counter.shards == [counter.retired]
+
+
+def test_attached_counts_survive_detach():
+    metrics = MetricsRegistry()
+    histogram = metrics.histogram("test_seconds", "Latency", buckets=(1.0,))
+    counts = [2, 1, 3.5]
+    histogram.attach(counts, source="worker")
+    counts[0] += 1
+    assert 'test_seconds_count{source="worker"} 4' in metrics.render()
+    histogram.detach(counts, source="worker")
+    counts[0] += 10
+    assert 'test_seconds_count{source="worker"} 4' in metrics.render()
+    assert histogram.shards == [histogram.retired]
+
+
+def test_server_serves_the_registry():
+    server = MetricsServer(0)
+    try:
+        server.start()
+    except OSError as e:
+        pytest.skip(f"Cannot listen on localhost: {e}")
+    try:
+        registry.counter("test_served_total", "Served").inc()
+        port = server.server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert "test_served_total 1" in response.read().decode()
+    finally:
+        server.stop()
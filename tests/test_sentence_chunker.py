@@ -0,0 +1,50 @@
+from sentence_chunker import SentenceChunker
+
+
+def feed_words(chunker, text):
+    chunks = []
+    for word in text.split(" "):
+        chunks.extend(chunker.feed(word + " "))
+    return chunks
+
+
+def test_first_chunk_ends_at_first_clause():
+    chunker = SentenceChunker()
+    assert feed_words(chunker, "Well, the price is 3.5 dollars. That is cheap!") == ["Well, "]
+    assert chunker.flush() == ["the price is 3.5 dollars. That is cheap!"]
+
+
+def test_first_chunk_falls_back_to_word_count():
+    chunker = SentenceChunker(first_chunk_words=3)
+    assert chunker.feed("one two three four five") == ["one two three "]
+    assert chunker.feed(" six") == []
+    assert chunker.flush() == ["four five six"]
+
+
+def test_sentences_merge_up_to_char_budget():
+    chunker = SentenceChunker(char_budget=20)
+    assert chunker.feed("Hi, there. ") == ["Hi, "]
+    assert chunker.feed("First sentence here. Second sentence here. Third. ") == \
+        ["there.", "First sentence here.", "Second sentence here."]
+    assert chunker.flush() == ["Third."]
+
+
+def test_decimals_and_numbered_items_do_not_split():
+    chunker = SentenceChunker(policy="sentence")
+    assert feed_words(chunker, "Pi is 3.14 today. Step 2. is next. Done?") == \
+        ["Pi is 3.14 today.", "Step 2. is next.", "Done?"]
+    assert chunker.flush() == []
+
+
+def test_sentence_policy_emits_each_sentence():
+    chunker = SentenceChunker(policy="sentence")
+    assert chunker.feed("One. Two! Thr") == ["One.", "Two!"]
+    assert chunker.flush() == ["Thr"]
+    assert chunker.chunks_emitted == 0
+
+
+def test_flush_drops_blank_chunks_and_resets():
+    chunker = SentenceChunker()
+    chunker.feed("   ")
+    assert chunker.flush() == []
+    assert chunker.feed("Again, ") == ["Again, "]
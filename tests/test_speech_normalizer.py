@@ -0,0 +1,50 @@
+import pytest
+from speech_normalizer import SpeechNormalizer
+
+
+@pytest.mark.parametrize("text, spoken", [
+    ("## Setup", "Setup"),
+    ("- **Bold** and *italic* `code`", "Bold and italic code"),
+    ("See [the docs](https://x.com/a) or https://www.example.com/path.", "See the docs or example.com."),
+    ("Party time 🎉", "Party time"),
+    ("Steps: 1. Open it. 2. Close it.", "Steps: Open it. Close it."),
+    ("# Title\nFirst line\n- item", "Title. First line. item"),
+])
+def test_markup_is_dropped(text, spoken):
+    assert SpeechNormalizer().normalize(text) == spoken
+
+
+@pytest.mark.parametrize("text, spoken", [
+    ("It runs 5-10 km at 20 km/h, ~3 kg.",
+     "It runs 5 to 10 kilometers at 20 kilometers per hour, about 3 kilograms."),
+    ("Revenue hit 3.5M vs 2k, e.g. growth.", "Revenue hit 3.5 million versus 2 thousand, for example growth."),
+    ("a → b ≥ 3 ± 1", "a to b at least 3 plus or minus 1"),
+    ("A 4x5 board", "A 4 by 5 board"),
+])
+def test_numbers_units_and_symbols_are_spoken(text, spoken):
+    assert SpeechNormalizer().normalize(text) == spoken
+
+
+def test_ambiguous_units_need_no_space():
+    assert SpeechNormalizer().normalize("Put 5 in the box, 5in wide, 5 m long.") == \
+        "Put 5 in the box, 5 inches wide, 5 m long."
+
+
+def test_dates_are_not_read_as_ranges():
+    assert SpeechNormalizer().normalize("On 2024-01-15 at 10:30") == "On 2024-01-15 at 10:30"
+
+
+def test_code_and_tables_spanning_chunks_are_summarized():
+    normalizer = SpeechNormalizer()
+    chunks = ["Here:\n```python\nx = 1", "y = 2\n```\nThat works.", "| a | b |\n|---|---|\n| 1 | 2 |",
+              "| 3 | 4 |", "After the table."]
+    assert [normalizer.normalize(chunk) for chunk in chunks] == \
+        ["Here: The code is shown on screen.", "That works.", "The table is shown on screen.", "",
+         "After the table."]
+    assert not normalizer.in_code and not normalizer.in_table
+
+
+def test_saved_counts_removed_characters():
+    normalizer = SpeechNormalizer()
+    normalizer.normalize("**bold**")
+    assert normalizer.saved() == 4
@@ -0,0 +1,250 @@
+import os
+import shutil
+import subprocess
+import logging
+import time
+from collections import deque
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+import session_trace
+import metrics
+
+TTS_SECONDS = metrics.registry.histogram("claude_cli_tts_request_seconds", "Speech synthesis time per request, by backend")
+POLLY_ENGINE_SECONDS = metrics.registry.histogram("claude_cli_polly_engine_seconds", "Polly synthesis time per request, by engine")
+ERRORS = metrics.registry.counter("claude_cli_errors_total", "Failed requests, by service")
+
+
+class TTSBackend:
+    name = "base"
+    file_extension = "mp3"
+
+    def is_available(self):
+        return True
+
+    # engine only applies to Polly; other backends ignore it.
+    def synthesize(self, text, file_base, engine=None):
+        raise NotImplementedError
+
+
+class PollyTTSBackend(TTSBackend):
+    name = "polly"
+    file_extension = "mp3"
+
+    def __init__(self, polly_client, voice, engine):
+        self.polly_client = polly_client
+        self.voice = voice
+        self.engine = engine
+
+    def synthesize(self, text, file_base, engine=None):
+        response = self.polly_client.synthesize_speech(
+            Engine=engine or self.engine,
+            LanguageCode='en-US',
+            Text=text,
+            TextType='text',
+            OutputFormat='mp3',
+            VoiceId=self.voice
+        )
+        if "AudioStream" not in response:
+            raise RuntimeError("No AudioStream found in the response")
+
+        file_path = f"{file_base}.{self.file_extension}"
+        with open(file_path, 'wb') as file:
+            file.write(response['AudioStream'].read())
+        return file_path
+
+
+class LocalTTSBackend(TTSBackend):
+    # Runs a local engine such as espeak-ng or Piper. The command is a list of
+    # arguments where "{output}" is replaced by the wav path and "{text}" by the
+    # text to speak; if "{text}" is absent the text is written to stdin instead.
+    name = "local"
+    file_extension = "wav"
+
+    def __init__(self, command, timeout=10):
+        self.command = command
+        self.timeout = timeout
+
+    def is_available(self):
+        return bool(self.command) and shutil.which(self.command[0]) is not None
+
+    def synthesize(self, text, file_base, engine=None):
+        file_path = f"{file_base}.{self.file_extension}"
+        args = [arg.replace("{output}", file_path).replace("{text}", text) for arg in self.command]
+        stdin = None if any("{text}" in arg for arg in self.command) else text
+        subprocess.run(args, input=stdin, text=True, capture_output=True, check=True, timeout=self.timeout)
+        return file_path
+
+
+class PollyEngineSelector:
+    # Picks the Polly engine for each request in tiered mode. While less audio
+    # is queued for playback than the preferred engine is likely to take (its
+    # p95 latency plus lead_ms), the fastest of the fast engines is used so
+    # playback does not run dry; once enough is queued ahead, the preferred
+    # engine is used. Latencies are measured for every engine as it is used.
+    ENGINES = ("standard", "neural", "long-form", "generative")
+
+    def __init__(self, preferred, fast_engines, lead_ms=500, default_p95_ms=2000,
+                 window=20, min_samples=3, retry_seconds=300):
+        self.window = window
+        self.min_samples = min_samples
+        self.retry_seconds = retry_seconds
+        self.default_p95 = default_p95_ms / 1000
+        self.latencies = {}
+        self.failed_until = {}
+        self.configure(preferred, fast_engines, lead_ms)
+
+    def configure(self, preferred, fast_engines, lead_ms):
+        self.preferred = preferred
+        self.fast_engines = [engine for engine in fast_engines if engine in self.ENGINES and engine != preferred]
+        self.lead = lead_ms / 1000
+        unknown = [engine for engine in fast_engines if engine not in self.ENGINES]
+        if unknown:
+            logging.warning(f"Ignoring unknown Polly engines: {', '.join(unknown)}")
+
+    def record(self, engine, seconds):
+        self.latencies.setdefault(engine, deque(maxlen=self.window)).append(seconds)
+        POLLY_ENGINE_SECONDS.observe(seconds, engine=engine)
+
+    def record_failure(self, engine, error):
+        logging.warning(f"Polly {engine} engine failed: {error}. Not using it for {self.retry_seconds} s")
+        self.failed_until[engine] = time.monotonic() + self.retry_seconds
+
+    def percentile(self, engine, quantile):
+        samples = sorted(self.latencies.get(engine, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[int(quantile * (len(samples) - 1))]
+
+    def select(self, buffered_seconds, first_chunk=False):
+        preferred_p95 = self.percentile(self.preferred, 0.95)
+        needed = (preferred_p95 if preferred_p95 is not None else self.default_p95) + self.lead
+        if not first_chunk and buffered_seconds >= needed:
+            return self.preferred
+        now = time.monotonic()
+        candidates = [engine for engine in self.fast_engines if self.failed_until.get(engine, 0) <= now]
+        if not candidates:
+            return self.preferred
+
+        def expected(engine):
+            # A fast engine that has not been measured yet is tried, so it gets measured.
+            median = self.percentile(engine, 0.5)
+            if median is not None:
+                return median
+            return self.default_p95 if engine == self.preferred else 0.0
+
+        return min(candidates + [self.preferred], key=expected)
+
+    def stats(self):
+        # (requests, median, p95) for each engine that has been used.
+        return {engine: (len(samples), self.percentile(engine, 0.5), self.percentile(engine, 0.95))
+                for engine, samples in self.latencies.items()}
+
+
+class TTSRouter:
+    def __init__(self, primary, fallback=None, mode="auto", p95_budget_ms=1500,
+                 window=20, min_samples=5, recheck_seconds=60,
+                 breaker=None, usage_manager=None, engine_selector=None):
+        self.primary = primary
+        self.usage_manager = usage_manager
+        self.engine_selector = engine_selector
+        self.fallback = fallback if fallback and fallback.is_available() else None
+        self.mode = mode
+        self.p95_budget = p95_budget_ms / 1000
+        self.latencies = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.recheck_seconds = recheck_seconds
+        self.breaker = breaker or CircuitBreaker(primary.name)
+        self.slow_until = 0
+        if mode != "polly" and fallback and not self.fallback:
+            logging.warning(f"Local TTS command not found: {fallback.command[0]}. Using {primary.name} only.")
+
+    def primary_p95(self):
+        if len(self.latencies) < self.min_samples:
+            return None
+        samples = sorted(self.latencies)
+        return samples[int(0.95 * (len(samples) - 1))]
+
+    def select_backend(self):
+        if self.mode == "local" and self.fallback:
+            return self.fallback
+        if self.mode != "auto" or not self.fallback:
+            return self.primary
+
+        now = time.monotonic()
+        if now < self.slow_until or self.breaker.state == CircuitBreaker.OPEN and self.breaker.retry_in() > 0:
+            return self.fallback
+
+        p95 = self.primary_p95()
+        if p95 is not None and p95 > self.p95_budget:
+            logging.warning(f"{self.primary.name} p95 latency {p95 * 1000:.0f} ms exceeds budget; "
+                            f"using {self.fallback.name} TTS for {self.recheck_seconds} s")
+            # Start from a clean window when we probe the primary again.
+            self.latencies.clear()
+            self.slow_until = now + self.recheck_seconds
+            return self.fallback
+        return self.primary
+
+    def is_degraded(self):
+        # True when no speech can be produced: the primary's circuit is open
+        # and there is no local engine to fall back to.
+        if self.fallback and self.mode != "polly":
+            return False
+        return self.breaker.state != CircuitBreaker.CLOSED
+
+    def synthesize(self, text, file_base, engine=None):
+        backend = self.select_backend()
+        if backend is not self.primary:
+            return self.run_backend(backend, text, file_base)
+        if not self.breaker.allow():
+            # Another call is already probing the primary.
+            if self.fallback and self.mode == "auto":
+                return self.run_backend(self.fallback, text, file_base)
+            raise CircuitOpenError(f"{self.primary.name} TTS is unavailable (retrying in {self.breaker.retry_in():.0f} s)")
+
+        start = time.monotonic()
+        try:
+            file_path, engine = self.run_primary(text, file_base, engine or getattr(self.primary, "engine", None))
+        except Exception as e:
+            logging.warning(f"{self.primary.name} TTS failed: {e}")
+            self.breaker.record_failure()
+            if not self.fallback or self.mode == "polly":
+                raise
+            return self.run_backend(self.fallback, text, file_base)
+
+        self.latencies.append(time.monotonic() - start)
+        self.breaker.record_success()
+        if self.usage_manager:
+            self.usage_manager.record_polly(engine, len(text))
+        return file_path
+
+    def run_primary(self, text, file_base, engine):
+        # Returns the file and the engine that made it.
+        preferred = getattr(self.primary, "engine", None)
+        if engine == preferred or not self.engine_selector:
+            return self.run_backend(self.primary, text, file_base, engine), engine
+        try:
+            return self.run_backend(self.primary, text, file_base, engine), engine
+        except Exception as e:
+            # A fast engine failing, for example one the voice does not
+            # support, is not an outage; the preferred engine is tried instead.
+            self.engine_selector.record_failure(engine, e)
+            return self.run_backend(self.primary, text, file_base, preferred), preferred
+
+    def run_backend(self, backend, text, file_base, engine=None):
+        start = time.monotonic()
+        file_path = None
+        try:
+            file_path = backend.synthesize(text, file_base, engine)
+            elapsed = time.monotonic() - start
+            TTS_SECONDS.observe(elapsed, backend=backend.name)
+            if backend is self.primary and self.engine_selector and engine:
+                self.engine_selector.record(engine, elapsed)
+            return file_path
+        except Exception:
+            ERRORS.inc(service=backend.name)
+            raise
+        finally:
+            if session_trace.is_recording():
+                size = os.path.getsize(file_path) if file_path and os.path.exists(file_path) else 0
+                session_trace.record(session_trace.TTS_RESULT, {
+                    "backend": backend.name, "engine": engine, "chars": len(text), "bytes": size,
+                    "latency": round(time.monotonic() - start, 4), "ok": file_path is not None})
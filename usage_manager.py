@@ -0,0 +1,148 @@
+import os
+import csv
+import threading
+from queue import SimpleQueue
+from datetime import datetime
+from collections import defaultdict
+from colorama import Fore, Style
+
+
+# Prices in USD. Claude models are per million tokens, matched by model name
+# prefix; Polly engines are per million characters; Deepgram is per minute.
+# Override or extend them with "usage_prices" in config.json.
+DEFAULT_PRICES = {
+    "claude-3-5-sonnet": {"input": 3.00, "output": 15.00, "cache_write": 3.75, "cache_read": 0.30},
+    "claude-3-opus": {"input": 15.00, "output": 75.00, "cache_write": 18.75, "cache_read": 1.50},
+    "claude-3-sonnet": {"input": 3.00, "output": 15.00, "cache_write": 3.75, "cache_read": 0.30},
+    "claude-3-haiku": {"input": 0.25, "output": 1.25, "cache_write": 0.30, "cache_read": 0.03},
+    "polly:standard": {"characters": 4.00},
+    "polly:neural": {"characters": 16.00},
+    "polly:long-form": {"characters": 100.00},
+    "polly:generative": {"characters": 30.00},
+    "deepgram": {"minutes": 0.0059},
+}
+
+LEDGER_FIELDS = ["time", "session", "service", "resource", "input_tokens", "output_tokens",
+                 "cache_write_tokens", "cache_read_tokens", "characters", "audio_seconds"]
+
+
+class UsageManager:
+    # Rows are queued and appended by a background thread, so recording never
+    # waits on the disk. The thread reads the ledger once at startup and then
+    # keeps running totals per day, session and resource, so the usage
+    # command does not read the whole file again.
+    def __init__(self, config_manager, log_manager):
+        self.config_manager = config_manager
+        self.logger = log_manager.get_logger()
+        self.ledger_file = os.path.join(log_manager.log_dir, "usage.csv")
+        self.session = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.lock = threading.Lock()  # Guards totals
+        self.totals = {}  # (day, session, service, resource) -> quantities
+        self.loaded = threading.Event()
+        self.queue = SimpleQueue()
+        self.thread = threading.Thread(target=self.writer_thread, daemon=True)
+        self.thread.start()
+
+    def record(self, service, resource, **quantities):
+        row = {"time": datetime.now().isoformat(timespec="seconds"), "session": self.session,
+               "service": service, "resource": resource}
+        row.update({field: quantities.get(field, 0) for field in LEDGER_FIELDS[4:]})
+        self.queue.put(row)
+
+    def writer_thread(self):
+        try:
+            with open(self.ledger_file, "r", newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    self.add_to_totals(row)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            self.logger.error(f"Error reading usage ledger: {str(e)}")
+        self.loaded.set()
+        while True:
+            row = self.queue.get()
+            if row is None:
+                break
+            self.add_to_totals(row)
+            try:
+                new_file = not os.path.exists(self.ledger_file)
+                with open(self.ledger_file, "a", newline="", encoding="utf-8") as f:
+                    writer = csv.DictWriter(f, fieldnames=LEDGER_FIELDS)
+                    if new_file:
+                        writer.writeheader()
+                    writer.writerow(row)
+            except OSError as e:
+                self.logger.error(f"Error writing usage ledger: {str(e)}")
+
+    def add_to_totals(self, row):
+        key = (row["time"][:10], row["session"], row["service"], row["resource"])
+        with self.lock:
+            totals = self.totals.setdefault(key, dict.fromkeys(LEDGER_FIELDS[4:], 0.0))
+            for field in LEDGER_FIELDS[4:]:
+                totals[field] += float(row[field] or 0)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def record_message(self, model, usage):
+        self.record("anthropic", model, **usage)
+
+    def record_polly(self, engine, characters):
+        self.record("polly", engine, characters=characters)
+
+    def record_deepgram(self, model, audio_seconds):
+        self.record("deepgram", model, audio_seconds=round(audio_seconds, 2))
+
+    def get_prices(self, service, resource):
+        prices = dict(DEFAULT_PRICES)
+        prices.update(self.config_manager.get("usage_prices", {}))
+        key = resource if service == "anthropic" else f"{service}:{resource}"
+        if key in prices:
+            return prices[key]
+        if service == "deepgram":
+            return prices.get("deepgram", {})
+        # Model names carry a date suffix, so fall back to the longest matching prefix.
+        matches = [name for name in prices if key.startswith(name)]
+        return prices[max(matches, key=len)] if matches else {}
+
+    def cost(self, row):
+        prices = self.get_prices(row["service"], row["resource"])
+        return (float(row["input_tokens"]) * prices.get("input", 0) / 1e6
+                + float(row["output_tokens"]) * prices.get("output", 0) / 1e6
+                + float(row["cache_write_tokens"]) * prices.get("cache_write", 0) / 1e6
+                + float(row["cache_read_tokens"]) * prices.get("cache_read", 0) / 1e6
+                + float(row["characters"]) * prices.get("characters", 0) / 1e6
+                + float(row["audio_seconds"]) / 60 * prices.get("minutes", 0))
+
+    def summarize(self):
+        # Costs are worked out here, so changed prices apply to past usage too.
+        by_day = defaultdict(lambda: defaultdict(float))
+        by_session = defaultdict(lambda: defaultdict(float))
+        self.loaded.wait()
+        with self.lock:
+            groups = [(key, dict(quantities)) for key, quantities in self.totals.items()]
+        for (day, session, service, resource), row in groups:
+            row.update(service=service, resource=resource)
+            for totals in (by_day[day], by_session[session]):
+                totals["tokens"] += row["input_tokens"] + row["output_tokens"] \
+                    + row["cache_write_tokens"] + row["cache_read_tokens"]
+                totals["characters"] += row["characters"]
+                totals["audio_seconds"] += row["audio_seconds"]
+                totals["cost"] += self.cost(row)
+        return by_day, by_session
+
+    def display_usage(self, max_rows=10):
+        by_day, by_session = self.summarize()
+        if not by_day:
+            print(f"{Fore.MAGENTA}No usage recorded yet.{Style.RESET_ALL}")
+            return
+        for title, totals in (("Day", by_day), ("Session", by_session)):
+            print(f"{Fore.CYAN}{title:<22} {'Tokens':>10} {'TTS chars':>10} {'STT sec':>9} {'Cost $':>9}")
+            for key in sorted(totals)[-max_rows:]:
+                marker = " *" if key == self.session else ""
+                row = totals[key]
+                print(f"{key + marker:<22} {row['tokens']:>10.0f} {row['characters']:>10.0f} "
+                      f"{row['audio_seconds']:>9.1f} {row['cost']:>9.4f}")
+            print(Style.RESET_ALL, end="")
+        print(f"{Fore.CYAN}Costs are estimates based on list prices; * marks this session.{Style.RESET_ALL}")
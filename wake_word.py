@@ -0,0 +1,113 @@
+import logging
+from collections import deque
+import numpy as np
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+
+def mel_filterbank(sample_rate, n_fft, n_mels):
+    def hz_to_mel(hz):
+        return 2595 * np.log10(1 + hz / 700)
+
+    def mel_to_hz(mel):
+        return 700 * (10 ** (mel / 2595) - 1)
+
+    mel_points = np.linspace(hz_to_mel(0), hz_to_mel(sample_rate / 2), n_mels + 2)
+    bins = np.floor((n_fft + 1) * mel_to_hz(mel_points) / sample_rate).astype(int)
+    filters = np.zeros((n_mels, n_fft // 2 + 1), dtype=np.float32)
+    for i in range(1, n_mels + 1):
+        left, center, right = bins[i - 1], bins[i], bins[i + 1]
+        if center > left:
+            filters[i - 1, left:center] = (np.arange(left, center) - left) / (center - left)
+        if right > center:
+            filters[i - 1, center:right] = (right - np.arange(center, right)) / (right - center)
+    return filters
+
+
+class EnergyDetector:
+    # Fallback when no keyword model is configured: triggers on sustained
+    # speech-level energy above an adaptive noise floor.
+    def __init__(self, sample_rate, chunk_size, min_speech_ms=200, ratio=4.0, min_level=300):
+        self.blocks_needed = max(1, int(min_speech_ms / 1000 * sample_rate / chunk_size))
+        self.ratio = ratio
+        self.min_level = min_level
+        self.noise_floor = None
+        self.loud_blocks = 0
+
+    def process(self, samples):
+        level = float(np.sqrt(np.mean(samples.astype(np.float32) ** 2))) if len(samples) else 0.0
+        if self.noise_floor is None:
+            self.noise_floor = level
+        if level > max(self.noise_floor * self.ratio, self.min_level):
+            self.loud_blocks += 1
+        else:
+            self.loud_blocks = 0
+            self.noise_floor = 0.95 * self.noise_floor + 0.05 * level
+        return self.loud_blocks >= self.blocks_needed
+
+
+class OnnxKeywordDetector:
+    # Runs a keyword-spotting model on a sliding window of log-mel features.
+    # The model takes float32 input shaped [1, frames, mels] (10 ms hop,
+    # 25 ms window) and returns a keyword probability as its first output.
+    def __init__(self, model_path, sample_rate, threshold=0.5, n_mels=40, window_frames=100):
+        if onnxruntime is None:
+            raise RuntimeError("The onnxruntime package is not installed. Run 'pip install onnxruntime'.")
+        self.session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        shape = self.session.get_inputs()[0].shape
+        if len(shape) == 3 and isinstance(shape[1], int) and isinstance(shape[2], int):
+            window_frames, n_mels = shape[1], shape[2]
+        self.threshold = threshold
+        self.hop = sample_rate // 100
+        self.win = sample_rate * 25 // 1000
+        self.n_fft = 512
+        self.window = np.hanning(self.win).astype(np.float32)
+        self.filters = mel_filterbank(sample_rate, self.n_fft, n_mels)
+        self.features = deque(maxlen=window_frames)
+        self.samples = np.zeros(0, dtype=np.float32)
+
+    def process(self, samples):
+        self.samples = np.concatenate([self.samples, samples.astype(np.float32) / 32768])
+        frame_count = (len(self.samples) - self.win) // self.hop + 1
+        if frame_count <= 0:
+            return False
+        indices = np.arange(self.win)[None, :] + self.hop * np.arange(frame_count)[:, None]
+        frames = self.samples[indices] * self.window
+        spectrum = np.abs(np.fft.rfft(frames, n=self.n_fft)) ** 2
+        self.features.extend(np.log(spectrum @ self.filters.T + 1e-6))
+        self.samples = self.samples[frame_count * self.hop:]
+        if len(self.features) < self.features.maxlen:
+            return False
+        window = np.asarray(self.features, dtype=np.float32)[None, :, :]
+        score = float(np.ravel(self.session.run(None, {self.input_name: window})[0])[-1])
+        if score >= self.threshold:
+            self.features.clear()
+            return True
+        return False
+
+
+class WakeWordDetector:
+    def __init__(self, mode, sample_rate, chunk_size, model_path="", threshold=0.5, preroll_ms=1000):
+        self.mode = mode
+        preroll_blocks = max(1, int(preroll_ms / 1000 * sample_rate / chunk_size))
+        self.preroll = deque(maxlen=preroll_blocks)
+        if mode == "onnx":
+            self.detector = OnnxKeywordDetector(model_path, sample_rate, threshold)
+        else:
+            self.detector = EnergyDetector(sample_rate, chunk_size)
+        logging.info(f"Wake word detector ready ({mode}, {preroll_ms} ms pre-roll)")
+
+    def process(self, frame):
+        # Returns True on detection. Recent frames are kept so the audio just
+        # before the detection can be sent along with what follows.
+        self.preroll.append(frame)
+        return self.detector.process(np.frombuffer(frame, dtype=np.int16))
+
+    def take_preroll(self):
+        frames = list(self.preroll)
+        self.preroll.clear()
+        return frames